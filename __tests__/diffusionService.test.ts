@@ -0,0 +1,101 @@
+// @vitest-environment node
+import { EventEmitter } from 'node:events';
+import type { MockedFunction } from 'vitest';
+import { describe, beforeEach, it, expect, vi } from 'vitest';
+
+vi.mock('node:child_process', () => ({
+  spawn: vi.fn(),
+}));
+
+import { spawn } from 'node:child_process';
+import { DiffusionGenerationError, finalizeDraft, generateDraftImages } from '../services/diffusionService';
+
+const mockedSpawn = spawn as unknown as MockedFunction<(...args: unknown[]) => unknown>;
+
+// Fake runner process: records the JSON written to stdin and answers with `response` on stdout
+const respondWith = (response: unknown) => {
+  const requests: Record<string, unknown>[] = [];
+
+  mockedSpawn.mockImplementation(() => {
+    const child = new EventEmitter();
+    const stdout = new EventEmitter();
+    const stdin = {
+      write: (data: string) => {
+        requests.push(JSON.parse(data));
+      },
+      end: () => {
+        setImmediate(() => {
+          stdout.emit('data', Buffer.from(JSON.stringify(response)));
+          child.emit('close', 0);
+        });
+      },
+    };
+    return Object.assign(child, { stdout, stderr: new EventEmitter(), stdin });
+  });
+
+  return requests;
+};
+
+describe('diffusionService draft and finalize contract', () => {
+  beforeEach(() => {
+    mockedSpawn.mockReset();
+  });
+
+  it('returns draft images with the per-image seeds the runner reports', async () => {
+    const requests = respondWith({
+      success: true,
+      images: ['draft-a', 'draft-b'],
+      diagnostics: { tier: 'draft', seed: 41, seeds: [41, 42] },
+    });
+
+    const drafts = await generateDraftImages('Lluvia futurista en neón', '1:1');
+
+    expect(drafts).toEqual({ images: ['draft-a', 'draft-b'], seeds: [41, 42] });
+    expect(requests).toHaveLength(1);
+    expect(requests[0]).toMatchObject({
+      mode: 'txt2img',
+      prompt: 'Lluvia futurista en neón',
+      tier: 'draft',
+      num_images: 2,
+      width: 512,
+      height: 512,
+    });
+  });
+
+  it('rejects drafts whose seeds are missing or do not match the images', async () => {
+    respondWith({ success: true, images: ['draft-a', 'draft-b'], diagnostics: { tier: 'draft' } });
+    await expect(generateDraftImages('Bosque brumoso', '16:9')).rejects.toBeInstanceOf(DiffusionGenerationError);
+
+    respondWith({ success: true, images: ['draft-a', 'draft-b'], diagnostics: { tier: 'draft', seeds: [7] } });
+    await expect(generateDraftImages('Bosque brumoso', '16:9')).rejects.toThrow(
+      'Diffusion runner did not report the draft seeds.',
+    );
+  });
+
+  it('finalizes a draft from its own seed at full size', async () => {
+    const requests = respondWith({ success: true, images: ['final-image'] });
+
+    const image = await finalizeDraft('data:image/png;base64,draft-b', 'Lluvia futurista en neón', '16:9', 42, 0.7);
+
+    expect(image).toBe('final-image');
+    expect(requests[0]).toMatchObject({
+      mode: 'img2img',
+      prompt: 'Lluvia futurista en neón',
+      init_images: ['draft-b'],
+      seed: 42,
+      finalize: true,
+      num_images: 1,
+      strength: 0.6,
+      width: 1216,
+      height: 704,
+    });
+  });
+
+  it('surfaces runner validation errors when finalizing', async () => {
+    respondWith({ success: false, error: 'Width and height must be multiples of 8.', errorType: 'validation' });
+
+    await expect(finalizeDraft('draft-a', 'Bosque brumoso', '1:1', 3, 1)).rejects.toThrow(
+      'Invalid diffusion request: Width and height must be multiples of 8.',
+    );
+  });
+});
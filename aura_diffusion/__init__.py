@@ -0,0 +1,62 @@
+"""Pieces shared by the FastAPI backend (``backend/app.py``), the diffusion runner and the benchmark.
+
+Install the package with ``pip install -e .`` from the repository root (the requirements
+files do this). Nothing here reads the environment: each service has its own settings
+(``AURA_*`` and ``SD_*``) and passes the values in, and messages go to the
+``aura_diffusion`` loggers.
+"""
+
+from .benchmarking import peak_memory_mb, percentile, reset_peak_memory, summarize_timings
+from .caches import PromptEmbeddingCache, PromptEmbeddings, ResultCache
+from .cpu import apply_cpu_profile, cgroup_cpu_limit, configure_cpu, cpu_supports_bf16, inference_context
+from .encoding import DEFAULT_IMAGE_QUALITY, DEFAULT_PNG_COMPRESS_LEVEL, IMAGE_FORMATS, ImageEncoding, encode_image
+from .inference import (
+    DEFAULT_VAE_TILING_PIXELS,
+    VAE_MIN_TILE_SIZE,
+    OomRecovery,
+    decode_latents,
+    free_memory,
+    image_generators,
+    is_out_of_memory,
+)
+from .quantization import (
+    INT8_COMPONENTS,
+    load_int8_components,
+    load_quantized_int8,
+    quantize_dynamic_int8,
+    weights_revision,
+)
+from .store import ModelStore
+
+__all__ = [
+    "DEFAULT_IMAGE_QUALITY",
+    "DEFAULT_PNG_COMPRESS_LEVEL",
+    "DEFAULT_VAE_TILING_PIXELS",
+    "IMAGE_FORMATS",
+    "INT8_COMPONENTS",
+    "VAE_MIN_TILE_SIZE",
+    "ImageEncoding",
+    "ModelStore",
+    "OomRecovery",
+    "PromptEmbeddingCache",
+    "PromptEmbeddings",
+    "ResultCache",
+    "apply_cpu_profile",
+    "cgroup_cpu_limit",
+    "configure_cpu",
+    "cpu_supports_bf16",
+    "decode_latents",
+    "encode_image",
+    "free_memory",
+    "image_generators",
+    "inference_context",
+    "is_out_of_memory",
+    "load_int8_components",
+    "load_quantized_int8",
+    "peak_memory_mb",
+    "percentile",
+    "quantize_dynamic_int8",
+    "reset_peak_memory",
+    "summarize_timings",
+    "weights_revision",
+]
@@ -0,0 +1,52 @@
+"""Latency percentiles and peak-memory probes for the /benchmark endpoint and scripts/benchmark.py."""
+
+from __future__ import annotations
+
+import math
+import resource
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import torch
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Linearly interpolated percentile; ``fraction`` is in [0, 1]."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower, upper = math.floor(position), math.ceil(position)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_timings(values: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(values, 0.5), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "mean": round(sum(values) / len(values), 4),
+    }
+
+
+def reset_peak_memory(device: str) -> None:
+    try:
+        # Linux: "5" resets the VmHWM high-water mark of this process
+        Path("/proc/self/clear_refs").write_text("5")
+    except OSError:
+        pass
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+
+
+def peak_memory_mb(device: str) -> Dict[str, Optional[float]]:
+    """Peak resident memory since the last reset_peak_memory(), plus peak VRAM on CUDA."""
+    rss_mb = None
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                rss_mb = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if rss_mb is None:
+        # Lifetime peak in KiB on Linux (bytes on macOS); cannot be reset between configs
+        rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    vram_mb = torch.cuda.max_memory_allocated() / (1024 * 1024) if device == "cuda" else None
+    return {"peak_rss_mb": round(rss_mb, 1), "peak_vram_mb": round(vram_mb, 1) if vram_mb is not None else None}
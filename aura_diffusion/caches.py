@@ -0,0 +1,168 @@
+"""Result and prompt-embedding caches."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+
+class ResultCache:
+    """Two-tier cache of encoded image results keyed by a hash of the generation parameters.
+
+    The memory tier is an LRU bounded by total bytes. The optional disk tier stores one
+    directory of encoded image files per key and is evicted by TTL and then oldest-first once it
+    exceeds its byte budget. Disk hits are promoted back into memory.
+    """
+
+    def __init__(self, max_memory_bytes: int, directory: Optional[str], max_disk_bytes: int, ttl_seconds: int):
+        self._max_memory_bytes = max_memory_bytes
+        self._max_disk_bytes = max_disk_bytes
+        self._ttl = ttl_seconds
+        self._directory = Path(directory).expanduser() if directory else None
+        self._memory: "OrderedDict[str, Tuple[float, List[bytes]]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self._directory is not None:
+            self._directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(**params: Any) -> str:
+        canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return self._ttl > 0 and time.time() - created > self._ttl
+
+    def get(self, key: str) -> Optional[List[bytes]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._drop_memory(key)
+            images = self._read_disk(key)
+            if images is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._store_memory(key, images)
+            return images
+
+    def put(self, key: str, images: List[bytes]) -> None:
+        with self._lock:
+            self._store_memory(key, images)
+            self._write_disk(key, images)
+
+    def _drop_memory(self, key: str) -> None:
+        _created, images = self._memory.pop(key)
+        self._memory_bytes -= sum(len(image) for image in images)
+
+    def _store_memory(self, key: str, images: List[bytes]) -> None:
+        size = sum(len(image) for image in images)
+        if size > self._max_memory_bytes:
+            return
+        if key in self._memory:
+            self._drop_memory(key)
+        self._memory[key] = (time.time(), images)
+        self._memory_bytes += size
+        while self._memory_bytes > self._max_memory_bytes:
+            self._drop_memory(next(iter(self._memory)))
+
+    def _read_disk(self, key: str) -> Optional[List[bytes]]:
+        if self._directory is None:
+            return None
+        entry_dir = self._directory / key
+        if not entry_dir.is_dir():
+            return None
+        if self._expired(entry_dir.stat().st_mtime):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+        files = sorted(entry_dir.glob("*.img"), key=lambda path: int(path.stem))
+        return [path.read_bytes() for path in files] or None
+
+    def _write_disk(self, key: str, images: List[bytes]) -> None:
+        if self._directory is None:
+            return
+        tmp_dir = self._directory / f".{key}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        for index, data in enumerate(images):
+            (tmp_dir / f"{index}.img").write_bytes(data)
+        entry_dir = self._directory / key
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        tmp_dir.rename(entry_dir)
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for entry_dir in self._directory.iterdir():
+            if not entry_dir.is_dir() or entry_dir.name.startswith("."):
+                continue
+            mtime = entry_dir.stat().st_mtime
+            if self._expired(mtime):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            size = sum(path.stat().st_size for path in entry_dir.iterdir())
+            entries.append((mtime, size, entry_dir))
+        total = sum(size for _mtime, size, _path in entries)
+        for _mtime, size, entry_dir in sorted(entries):
+            if total <= self._max_disk_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk": str(self._directory) if self._directory else None,
+            }
+
+
+# Text-encoder output and, for SDXL-style pipelines, the pooled embedding
+PromptEmbeddings = Tuple[torch.Tensor, Optional[torch.Tensor]]
+
+
+class PromptEmbeddingCache:
+    """Bounded LRU of text-encoder outputs keyed by (model id, dtype, prompt text)."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str, str], PromptEmbeddings]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, key: Tuple[str, str, str], encode: Callable[[], PromptEmbeddings]) -> PromptEmbeddings:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        embeds = encode()
+        with self._lock:
+            self._entries[key] = embeds
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return embeds
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
@@ -0,0 +1,114 @@
+"""CPU threading, bf16 autocast and the CPU inference profile."""
+
+from __future__ import annotations
+
+import math
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import torch
+
+from .quantization import INT8_COMPONENTS, is_quantized, quantize_dynamic_int8
+
+
+def cgroup_cpu_limit() -> int:
+    """CPUs this process may use: the cgroup quota if one is set, otherwise its affinity mask."""
+    try:
+        available = len(os.sched_getaffinity(0))
+    except AttributeError:
+        available = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        raw_quota, raw_period = Path("/sys/fs/cgroup/cpu.max").read_text().split()
+        if raw_quota != "max":
+            quota = int(raw_quota) / int(raw_period)
+    except (OSError, ValueError):
+        try:
+            raw_quota = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read_text())
+            raw_period = int(Path("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read_text())
+            if raw_quota > 0:
+                quota = raw_quota / raw_period
+        except (OSError, ValueError):
+            pass
+    if quota is None:
+        return available
+    return max(1, min(available, math.ceil(quota)))
+
+
+def cpu_supports_bf16() -> bool:
+    try:
+        flags = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def configure_cpu(
+    threads: int, *, channels_last: bool, torch_compile: bool, compile_cache_dir: str, bf16: str
+) -> Dict[str, Any]:
+    """Set torch's CPU threading and return the profile reported in diagnostics.
+
+    ``threads`` of 0 derives the count from the cgroup CPU quota. ``bf16`` is "1", "0" or
+    "auto", which enables bf16 autocast when the CPU has native bf16 instructions.
+    """
+    threads = threads if threads > 0 else cgroup_cpu_limit()
+    torch.set_num_threads(threads)
+    try:
+        # Pipelines rarely run independent ops side by side; a couple of inter-op threads is enough
+        torch.set_num_interop_threads(max(1, min(2, threads // 4)))
+    except RuntimeError:
+        pass  # already fixed once inter-op work has started
+    if torch_compile:
+        # Inductor reads this on every compile; importing diffusers already filled in a /tmp default
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = compile_cache_dir
+    return {
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "channels_last": channels_last,
+        "torch_compile": torch_compile,
+        "bf16_autocast": bf16 == "1" or (bf16 == "auto" and cpu_supports_bf16()),
+    }
+
+
+@contextmanager
+def inference_context(bf16_autocast: bool):
+    """Wraps every model call: no autograd bookkeeping, plus bf16 autocast when asked for."""
+    with torch.inference_mode():
+        if bf16_autocast:
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                yield
+        else:
+            yield
+
+
+def apply_cpu_profile(
+    pipe,
+    model_id: str,
+    *,
+    channels_last: bool,
+    quantize: bool,
+    torch_compile: bool,
+    quantized_cache_dir: str,
+    revision: Optional[str] = None,
+) -> None:
+    """channels_last UNet and VAE, then either int8 linears or a compiled UNet.
+
+    Components already loaded from the int8 cache are left as they are.
+    """
+    if channels_last:
+        pipe.unet.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    if quantize:
+        for component in INT8_COMPONENTS:
+            module = getattr(pipe, component, None)
+            if module is not None and not is_quantized(module):
+                quantized = quantize_dynamic_int8(
+                    module, model_id, component, revision=revision, cache_dir=quantized_cache_dir
+                )
+                setattr(pipe, component, quantized)
+    elif torch_compile:
+        # Compiles lazily on the first call; later processes reuse the on-disk graph cache
+        pipe.unet.compile()
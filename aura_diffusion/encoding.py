@@ -0,0 +1,38 @@
+"""Output image encodings."""
+
+from __future__ import annotations
+
+import io
+from dataclasses import dataclass
+
+from PIL import Image
+
+# Output encodings: request format -> (PIL format, media type)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+}
+DEFAULT_IMAGE_QUALITY = 90
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+
+@dataclass(frozen=True)
+class ImageEncoding:
+    format: str = "png"
+    quality: int = DEFAULT_IMAGE_QUALITY
+    compress_level: int = DEFAULT_PNG_COMPRESS_LEVEL
+
+    @property
+    def media_type(self) -> str:
+        return IMAGE_FORMATS[self.format][1]
+
+
+def encode_image(image: Image.Image, encoding: ImageEncoding) -> bytes:
+    pil_format, _media_type = IMAGE_FORMATS[encoding.format]
+    buffered = io.BytesIO()
+    if encoding.format == "png":
+        image.save(buffered, format=pil_format, compress_level=encoding.compress_level)
+    else:
+        image.convert("RGB").save(buffered, format=pil_format, quality=encoding.quality)
+    return buffered.getvalue()
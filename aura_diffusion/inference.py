@@ -0,0 +1,177 @@
+"""Seeding, VAE decoding and out-of-memory recovery around pipeline calls."""
+
+from __future__ import annotations
+
+import gc
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# VAE decode switches to tiles at this many output pixels (inclusive)
+DEFAULT_VAE_TILING_PIXELS = 512 * 1024
+# Smallest tile (in pixels) the decode falls back to after repeated out-of-memory errors
+VAE_MIN_TILE_SIZE = 128
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    if isinstance(error, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(error).lower()
+    # CPU allocations fail with a plain RuntimeError
+    return "out of memory" in message or "can't allocate memory" in message or "alloc failed" in message
+
+
+def image_generators(seed: Optional[int], count: int) -> List[torch.Generator]:
+    """One CPU generator per output image (``seed + index``), so seeded images do not depend on batching."""
+    generators = []
+    for index in range(count):
+        generator = torch.Generator("cpu")
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed + index)
+        generators.append(generator)
+    return generators
+
+
+def free_memory() -> None:
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def decode_latents(
+    pipe, latents: torch.Tensor, *, batch: int = 1, tiling_pixels: int = DEFAULT_VAE_TILING_PIXELS
+) -> List[Image.Image]:
+    """VAE-decode ``batch`` images at a time, tiled from ``tiling_pixels`` output pixels up.
+
+    An out-of-memory error halves the decode batch, then switches to tiled decoding, then
+    halves the tile size down to VAE_MIN_TILE_SIZE before giving up.
+    """
+    vae = pipe.vae
+    height, width = (dim * pipe.vae_scale_factor for dim in latents.shape[-2:])
+    saved = (vae.use_tiling, vae.tile_sample_min_size, vae.tile_latent_min_size)
+    batch = max(1, batch)
+    tile = vae.tile_sample_min_size if width * height >= tiling_pixels else None
+    # The SDXL VAE overflows in fp16 and is configured to decode in fp32
+    upcast = vae.dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+    if upcast:
+        vae.to(torch.float32)
+    images: List[Image.Image] = []
+    try:
+        index = 0
+        while index < latents.shape[0]:
+            chunk = latents[index:index + batch]
+            if tile is None:
+                vae.disable_tiling()
+            else:
+                vae.enable_tiling()
+                vae.tile_sample_min_size = tile
+                vae.tile_latent_min_size = tile // pipe.vae_scale_factor
+            try:
+                with torch.no_grad():
+                    decoded = vae.decode(chunk.to(vae.dtype) / vae.config.scaling_factor, return_dict=False)[0]
+            except Exception as e:
+                if not is_out_of_memory(e):
+                    raise
+                free_memory()
+                if batch > 1:
+                    batch //= 2
+                elif tile is None:
+                    tile = vae.tile_sample_min_size
+                elif tile // 2 >= VAE_MIN_TILE_SIZE:
+                    tile //= 2
+                else:
+                    raise
+                logger.warning(f"VAE decode ran out of memory at {width}x{height}; retrying with batch {batch}, tile {tile}")
+                continue
+            images.extend(pipe.image_processor.postprocess(decoded, output_type="pil"))
+            index += chunk.shape[0]
+    finally:
+        vae.use_tiling, vae.tile_sample_min_size, vae.tile_latent_min_size = saved
+        if upcast:
+            vae.to(torch.float16)
+    return images
+
+
+class OomRecovery:
+    """Fallback ladder for out-of-memory errors during denoising.
+
+    Each OOM frees cached memory and retries one step cheaper: halve the images per
+    pipeline call (down to sequential single-image runs), then enable attention slicing,
+    then (on CUDA) model CPU offload. Slicing and offload change the shared pipeline, so
+    they only last for the call that needed them (see ``ladder()``). The images-per-call
+    that finally worked is remembered per key, ending in (width, height), so later
+    requests start from it.
+    """
+
+    def __init__(self):
+        self._safe_batch: Dict[Tuple[Any, ...], int] = {}
+        self._lock = threading.Lock()
+        self.recoveries = 0
+
+    def safe_batch(self, key: Tuple[Any, ...]) -> Optional[int]:
+        with self._lock:
+            return self._safe_batch.get(key)
+
+    def record(self, key: Tuple[Any, ...], images_per_call: int) -> None:
+        with self._lock:
+            self._safe_batch[key] = min(images_per_call, self._safe_batch.get(key, images_per_call))
+            self.recoveries += 1
+
+    @contextmanager
+    def ladder(self, pipe):
+        """Yields ``degrade(limit)`` for one generation call, undoing its pipeline-wide rungs on exit.
+
+        ``degrade`` returns the next rung as (images per call, description), or None when the
+        ladder is exhausted. The caller must hold the pipeline for the whole block.
+        """
+        taken: List[str] = []
+        # enable_attention_slicing() swaps the attention processors of every component that has them
+        processors = {
+            name: dict(module.attn_processors)
+            for name, module in pipe.components.items()
+            if hasattr(module, "attn_processors") and hasattr(module, "set_attn_processor")
+        }
+        device = pipe.device
+
+        def degrade(limit: int) -> Optional[Tuple[int, str]]:
+            if limit > 1:
+                limit //= 2
+                return limit, f"split into runs of {limit} image(s)"
+            sliced = any("Sliced" in type(processor).__name__ for processor in pipe.unet.attn_processors.values())
+            if "attention slicing" not in taken and not sliced:
+                taken.append("attention slicing")
+                pipe.enable_attention_slicing()
+                return limit, "attention slicing"
+            if device.type == "cuda" and "model cpu offload" not in taken:
+                taken.append("model cpu offload")
+                pipe.enable_model_cpu_offload()
+                return limit, "model cpu offload"
+            return None
+
+        try:
+            yield degrade
+        finally:
+            if "model cpu offload" in taken:
+                pipe.remove_all_hooks()
+                pipe.to(device)
+            if "attention slicing" in taken:
+                for name, saved in processors.items():
+                    pipe.components[name].set_attn_processor(saved)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "recoveries": self.recoveries,
+                "safe_batch_sizes": {
+                    f"{'/'.join(str(part) for part in key[:-2])}@{key[-2] or 'default'}x{key[-1] or 'default'}": size
+                    for key, size in self._safe_batch.items()
+                },
+            }
@@ -0,0 +1,146 @@
+"""Dynamic int8 quantization of pipeline components, with an on-disk state_dict cache."""
+
+from __future__ import annotations
+
+import hashlib
+import importlib
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+import torch
+
+if TYPE_CHECKING:
+    from .store import ModelStore
+
+logger = logging.getLogger(__name__)
+
+# Pipeline components whose linear layers precision "int8" quantizes
+INT8_COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+
+def weights_revision(model_id: str, source: str, store: "ModelStore") -> Optional[str]:
+    """Identifies the exact weights ``source`` loads, or None while that is unknown.
+
+    A stored copy is identified by its manifest checksums, a hub download by its snapshot
+    commit and any other local directory by the sizes and mtimes of its files.
+    """
+    revision = store.revision(model_id)
+    if revision is not None:
+        return revision
+    root = Path(source)
+    if root.is_dir():
+        digest = hashlib.sha256()
+        for path in sorted(root.rglob("*")):
+            relative = path.relative_to(root)
+            if path.is_file() and not any(part.startswith(".") for part in relative.parts):
+                stat = path.stat()
+                digest.update(f"{relative}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+        return digest.hexdigest()
+    from huggingface_hub import try_to_load_from_cache
+
+    for filename in ("model_index.json", "config.json"):
+        cached = try_to_load_from_cache(source, filename)
+        if isinstance(cached, str):
+            # <cache>/models--<org>--<name>/snapshots/<commit>/<filename>
+            return Path(cached).parent.name
+    return None
+
+
+def _int8_cache_path(cache_dir: str, revision: str, component: str) -> Path:
+    key = hashlib.sha256(f"{revision}:{component}:{torch.__version__}".encode("utf-8")).hexdigest()[:24]
+    return Path(cache_dir) / f"{key}.state.pt"
+
+
+def _swap_quantized_linears(module: torch.nn.Module) -> None:
+    """Replace every nn.Linear with an empty dynamically quantized one, as quantize_dynamic would."""
+    for name, child in module.named_children():
+        if type(child) is torch.nn.Linear:
+            quantized = torch.ao.nn.quantized.dynamic.Linear(
+                child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8
+            )
+            setattr(module, name, quantized)
+        else:
+            _swap_quantized_linears(child)
+
+
+def load_quantized_int8(
+    build: Callable[[], torch.nn.Module], revision: str, component: str, cache_dir: str
+) -> Optional[torch.nn.Module]:
+    """The cached int8 module for these weights, or None when there is none yet.
+
+    ``build`` constructs the module from its config under accelerate's ``init_empty_weights``,
+    so no fp32 weights are read or allocated before the cached state_dict is assigned.
+    """
+    path = _int8_cache_path(cache_dir, revision, component)
+    if not path.exists():
+        return None
+    try:
+        from accelerate import init_empty_weights
+
+        state = torch.load(path, weights_only=True)
+        with init_empty_weights():
+            module = build()
+        _swap_quantized_linears(module)
+        module.load_state_dict(state, strict=True, assign=True)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable quantized cache {path}: {e}")
+        return None
+    return module.eval()
+
+
+def quantize_dynamic_int8(
+    module: torch.nn.Module, model_id: str, component: str, *, revision: Optional[str], cache_dir: str
+) -> torch.nn.Module:
+    """Dynamic int8 quantization of every nn.Linear, in place.
+
+    The state_dict is cached for load_quantized_int8() when the weights ``revision`` is known.
+    """
+    logger.info(f"Quantizing {component} of {model_id} to int8")
+    quantized = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if revision is None:
+        return quantized
+    path = _int8_cache_path(cache_dir, revision, component)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        torch.save(quantized.state_dict(), tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to cache quantized {component}: {e}")
+    return quantized
+
+
+def load_int8_components(
+    source: str, revision: Optional[str], cache_dir: str, load_kwargs: Dict[str, Any]
+) -> Dict[str, torch.nn.Module]:
+    """Cached int8 components of a pipeline, keyed by name, to pass to ``from_pretrained``.
+
+    Components returned here are not loaded from ``source`` at all.
+    """
+    if revision is None:
+        return {}
+    from diffusers import DiffusionPipeline
+
+    config_kwargs = {"local_files_only": True} if load_kwargs.get("local_files_only") else {}
+    index = DiffusionPipeline.load_config(source, **config_kwargs)
+    components: Dict[str, torch.nn.Module] = {}
+    for component in INT8_COMPONENTS:
+        library, class_name = index.get(component) or (None, None)
+        if library is None:
+            continue
+        cls = getattr(importlib.import_module(library), class_name)
+        if library == "diffusers":
+            config = cls.load_config(source, subfolder=component, **config_kwargs)
+            module = load_quantized_int8(lambda: cls.from_config(config), revision, component, cache_dir)
+        else:
+            config = cls.config_class.from_pretrained(source, subfolder=component, **config_kwargs)
+            module = load_quantized_int8(lambda: cls(config), revision, component, cache_dir)
+        if module is not None:
+            components[component] = module
+    return components
+
+
+def is_quantized(module: torch.nn.Module) -> bool:
+    return any(isinstance(child, torch.ao.nn.quantized.dynamic.Linear) for child in module.modules())
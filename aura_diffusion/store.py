@@ -0,0 +1,169 @@
+"""Local model store described by the manifest scripts/download_models.py writes."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    """Resolves model ids to the local copies recorded in the download manifest.
+
+    ``resolve()`` checks file sizes against the manifest (cheap) and returns the local
+    directory plus ``from_pretrained`` arguments: offline, safetensors only, and the
+    stored weight variant matching the dtype, so loads memory-map the files and worker
+    processes share their page-cache pages. SHA-256 checksums are verified before a
+    model's files are first handed out, so corrupt weights never reach a load; verified
+    files are remembered in ``.verified.json`` by size and mtime so restarts (and other
+    worker processes) skip the hashing. A model with a bad checksum is refused until its
+    files change on disk, i.e. it is downloaded again.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+    VERIFIED_NAME = ".verified.json"
+    DTYPE_VARIANTS = {torch.float16: "fp16", torch.bfloat16: "bf16"}
+
+    def __init__(self, root: str):
+        self._root = Path(root)
+        self._lock = threading.Lock()
+        self._manifest: Dict[str, Any] = {}
+        self._manifest_mtime: Optional[int] = None
+        self._state: Dict[str, str] = {}
+        self._corrupt: Dict[str, str] = {}
+        # (name, size, mtime) of the files each model was last checked with
+        self._checked: Dict[str, Tuple[Tuple[str, int, int], ...]] = {}
+        # Held while hashing, so concurrent first loads wait for one verification
+        self._verify_lock = threading.Lock()
+
+    def _models(self) -> Dict[str, Any]:
+        path = self._root / self.MANIFEST_NAME
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            return {}
+        with self._lock:
+            if mtime != self._manifest_mtime:
+                try:
+                    self._manifest = json.loads(path.read_text()).get("models", {})
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Ignoring unreadable model store manifest {path}: {e}")
+                    self._manifest = {}
+                self._manifest_mtime = mtime
+            return self._manifest
+
+    def resolve(self, model_id: str, dtype: torch.dtype) -> Tuple[str, Dict[str, Any]]:
+        entry = self._models().get(model_id)
+        if entry is None:
+            return model_id, {}
+        model_dir = self._root / entry["path"]
+        signature = []
+        for name, info in entry["files"].items():
+            try:
+                stat = (model_dir / name).stat()
+            except OSError:
+                raise RuntimeError(f"stored copy is missing {name}; download it again")
+            if stat.st_size != info["size"]:
+                raise RuntimeError(
+                    f"stored copy of {name} is {stat.st_size} bytes, expected {info['size']}; download it again"
+                )
+            signature.append((name, stat.st_size, stat.st_mtime_ns))
+        self._check(model_id, model_dir, entry["files"], tuple(signature))
+        kwargs: Dict[str, Any] = {"local_files_only": True}
+        if any("dtypes" in info for info in entry["files"].values()):
+            kwargs["use_safetensors"] = True
+        variant = self.DTYPE_VARIANTS.get(dtype)
+        if variant in entry.get("variants", []):
+            kwargs["variant"] = variant
+        logger.info(f"Resolved {model_id} to {model_dir} ({kwargs.get('variant', 'default')} weights)")
+        return str(model_dir), kwargs
+
+    def revision(self, model_id: str) -> Optional[str]:
+        """Digest of a stored model's manifest checksums; None for models not in the store."""
+        entry = self._models().get(model_id)
+        if entry is None:
+            return None
+        checksums = sorted((name, info["sha256"]) for name, info in entry["files"].items())
+        return hashlib.sha256(json.dumps(checksums).encode("utf-8")).hexdigest()
+
+    def _read_verified(self) -> Dict[str, Any]:
+        try:
+            return json.loads((self._root / self.VERIFIED_NAME).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _check(
+        self, model_id: str, model_dir: Path, files: Dict[str, Any], signature: Tuple[Tuple[str, int, int], ...]
+    ) -> None:
+        """Verify a model's checksums unless these exact files were already checked; raises if one is bad."""
+        with self._verify_lock:
+            with self._lock:
+                checked = self._checked.get(model_id) == signature
+                if not checked:
+                    self._state[model_id] = "verifying"
+            if not checked:
+                corrupt = self._verify(model_id, model_dir, files)
+                with self._lock:
+                    self._checked[model_id] = signature
+                    self._state[model_id] = "verified" if corrupt is None else "corrupt"
+                    if corrupt is None:
+                        self._corrupt.pop(model_id, None)
+                    else:
+                        self._corrupt[model_id] = corrupt
+        with self._lock:
+            corrupt = self._corrupt.get(model_id)
+        if corrupt is not None:
+            raise RuntimeError(f"stored copy failed checksum verification ({corrupt}); download it again")
+
+    def _verify(self, model_id: str, model_dir: Path, files: Dict[str, Any]) -> Optional[str]:
+        """Hash every file not yet recorded in ``.verified.json``; returns the first bad file name."""
+        started = time.perf_counter()
+        for name, info in files.items():
+            path = model_dir / name
+            key = f"{model_dir.name}/{name}"
+            try:
+                stat = path.stat()
+                # Re-read per file: other worker processes may have verified it meanwhile
+                known = self._read_verified().get(key)
+                if known == [stat.st_size, stat.st_mtime_ns, info["sha256"]]:
+                    continue
+                digest = hashlib.sha256()
+                with path.open("rb") as handle:
+                    for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                        digest.update(chunk)
+            except OSError as e:
+                digest = None
+                logger.error(f"Could not verify {key}: {e}")
+            if digest is None or digest.hexdigest() != info["sha256"]:
+                logger.error(f"Model store file {key} does not match its manifest checksum; refusing {model_id}")
+                return name
+            verified = self._read_verified()
+            verified[key] = [stat.st_size, stat.st_mtime_ns, info["sha256"]]
+            tmp = self._root / f"{self.VERIFIED_NAME}.{os.getpid()}.tmp"
+            try:
+                tmp.write_text(json.dumps(verified))
+                os.replace(tmp, self._root / self.VERIFIED_NAME)
+            except OSError as e:
+                logger.warning(f"Failed to record verified checksums: {e}")
+        logger.info(f"Verified {model_id} checksums in {time.perf_counter() - started:.1f} seconds")
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        models = self._models()
+        with self._lock:
+            return {
+                "dir": str(self._root),
+                "models": {
+                    model_id: {"variants": entry.get("variants", []), "state": self._state.get(model_id, "unverified")}
+                    for model_id, entry in models.items()
+                },
+            }
@@ -15,91 +15,2079 @@ EXPECTED PERFORMANCE:
 - Quality: Acceptable with aggressive optimizations
 """
 
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Any, Dict
-from diffusers import StableDiffusionPipeline
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from diffusers import AutoPipelineForImage2Image, AutoPipelineForText2Image, EulerDiscreteScheduler
 from transformers import BlipProcessor, BlipForConditionalGeneration
 import torch
 from PIL import Image
+import asyncio
 import base64
+import gc
+import hashlib
 import io
+import json
+import math
+import os
+import multiprocessing.connection
+import pickle
+import queue
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import weakref
 import numpy as np
 import logging
 
+# Helpers shared with scripts/diffusion_runner.py (pip install -e . at the repository root)
+from aura_diffusion import (
+    DEFAULT_IMAGE_QUALITY,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_VAE_TILING_PIXELS,
+    IMAGE_FORMATS,
+    ImageEncoding,
+    ModelStore,
+    OomRecovery,
+    PromptEmbeddingCache,
+    PromptEmbeddings,
+    ResultCache,
+    apply_cpu_profile,
+    cgroup_cpu_limit,
+    configure_cpu,
+    decode_latents,
+    encode_image,
+    free_memory,
+    image_generators,
+    inference_context,
+    is_out_of_memory,
+    load_int8_components,
+    load_quantized_int8,
+    peak_memory_mb,
+    quantize_dynamic_int8,
+    reset_peak_memory,
+    summarize_timings,
+    weights_revision,
+)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI()
+
+# Optimized configuration for RTX 3050 4GB
+NUM_IMAGES = 2
+OPTIMIZED_STEPS = 15  # Further reduced for speed (from 20)
+OPTIMIZED_GUIDANCE_SCALE = 7  # Lower for faster generation
+SD_MODEL_ID = "CompVis/stable-diffusion-v1-4"
+SD_SCHEDULER_NAME = "EulerDiscreteScheduler"
+BLIP_MODEL_ID = "Salesforce/blip-image-captioning-base"
+
+# Text-to-image model ids clients may select with the "model" field (first one is the default)
+AVAILABLE_MODELS = [m.strip() for m in os.environ.get("AURA_MODELS", SD_MODEL_ID).split(",") if m.strip()]
+DEFAULT_MODEL_ID = AVAILABLE_MODELS[0]
+# Models loaded in the background at startup; everything else loads on first use
+PRELOAD_MODELS = [m.strip() for m in os.environ.get("AURA_PRELOAD_MODELS", DEFAULT_MODEL_ID).split(",") if m.strip()]
+# Warm-up before /ready reports ready: a short generation per preloaded model and resolution
+# bucket plus one BLIP caption, so the first real request does not pay for kernel selection,
+# allocator growth and lazy initialization ("0" only loads the preloaded models)
+WARMUP_ENABLED = os.environ.get("AURA_WARMUP", "1") == "1"
+# Aspect ratios whose resolutions are warmed up ("all" = every entry of ASPECT_RATIO_DIMENSIONS)
+WARMUP_ASPECT_RATIOS = [r.strip() for r in os.environ.get("AURA_WARMUP_ASPECT_RATIOS", "1:1").split(",") if r.strip()]
+# Kernels are picked per tensor shape, so a couple of steps warm up as much as a full schedule
+WARMUP_STEPS = int(os.environ.get("AURA_WARMUP_STEPS", "2"))
+WARMUP_CAPTION = os.environ.get("AURA_WARMUP_CAPTION", "1") == "1"
+# Idle models are evicted least-recently-used first beyond this budget (0 = unlimited)
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("AURA_MODEL_MEMORY_BUDGET_MB", "0"))
+# Retry-After sent when a model failed to load (e.g. the hub was unreachable)
+MODEL_LOAD_RETRY_AFTER = 30
+# Local model store written by scripts/download_models.py; ids listed in its manifest load
+# from disk (memory-mapped safetensors, no network), everything else from the hub
+MODEL_STORE_DIR = os.environ.get("AURA_MODEL_STORE_DIR", str(Path(__file__).resolve().parent.parent / "models"))
+
+# Few-step distilled model behind tier "draft" (empty = the requested model at draft settings)
+DRAFT_MODEL_ID = os.environ.get("AURA_DRAFT_MODEL", "stabilityai/sd-turbo")
+# Draft steps and guidance; guidance <= 1 skips classifier-free guidance (one UNet pass per step)
+DRAFT_STEPS = int(os.environ.get("AURA_DRAFT_STEPS", "4"))
+DRAFT_GUIDANCE_SCALE = float(os.environ.get("AURA_DRAFT_GUIDANCE_SCALE", "0"))
+# Share of the full-quality schedule /finalize re-runs on top of the chosen draft
+FINALIZE_STRENGTH = float(os.environ.get("AURA_FINALIZE_STRENGTH", "0.6"))
+GENERATION_TIERS = ("full", "draft")
+
+# Map aspect ratio to SD dimensions
+ASPECT_RATIO_DIMENSIONS = {
+    "1:1": (512, 512),
+    "9:16": (512, 912),
+    "16:9": (912, 512),
+    "3:4": (512, 680),
+    "4:3": (680, 512),
+    "3:2": (768, 512),
+    "2:3": (512, 768),
+    "5:4": (640, 512),
+    "4:5": (512, 640),
+    "21:9": (1152, 512),
+    "Auto": (512, 512),
+}
+
+# Output encodings (IMAGE_FORMATS); base64-in-JSON PNG stays the default transport
+PNG_COMPRESS_LEVEL = int(os.environ.get("AURA_PNG_COMPRESS_LEVEL", str(DEFAULT_PNG_COMPRESS_LEVEL)))
+
+# Streaming: cheap latent preview every N denoising steps (0 disables previews)
+PREVIEW_INTERVAL = int(os.environ.get("AURA_PREVIEW_INTERVAL", "5"))
+# Linear approximation of the SD v1 VAE decoder, latent channel -> RGB
+LATENT_RGB_FACTORS = [
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+]
+
+# Micro-batching: requests sharing a bucket within this window share one pipeline call
+BATCH_WINDOW_MS = float(os.environ.get("AURA_BATCH_WINDOW_MS", "50"))
+# Upper bound on images per pipeline call; 0 derives it from available memory
+MAX_BATCH_IMAGES = int(os.environ.get("AURA_MAX_BATCH_IMAGES", "0"))
+# Rough activation footprint of one 512x512 image through UNet + VAE decode
+BATCH_BYTES_PER_IMAGE = {"cuda": 768 * 1024 ** 2, "cpu": 1536 * 1024 ** 2}
+BATCH_REFERENCE_PIXELS = 512 * 512
+
+# Inference runs on a dedicated pool so the event loop keeps serving /health
+INFERENCE_WORKERS = int(os.environ.get("AURA_INFERENCE_WORKERS", "1"))
+# Requests admitted (queued or running) before new ones are rejected with 503
+MAX_QUEUE_DEPTH = int(os.environ.get("AURA_MAX_QUEUE_DEPTH", "8"))
+# Inference worker processes, each pinned to its own slice of the CPUs (and one GPU when there
+# are several) with its own warm models; 0 runs inference on threads of the HTTP process
+WORKER_PROCESSES = int(os.environ.get("AURA_WORKER_PROCESSES", "0"))
+# A crashed worker is restarted after this delay, doubled for every further crash before it
+# reports ready again, up to WORKER_RESTART_MAX_BACKOFF_SECONDS
+WORKER_RESTART_BACKOFF_SECONDS = float(os.environ.get("AURA_WORKER_RESTART_BACKOFF_SECONDS", "1"))
+WORKER_RESTART_MAX_BACKOFF_SECONDS = float(os.environ.get("AURA_WORKER_RESTART_MAX_BACKOFF_SECONDS", "60"))
+# Consecutive crashes after which a worker is left down
+WORKER_MAX_RESTARTS = int(os.environ.get("AURA_WORKER_MAX_RESTARTS", "5"))
+# Set by the pool in every worker process it starts
+WORKER_INDEX = os.environ.get("AURA_WORKER_INDEX")
+
+# Opt-in cache of encoded results for seeded (deterministic) requests
+RESULT_CACHE_ENABLED = os.environ.get("AURA_RESULT_CACHE", "0") == "1"
+RESULT_CACHE_MEMORY_MB = int(os.environ.get("AURA_RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DIR = os.environ.get("AURA_RESULT_CACHE_DIR")  # enables the on-disk tier
+RESULT_CACHE_DISK_MB = int(os.environ.get("AURA_RESULT_CACHE_DISK_MB", "2048"))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("AURA_RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Text-encoder outputs kept per (model, dtype, prompt); 0 disables the cache
+PROMPT_CACHE_SIZE = int(os.environ.get("AURA_PROMPT_CACHE_SIZE", "256"))
+# BLIP captions remembered per image content hash; 0 disables the cache
+CAPTION_CACHE_SIZE = int(os.environ.get("AURA_CAPTION_CACHE_SIZE", "512"))
+BLIP_MAX_LENGTH = 50
+# Final latents kept per generated image so /refine can start from a handle (0 disables)
+LATENT_STORE_SIZE = int(os.environ.get("AURA_LATENT_STORE_SIZE", "256"))
+# img2img strength of a handle refine; 0.5 re-runs about half of the generation's steps
+LATENT_REFINE_STRENGTH = float(os.environ.get("AURA_LATENT_REFINE_STRENGTH", "0.5"))
+
+# Finished results kept for replay to retries carrying the same Idempotency-Key
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("AURA_IDEMPOTENCY_TTL_SECONDS", "120"))
+IDEMPOTENCY_MAX_ENTRIES = 64
+
+# Asynchronous jobs: SQLite records and result files survive restarts under this directory
+JOBS_DIR = os.environ.get("AURA_JOBS_DIR", str(Path.home() / ".cache" / "aura-reflect" / "jobs"))
+# Finished jobs (and their images) are deleted this long after completion
+JOB_RETENTION_SECONDS = int(os.environ.get("AURA_JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+# VAE decode: images decoded per VAE call, and tiled decoding from this many output pixels up
+VAE_DECODE_BATCH = int(os.environ.get("AURA_VAE_DECODE_BATCH", "1"))
+VAE_TILING_PIXELS = int(os.environ.get("AURA_VAE_TILING_PIXELS", str(DEFAULT_VAE_TILING_PIXELS)))
+
+# CPU performance profile (only applied when no GPU is available)
+CPU_CHANNELS_LAST = os.environ.get("AURA_CPU_CHANNELS_LAST", "1") == "1"
+# torch.compile the UNet; compiled graphs persist in AURA_TORCH_COMPILE_CACHE_DIR across restarts
+CPU_TORCH_COMPILE = os.environ.get("AURA_TORCH_COMPILE", "0") == "1"
+TORCH_COMPILE_CACHE_DIR = os.environ.get(
+    "AURA_TORCH_COMPILE_CACHE_DIR", str(Path.home() / ".cache" / "aura-reflect" / "torch-compile")
+)
+# bf16 autocast: "auto" enables it when the CPU has native bf16 instructions
+CPU_BF16 = os.environ.get("AURA_CPU_BF16", "auto").lower()
+# Intra-op threads; 0 derives them from the cgroup CPU quota
+CPU_THREADS = int(os.environ.get("AURA_CPU_THREADS", "0"))
+# "int8" dynamically quantizes the linear layers of the UNet, text encoders and BLIP (CPU only)
+PRECISION = os.environ.get("AURA_PRECISION", "auto").lower()
+QUANTIZED_CACHE_DIR = os.environ.get(
+    "AURA_QUANTIZED_CACHE_DIR", str(Path.home() / ".cache" / "aura-reflect" / "int8")
+)
+
+# Upper bounds (seconds) of the /metrics latency histogram buckets; CPU generations run for minutes
+METRICS_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 300)
+
+# Add CORS middleware
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:8082", "http://127.0.0.1:8082"],  # Allow frontend origin
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Models are loaded lazily through the registry below
+device = "cuda" if torch.cuda.is_available() else "cpu"
+# Enable mixed precision for better performance on RTX 3050
+torch_dtype = torch.float16 if device == "cuda" else torch.float32
+quantize_int8 = PRECISION == "int8" and device == "cpu"
+if PRECISION == "int8" and not quantize_int8:
+    logger.warning("AURA_PRECISION=int8 is only supported on the CPU; using fp16 on the GPU")
+
+
+def _configure_cpu_profile() -> Dict[str, Any]:
+    profile = configure_cpu(
+        CPU_THREADS,
+        channels_last=CPU_CHANNELS_LAST,
+        torch_compile=CPU_TORCH_COMPILE,
+        compile_cache_dir=TORCH_COMPILE_CACHE_DIR,
+        bf16=CPU_BF16,
+    )
+    # Quantized linears take float32 activations, so int8 models run without bf16 autocast
+    profile["bf16_autocast"] = profile["bf16_autocast"] and not quantize_int8
+    profile["int8"] = quantize_int8
+    return profile
+
+
+cpu_profile = _configure_cpu_profile() if device == "cpu" else None
+
+
+def _inference_context():
+    """Wraps every model call: no autograd bookkeeping, plus bf16 autocast on capable CPUs."""
+    return inference_context(cpu_profile is not None and cpu_profile["bf16_autocast"])
+
+
+def _apply_cpu_profile(pipe, model_id: str, revision: Optional[str]) -> None:
+    apply_cpu_profile(
+        pipe,
+        model_id,
+        channels_last=CPU_CHANNELS_LAST,
+        quantize=quantize_int8,
+        torch_compile=CPU_TORCH_COMPILE,
+        quantized_cache_dir=QUANTIZED_CACHE_DIR,
+        revision=revision,
+    )
+
+
+def _load_text2img_pipeline(model_id: str):
+    source, store_kwargs = model_store.resolve(model_id, torch_dtype)
+    revision = None
+    quantized: Dict[str, Any] = {}
+    if quantize_int8:
+        # Components found in the int8 cache are never loaded in fp32
+        revision = weights_revision(model_id, source, model_store)
+        quantized = load_int8_components(source, revision, QUANTIZED_CACHE_DIR, store_kwargs)
+    pipe = AutoPipelineForText2Image.from_pretrained(
+        source,
+        torch_dtype=torch_dtype,  # Use torch_dtype for StableDiffusionPipeline
+        safety_checker=None,  # Disable for speed (add back if needed)
+        requires_safety_checker=False,
+        low_cpu_mem_usage=True,  # Enable memory optimization
+        **store_kwargs,
+        **quantized,
+    ).to(device)
+
+    # Optimize scheduler for faster generation
+    pipe.scheduler = EulerDiscreteScheduler.from_config(pipe.scheduler.config)
+
+    # Additional optimizations for CPU mode
+    if device == "cpu":
+        logger.info(f"Running in CPU mode - applying CPU profile {cpu_profile}")
+        if quantize_int8 and revision is None:
+            # A first hub download only has a snapshot commit once from_pretrained has fetched it
+            revision = weights_revision(model_id, source, model_store)
+        _apply_cpu_profile(pipe, model_id, revision)
+
+    # Enable memory optimizations
+    if device == "cuda":
+        pipe.enable_attention_slicing()
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+        except ImportError:
+            pass  # xformers not available, continue without it
+    return pipe
+
+
+def _load_blip():
+    source, store_kwargs = model_store.resolve(BLIP_MODEL_ID, torch_dtype)
+    processor = BlipProcessor.from_pretrained(source)
+    model = None
+    revision = weights_revision(BLIP_MODEL_ID, source, model_store) if quantize_int8 else None
+    if revision is not None:
+        config_kwargs = {"local_files_only": True} if store_kwargs.get("local_files_only") else {}
+        config = BlipForConditionalGeneration.config_class.from_pretrained(source, **config_kwargs)
+        model = load_quantized_int8(lambda: BlipForConditionalGeneration(config), revision, "blip", QUANTIZED_CACHE_DIR)
+    if model is None:
+        model = BlipForConditionalGeneration.from_pretrained(
+            source,
+            torch_dtype=torch_dtype,
+            **store_kwargs,
+        ).to(device)
+        if quantize_int8:
+            revision = revision or weights_revision(BLIP_MODEL_ID, source, model_store)
+            model = quantize_dynamic_int8(
+                model, BLIP_MODEL_ID, "blip", revision=revision, cache_dir=QUANTIZED_CACHE_DIR
+            )
+    return processor, model
+
+
+def _model_bytes(model: Any) -> int:
+    """Parameter and buffer bytes of every torch module reachable from a loaded model."""
+    if isinstance(model, torch.nn.Module):
+        modules = [model]
+    elif isinstance(model, (tuple, list)):
+        return sum(_model_bytes(part) for part in model)
+    else:
+        components = getattr(model, "components", None) or {}
+        modules = [component for component in components.values() if isinstance(component, torch.nn.Module)]
+    total = 0
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class MetricsRegistry:
+    """In-process latency histograms rendered in the Prometheus text exposition format.
+
+    Histograms are observed from the event loop and the inference threads alike, so every
+    update takes the lock. Counters and gauges that already live elsewhere (cache hits,
+    queue depth) are not duplicated here; ``render()`` takes them as ``extra`` samples.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...], descriptions: Dict[str, str]):
+        self._buckets = tuple(sorted(buckets))
+        self._descriptions = descriptions
+        # name -> labels -> [cumulative bucket counts, sum, count]
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], List[Any]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).get(key)
+            if series is None:
+                series = self._histograms[name][key] = [[0] * len(self._buckets), 0.0, 0]
+            for index, bound in enumerate(self._buckets):
+                if seconds <= bound:
+                    series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self, extra: List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]] = ()) -> str:
+        """Exposition text; ``extra`` holds (name, type, help, [(labels, value)]) families."""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in self._histograms.items():
+                lines.append(f"# HELP {name} {self._descriptions.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, (counts, total, count) in series.items():
+                    for bound, bucket_count in zip(self._buckets, counts):
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', repr(float(bound))),))} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        for name, kind, help_text, samples in extra:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(
+    METRICS_BUCKETS,
+    {
+        "aura_request_duration_seconds": "Time until the response starts, per route and status.",
+        "aura_stage_duration_seconds": "Time spent per request stage (a batched pipeline run counts once).",
+        "aura_denoise_step_seconds": "Wall time of individual denoising steps.",
+        "aura_model_load_seconds": "Time to load a model into memory.",
+    },
+)
+
+
+class StageTimer:
+    """Seconds spent in each stage of one request, or of one batched pipeline run.
+
+    Stages are observed in ``aura_stage_duration_seconds`` as they finish and sent back to
+    the client as a ``Server-Timing`` header. Stages copied from a shared batch run are
+    merged without being observed again.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float, observe: bool = True) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if observe:
+            metrics.observe("aura_stage_duration_seconds", seconds, stage=name)
+
+    def merge(self, stages: Dict[str, float]) -> None:
+        for name, seconds in stages.items():
+            self.record(name, seconds, observe=False)
+
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+def _observe_stages(stages: Dict[str, float]) -> None:
+    """Observe stage timings measured in a worker process, whose own histograms are never scraped."""
+    for name, seconds in stages.items():
+        metrics.observe("aura_stage_duration_seconds", seconds, stage=name)
+
+
+def _denoise_step_callback(model_id: str, on_step: Optional[Callable[..., Any]] = None):
+    """``callback_on_step_end`` observing the wall time of every denoising step."""
+    last = time.perf_counter()
+
+    def _on_step_end(pipe, step_index, timestep, callback_kwargs):
+        nonlocal last
+        now = time.perf_counter()
+        metrics.observe("aura_denoise_step_seconds", now - last, model=model_id)
+        last = now
+        if on_step is not None:
+            return on_step(pipe, step_index, timestep, callback_kwargs)
+        return callback_kwargs
+
+    return _on_step_end
+
+
+class ServiceUnavailableError(Exception):
+    """A request that cannot be served right now; answered with 503 and Retry-After."""
+
+    def __init__(self, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class ModelLoadError(ServiceUnavailableError):
+    def __init__(self, model_id: str, reason: str):
+        super().__init__(f"Model {model_id} could not be loaded: {reason}", MODEL_LOAD_RETRY_AFTER)
+        self.model_id = model_id
+
+
+class GenerationCancelled(Exception):
+    """Every caller waiting on a generation cancelled it; raised between denoising steps."""
+
+
+@dataclass
+class _RegistryEntry:
+    loader: Callable[[], Any]
+    model: Any = None
+    size_bytes: int = 0
+    refs: int = 0
+    last_used: float = 0.0
+    load_seconds: Optional[float] = None
+    loads: int = 0
+    error: Optional[str] = None
+    load_lock: threading.Lock = field(default_factory=threading.Lock)
+    # Loaded models are not thread-safe; callers serialize use when workers > 1
+    use_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps them warm within a memory budget.
+
+    ``acquire()`` pins a model with a reference count for the duration of a request.
+    When loading another model would exceed ``budget_bytes``, idle models are evicted
+    least recently used first; pinned models are never evicted. A failed load is
+    reported as ``ModelLoadError`` and retried by the next request instead of taking
+    the whole service down.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self._budget = max(budget_bytes, 0)
+        self._entries: Dict[str, _RegistryEntry] = {}
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def register(self, model_id: str, loader: Callable[[], Any]) -> None:
+        self._entries[model_id] = _RegistryEntry(loader=loader)
+
+    def __contains__(self, model_id: str) -> bool:
+        return model_id in self._entries
+
+    def use_lock(self, model_id: str) -> threading.Lock:
+        return self._entries[model_id].use_lock
+
+    @contextmanager
+    def acquire(self, model_id: str):
+        entry = self._entries[model_id]
+        with self._lock:
+            entry.refs += 1
+        try:
+            yield self._ensure_loaded(model_id, entry)
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                entry.last_used = time.monotonic()
+
+    def _ensure_loaded(self, model_id: str, entry: _RegistryEntry) -> Any:
+        with entry.load_lock:
+            if entry.model is not None:
+                return entry.model
+            # Sizes are only known after a first load; make room up front on reloads
+            self._make_room(entry.size_bytes, exclude=model_id)
+            logger.info(f"Loading model {model_id}")
+            started = time.perf_counter()
+            try:
+                model = entry.loader()
+            except Exception as e:
+                entry.error = str(e)
+                logger.error(f"Failed to load model {model_id}: {e}")
+                raise ModelLoadError(model_id, str(e))
+            entry.load_seconds = time.perf_counter() - started
+            metrics.observe("aura_model_load_seconds", entry.load_seconds, model=model_id)
+            entry.size_bytes = _model_bytes(model)
+            entry.loads += 1
+            entry.error = None
+            with self._lock:
+                entry.model = model
+            logger.info(
+                f"Loaded model {model_id} in {entry.load_seconds:.2f} seconds "
+                f"({entry.size_bytes / (1024 * 1024):.0f} MB)"
+            )
+            self._make_room(0, exclude=model_id)
+            return model
+
+    def _make_room(self, incoming: int, exclude: str) -> None:
+        if self._budget <= 0:
+            return
+        evicted = []
+        with self._lock:
+            resident = sum(entry.size_bytes for entry in self._entries.values() if entry.model is not None)
+            idle = sorted(
+                (
+                    (entry.last_used, model_id)
+                    for model_id, entry in self._entries.items()
+                    if model_id != exclude and entry.model is not None and entry.refs == 0
+                ),
+            )
+            for _last_used, model_id in idle:
+                if resident + incoming <= self._budget:
+                    break
+                entry = self._entries[model_id]
+                entry.model = None
+                resident -= entry.size_bytes
+                self._evictions += 1
+                evicted.append(model_id)
+        if evicted:
+            logger.info(f"Evicted idle models to stay within memory budget: {', '.join(evicted)}")
+            gc.collect()
+            if device == "cuda":
+                torch.cuda.empty_cache()
+        if resident + incoming > self._budget:
+            logger.warning(
+                f"Resident models use {(resident + incoming) / (1024 * 1024):.0f} MB, above the "
+                f"{self._budget / (1024 * 1024):.0f} MB budget; no idle model left to evict"
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                model_id: {
+                    "loaded": entry.model is not None,
+                    "refs": entry.refs,
+                    "size_mb": round(entry.size_bytes / (1024 * 1024), 1),
+                    "loads": entry.loads,
+                    "load_seconds": round(entry.load_seconds, 2) if entry.load_seconds is not None else None,
+                    "idle_seconds": round(now - entry.last_used, 1) if entry.last_used else None,
+                    "error": entry.error,
+                }
+                for model_id, entry in self._entries.items()
+            }
+            resident = sum(entry.size_bytes for entry in self._entries.values() if entry.model is not None)
+        return {
+            "budget_mb": self._budget // (1024 * 1024) if self._budget else None,
+            "resident_mb": round(resident / (1024 * 1024), 1),
+            "evictions": self._evictions,
+            "models": models,
+        }
+
+
+model_store = ModelStore(MODEL_STORE_DIR)
+model_registry = ModelRegistry(MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
+for _model_id in AVAILABLE_MODELS:
+    model_registry.register(_model_id, lambda model_id=_model_id: _load_text2img_pipeline(model_id))
+if DRAFT_MODEL_ID and DRAFT_MODEL_ID not in model_registry:
+    model_registry.register(DRAFT_MODEL_ID, lambda: _load_text2img_pipeline(DRAFT_MODEL_ID))
+model_registry.register(BLIP_MODEL_ID, _load_blip)
+
+DEFAULT_ENCODING = ImageEncoding(compress_level=PNG_COMPRESS_LEVEL)
+
+
+def image_to_base64(image: Image.Image, encoding: ImageEncoding = DEFAULT_ENCODING) -> str:
+    return base64.b64encode(encode_image(image, encoding)).decode()
+
+
+def _extract_encoding(payload: Dict[str, Any]) -> ImageEncoding:
+    image_format = str(payload.get("format") or "png").lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Invalid format. Must be one of {sorted(IMAGE_FORMATS)}")
+    try:
+        quality = int(payload.get("quality", DEFAULT_IMAGE_QUALITY))
+        compress_level = int(payload.get("compressLevel", PNG_COMPRESS_LEVEL))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="quality and compressLevel must be integers.")
+    if not 1 <= quality <= 100 or not 0 <= compress_level <= 9:
+        raise HTTPException(status_code=422, detail="quality must be 1-100 and compressLevel 0-9.")
+    return ImageEncoding(format=image_format, quality=quality, compress_level=compress_level)
+
+
+def _images_response(
+    request: Request,
+    images: List[bytes],
+    encoding: ImageEncoding,
+    downgrades: Optional[List[str]] = None,
+    timer: Optional[StageTimer] = None,
+    seeds: Optional[List[int]] = None,
+    handles: Optional[List[str]] = None,
+):
+    """Encoded images as base64 JSON (default) or, when the client accepts it, raw multipart/mixed parts.
+
+    ``downgrades`` lists the out-of-memory fallbacks the generation needed, if any. ``seeds``
+    holds the per-image seeds of a draft, which /finalize needs to re-run one of them, and
+    ``handles`` the latent-store handles /refine accepts in place of the image.
+    """
+    if "multipart/mixed" not in request.headers.get("accept", ""):
+        timer = timer or StageTimer()
+        with timer.stage("base64"):
+            encoded = [base64.b64encode(data).decode() for data in images]
+        body = {"images": encoded, "mimeType": encoding.media_type}
+        if downgrades:
+            body["downgrades"] = downgrades
+        if seeds is not None:
+            body["seeds"] = seeds
+        if handles is not None:
+            body["handles"] = handles
+        return body
+
+    boundary = uuid.uuid4().hex
+    extension = "jpg" if encoding.format == "jpeg" else encoding.format
+    parts = []
+    for index, data in enumerate(images):
+        headers = (
+            f"--{boundary}\r\n"
+            f"Content-Type: {encoding.media_type}\r\n"
+            f'Content-Disposition: attachment; filename="image-{index}.{extension}"\r\n'
+            f"Content-Length: {len(data)}\r\n\r\n"
+        )
+        parts.extend((headers.encode("ascii"), data, b"\r\n"))
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    headers = {}
+    if downgrades:
+        headers["X-Downgrades"] = "; ".join(downgrades)
+    if seeds is not None:
+        headers["X-Seeds"] = ",".join(str(seed) for seed in seeds)
+    if handles is not None:
+        headers["X-Image-Handles"] = ",".join(handles)
+    return Response(content=b"".join(parts), media_type=f"multipart/mixed; boundary={boundary}", headers=headers or None)
+
+
+async def _read_refine_request(request: Request) -> Tuple[Dict[str, Any], List[bytes]]:
+    """Parse /refine from JSON with base64 images or from multipart/form-data file uploads.
+
+    A request carrying a latent-store ``handle`` needs no images.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = form.getlist("images") or form.getlist("baseImages")
+        payload = {key: value for key, value in form.items() if isinstance(value, str)}
+        raw_images = [await upload.read() for upload in uploads if hasattr(upload, "read")]
+        if not raw_images and not payload.get("handle"):
+            raise HTTPException(status_code=422, detail="images field must contain image files.")
+        return payload, raw_images
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Request body must be valid JSON.")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Request body must be a JSON object.")
+    if payload.get("handle"):
+        return payload, []
+    return payload, await asyncio.to_thread(_decode_base64_images, payload)
+
+
+def _decode_base64_images(payload: Dict[str, Any]) -> List[bytes]:
+    encoded = payload.get("images") or payload.get("baseImages")
+    if not isinstance(encoded, list) or not encoded:
+        raise HTTPException(status_code=422, detail="images field must contain base64 strings.")
+    try:
+        return [base64.b64decode(item) for item in encoded]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid base64 string in images")
+
+
+result_cache = (
+    ResultCache(
+        RESULT_CACHE_MEMORY_MB * 1024 ** 2,
+        RESULT_CACHE_DIR,
+        RESULT_CACHE_DISK_MB * 1024 ** 2,
+        RESULT_CACHE_TTL_SECONDS,
+    )
+    if RESULT_CACHE_ENABLED
+    else None
+)
+
+
+class CaptionCache:
+    """Bounded LRU of BLIP captions keyed by a hash of the decoded image bytes."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            caption = self._entries.get(key)
+            if caption is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return caption
+
+    def put(self, key: str, caption: str) -> None:
+        with self._lock:
+            self._entries[key] = caption
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+caption_cache = CaptionCache(CAPTION_CACHE_SIZE) if CAPTION_CACHE_SIZE > 0 else None
+
+
+@dataclass
+class _LatentEntry:
+    model_id: str
+    prompt: str
+    steps: int
+    guidance_scale: float
+    latents: torch.Tensor
+
+
+class LatentStore:
+    """Bounded LRU of final (pre-VAE) latents per generated image, keyed by an opaque handle.
+
+    /refine with a handle runs img2img straight from these latents, so it needs no image
+    upload, no image decode, no VAE encode and no BLIP caption.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[str, _LatentEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, model_id: str, prompt: str, steps: int, guidance_scale: float, latents: torch.Tensor) -> List[str]:
+        """Store each image of a latent batch and return one handle per image."""
+        handles = []
+        with self._lock:
+            for index in range(latents.shape[0]):
+                handle = uuid.uuid4().hex
+                self._entries[handle] = _LatentEntry(
+                    model_id, prompt, steps, guidance_scale, latents[index:index + 1]
+                )
+                handles.append(handle)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return handles
+
+    def get(self, handle: str) -> Optional[_LatentEntry]:
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(handle)
+            self.hits += 1
+            return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            size = sum(entry.latents.numel() * entry.latents.element_size() for entry in self._entries.values())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "memory_mb": round(size / (1024 * 1024), 1),
+            }
+
+
+latent_store = LatentStore(LATENT_STORE_SIZE) if LATENT_STORE_SIZE > 0 else None
+
+
+def _describe_images(raw_images: List[bytes], timer: Optional[StageTimer] = None) -> List[str]:
+    """Caption every image with BLIP in a single batched generate call, skipping cached ones."""
+    timer = timer or StageTimer()
+    descriptions: List[Optional[str]] = [None] * len(raw_images)
+    pending: "OrderedDict[str, Tuple[Image.Image, List[int]]]" = OrderedDict()
+    for index, image_data in enumerate(raw_images):
+        try:
+            image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid image data in images")
+        key = hashlib.sha256(image_data).hexdigest()
+        if key in pending:
+            pending[key][1].append(index)
+            continue
+        cached = caption_cache.get(key) if caption_cache is not None else None
+        if cached is not None:
+            descriptions[index] = cached
+        else:
+            pending[key] = (image, [index])
+
+    if pending:
+        with model_registry.acquire(BLIP_MODEL_ID) as (blip_processor, blip_model), model_registry.use_lock(BLIP_MODEL_ID):
+            inputs = blip_processor(images=[image for image, _indices in pending.values()], return_tensors="pt")
+            inputs = inputs.to(device, torch_dtype)
+            with timer.stage("blip_caption"), _inference_context():
+                out = blip_model.generate(**inputs, max_length=BLIP_MAX_LENGTH)
+            captions = blip_processor.batch_decode(out, skip_special_tokens=True)
+        for (key, (_image, indices)), caption in zip(pending.items(), captions):
+            for index in indices:
+                descriptions[index] = caption
+            if caption_cache is not None:
+                caption_cache.put(key, caption)
+
+    return descriptions
+
+
+async def _caption_images(raw_images: List[bytes], timer: Optional[StageTimer] = None) -> List[str]:
+    """BLIP captions on an inference thread, or on a worker process when the pool is enabled."""
+    if worker_pool is None:
+        return await inference_queue.run(_describe_images, raw_images, timer)
+    descriptions, stages = await inference_queue.run(
+        worker_pool.call, "describe", {"raw_images": raw_images}, model_id=BLIP_MODEL_ID
+    )
+    _observe_stages(stages)
+    if timer is not None:
+        timer.merge(stages)
+    return descriptions
+
+
+def _decode_latents(pipe, latents: torch.Tensor) -> List[Image.Image]:
+    return decode_latents(pipe, latents, batch=VAE_DECODE_BATCH, tiling_pixels=VAE_TILING_PIXELS)
+
+
+oom_recovery = OomRecovery()
+
+
+def _denoise_with_recovery(
+    pipe,
+    model_id: str,
+    prompts: List[str],
+    *,
+    width: Optional[int],
+    height: Optional[int],
+    steps: int,
+    guidance_scale: float,
+    images_per_prompt: int,
+    seeds: List[Optional[int]],
+    downgrades: List[str],
+    timer: StageTimer,
+    on_step: Optional[Callable[..., Any]] = None,
+) -> torch.Tensor:
+    """Denoise to latents, walking down the OomRecovery ladder on memory errors.
+
+    ``seeds`` holds one seed (or None) per prompt. ``on_step`` is chained into the
+    pipeline's ``callback_on_step_end``.
+    """
+    total = len(prompts) * images_per_prompt
+    key = (model_id, width, height)
+    limit = min(total, oom_recovery.safe_batch(key) or total)
+    if limit < total:
+        downgrades.append(f"split into runs of {limit} image(s) (learned)")
+
+    def _call(prompt_list: List[str], count: int, run_generators) -> torch.Tensor:
+        if prompt_cache is not None:
+            with timer.stage("text_encode"):
+                prompt_kwargs = _prompt_embeddings(pipe, model_id, prompt_list, guidance_scale)
+        else:
+            # Without the prompt cache the pipeline encodes inside the denoise stage
+            prompt_kwargs = {"prompt": prompt_list}
+        with timer.stage("denoise"):
+            return pipe(
+                **prompt_kwargs,
+                width=width,
+                height=height,
+                num_images_per_prompt=count,
+                guidance_scale=guidance_scale,
+                num_inference_steps=steps,
+                generator=run_generators,
+                output_type="latent",
+                callback_on_step_end=_denoise_step_callback(model_id, on_step),
+            ).images
+
+    recovered = False
+    with oom_recovery.ladder(pipe) as degrade:
+        while True:
+            # Fresh per-image generators on every attempt: runs that finished before an OOM
+            # have advanced theirs, and seeded results must not depend on how the work is split
+            generators = _batch_generators(seeds, images_per_prompt)
+            try:
+                if limit >= total:
+                    return _call(prompts, images_per_prompt, generators)
+                runs = []
+                for prompt_index, prompt in enumerate(prompts):
+                    for start in range(0, images_per_prompt, limit):
+                        count = min(limit, images_per_prompt - start)
+                        offset = prompt_index * images_per_prompt + start
+                        run_generators = generators[offset:offset + count] if generators is not None else None
+                        runs.append(_call([prompt], count, run_generators))
+                if recovered:
+                    oom_recovery.record(key, limit)
+                return torch.cat(runs)
+            except Exception as e:
+                if not is_out_of_memory(e):
+                    raise
+                free_memory()
+                step = degrade(limit)
+                if step is None:
+                    raise
+                limit, downgrade = step
+                recovered = True
+                logger.warning(f"Out of memory generating {total} image(s) with {model_id}; retrying with {downgrade}")
+                downgrades.append(downgrade)
+
+
+def _available_memory_bytes() -> Optional[int]:
+    if device == "cuda":
+        try:
+            free, _total = torch.cuda.mem_get_info()
+            return int(free)
+        except Exception:
+            return None
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def _derive_max_batch_images() -> int:
+    """Images per pipeline call at 512x512 that fit in the memory left after loading the models."""
+    if MAX_BATCH_IMAGES > 0:
+        return MAX_BATCH_IMAGES
+    available = _available_memory_bytes()
+    if available is None:
+        return NUM_IMAGES
+    per_image = BATCH_BYTES_PER_IMAGE.get(device, BATCH_BYTES_PER_IMAGE["cpu"])
+    # Keep a quarter of the free memory as headroom for allocator fragmentation
+    return max(NUM_IMAGES, min(16, int(available * 0.75) // per_image))
+
+
+class QueueFullError(ServiceUnavailableError):
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full. Retry later.", retry_after)
+
+
+class InferenceQueue:
+    """Bounded admission queue in front of a dedicated inference thread pool.
+
+    Handlers hold an admission ``slot()`` for the lifetime of the request, so the depth
+    counts both waiting and running work. Blocking model calls go through ``run()``,
+    which executes them on the pool and records how long they waited for a worker.
+    """
+
+    def __init__(self, workers: int, max_depth: int):
+        self._workers = max(workers, 1)
+        self._max_depth = max(max_depth, 1)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="inference")
+        self._depth = 0
+        self._running = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._dispatched = 0
+        self._last_wait = 0.0
+        self._avg_wait = 0.0
+        self._avg_service = 0.0
+
+    def _retry_after(self) -> int:
+        estimate = self._avg_service * self._depth / self._workers
+        return max(1, math.ceil(estimate))
+
+    def admit(self, force: bool = False) -> float:
+        """Reserve a slot or raise QueueFullError; returns the admission timestamp for release().
+
+        ``force`` admits past the limit, for jobs that were already admitted before a restart.
+        """
+        if self._depth >= self._max_depth and not force:
+            self._rejected += 1
+            raise QueueFullError(self._retry_after())
+        self._depth += 1
+        self._admitted += 1
+        return time.perf_counter()
+
+    def release(self, started: float) -> None:
+        self._depth -= 1
+        elapsed = time.perf_counter() - started
+        self._avg_service = elapsed if self._admitted == 1 else 0.8 * self._avg_service + 0.2 * elapsed
+
+    @asynccontextmanager
+    async def slot(self):
+        started = self.admit()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        submitted = time.perf_counter()
+
+        def _call():
+            wait = time.perf_counter() - submitted
+            metrics.observe("aura_stage_duration_seconds", wait, stage="queue_wait")
+            self._dispatched += 1
+            self._last_wait = wait
+            self._avg_wait = wait if self._dispatched == 1 else 0.8 * self._avg_wait + 0.2 * wait
+            self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._running -= 1
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _call)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self._depth,
+            "running": self._running,
+            "max_depth": self._max_depth,
+            "workers": self._workers,
+            "admitted_total": self._admitted,
+            "rejected_total": self._rejected,
+            "last_wait_seconds": round(self._last_wait, 3),
+            "avg_wait_seconds": round(self._avg_wait, 3),
+            "avg_request_seconds": round(self._avg_service, 3),
+        }
+
+
+# With a worker pool every pool thread just waits on a worker process
+inference_queue = InferenceQueue(max(INFERENCE_WORKERS, WORKER_PROCESSES), MAX_QUEUE_DEPTH)
+
+
+@dataclass
+class _PendingTask:
+    on_progress: Optional[Callable[[int, int], None]] = None
+    # Server-Sent Events of a streamed generation, forwarded as the worker emits them
+    on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Any = None
+    error: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class _Worker:
+    index: int
+    cpus: List[int]
+    gpu: Optional[int]
+    process: Optional[subprocess.Popen] = None
+    conn: Any = None
+    send_lock: threading.Lock = field(default_factory=threading.Lock)
+    pending: Dict[int, _PendingTask] = field(default_factory=dict)
+    models: List[str] = field(default_factory=list)
+    # Warm-up report sent with "ready"; None until the worker finished its first warm-up
+    warmup: Optional[Dict[str, Any]] = None
+    # "running" (started, maybe still warming up), "restarting" (down, waiting out the backoff)
+    # or "failed" (down for good after WORKER_MAX_RESTARTS consecutive crashes)
+    state: str = "running"
+    inflight: int = 0
+    tasks: int = 0
+    restarts: int = 0
+    # Crashes since the worker last reported ready
+    crashes: int = 0
+    # time.monotonic() of the pending restart while "restarting"
+    restart_at: float = 0.0
+
+
+def _send_message(conn, message: Tuple[Any, ...]) -> None:
+    # Plain pickle: Connection.send() would share tensors through file descriptors, which
+    # needs an authkey the independently started worker processes do not have in common
+    conn.send_bytes(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _receive_message(conn) -> Tuple[Any, ...]:
+    return pickle.loads(conn.recv_bytes())
+
+
+def _worker_error(error: BaseException) -> Dict[str, Any]:
+    """Picklable description of a task failure, turned back into an exception by the front process."""
+    if isinstance(error, GenerationCancelled):
+        return {"kind": "cancelled"}
+    if isinstance(error, ModelLoadError):
+        return {"kind": "model_load", "model_id": error.model_id, "detail": error.detail}
+    if isinstance(error, HTTPException):
+        return {"kind": "http", "status": error.status_code, "detail": error.detail}
+    return {"kind": "runtime", "detail": str(error)}
+
+
+def _worker_exception(error: Dict[str, Any]) -> Exception:
+    if error["kind"] == "cancelled":
+        return GenerationCancelled()
+    if error["kind"] == "model_load":
+        exc = ModelLoadError(error["model_id"], "")
+        exc.detail = error["detail"]
+        return exc
+    if error["kind"] == "http":
+        return HTTPException(status_code=error["status"], detail=error["detail"])
+    # Out-of-memory errors keep their message, which is what is_out_of_memory inspects
+    return RuntimeError(error["detail"])
+
+
+class NoWorkerAvailableError(ServiceUnavailableError):
+    def __init__(self, retry_after: int):
+        super().__init__("No inference worker is available. Retry later.", retry_after)
+
+
+class WorkerPool:
+    """Inference worker processes behind the HTTP process.
+
+    Each worker is this module started with ``--worker``, pinned to a contiguous slice of
+    the usable CPUs (with its thread count sized to match) and, on multi-GPU hosts, to one
+    GPU. Workers keep their own ModelRegistry warm. ``call()`` blocks an inference thread
+    while a worker runs the task, routing by model affinity: a worker that already holds
+    the model wins unless another worker has less work queued. Workers that die fail their
+    in-flight tasks and get no new ones; they are restarted with exponential backoff and
+    left down after WORKER_MAX_RESTARTS consecutive crashes. Every route that runs a
+    model (including /generate/stream, whose events come back over the worker socket, and
+    /benchmark) goes through a worker, so the HTTP process never loads one.
+    """
+
+    def __init__(self, processes: int):
+        try:
+            usable = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            usable = list(range(os.cpu_count() or 1))
+        per_worker = max(1, len(usable) // processes)
+        gpus = torch.cuda.device_count() if torch.cuda.is_available() else 0
+        self._workers = [
+            _Worker(
+                index=index,
+                cpus=usable[index * per_worker:(index + 1) * per_worker] or usable[-per_worker:],
+                gpu=index % gpus if gpus > 1 else None,
+            )
+            for index in range(processes)
+        ]
+        # cgroup quotas can be below the visible CPU count; split the quota too
+        self._threads = max(1, min(per_worker, cgroup_cpu_limit() // processes))
+        self._lock = threading.Lock()
+        self._next_task = 0
+        self._closed = threading.Event()
+
+    def start(self) -> None:
+        for worker in self._workers:
+            self._spawn(worker)
+        logger.info(
+            f"Started {len(self._workers)} inference workers: "
+            + ", ".join(f"#{worker.index} cpus {worker.cpus[0]}-{worker.cpus[-1]}" for worker in self._workers)
+        )
+
+    def _spawn(self, worker: _Worker) -> None:
+        parent, child = socket.socketpair()
+        env = dict(
+            os.environ,
+            AURA_WORKER_INDEX=str(worker.index),
+            AURA_WORKER_CPUS=",".join(str(cpu) for cpu in worker.cpus),
+            AURA_CPU_THREADS=str(self._threads),
+        )
+        if worker.gpu is not None:
+            env["CUDA_VISIBLE_DEVICES"] = str(worker.gpu)
+        worker.warmup = None
+        worker.state = "running"
+        worker.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--worker", str(child.fileno())],
+            pass_fds=(child.fileno(),),
+            env=env,
+        )
+        child.close()
+        worker.conn = multiprocessing.connection.Connection(parent.detach())
+        threading.Thread(target=self._read, args=(worker, worker.conn), daemon=True).start()
+
+    def _read(self, worker: _Worker, conn) -> None:
+        while True:
+            try:
+                message = _receive_message(conn)
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "ready":
+                _kind, worker.models, worker.warmup = message
+                worker.crashes = 0
+            elif kind == "progress":
+                _kind, task_id, step, total = message
+                pending = worker.pending.get(task_id)
+                if pending is not None and pending.on_progress is not None:
+                    pending.on_progress(step, total)
+            elif kind == "event":
+                _kind, task_id, event, data = message
+                pending = worker.pending.get(task_id)
+                if pending is not None and pending.on_event is not None:
+                    pending.on_event(event, data)
+            elif kind == "result":
+                _kind, task_id, result, error, models = message
+                worker.models = models
+                pending = worker.pending.pop(task_id, None)
+                if pending is not None:
+                    pending.result, pending.error = result, error
+                    pending.done.set()
+
+        # Under the lock, so call() either sees the worker down or has its task failed here
+        with self._lock:
+            orphaned, worker.pending = worker.pending, {}
+            worker.warmup = None
+            worker.crashes += 1
+            worker.state = "restarting" if worker.crashes <= WORKER_MAX_RESTARTS else "failed"
+        for pending in orphaned.values():
+            pending.error = {"kind": "runtime", "detail": f"Inference worker {worker.index} exited"}
+            pending.done.set()
+        if self._closed.is_set():
+            return
+        if worker.state == "failed":
+            logger.error(f"Inference worker {worker.index} exited {worker.crashes} times in a row; leaving it down")
+            return
+        delay = min(WORKER_RESTART_BACKOFF_SECONDS * 2 ** (worker.crashes - 1), WORKER_RESTART_MAX_BACKOFF_SECONDS)
+        worker.restart_at = time.monotonic() + delay
+        logger.warning(f"Inference worker {worker.index} exited; restarting it in {delay:.0f}s")
+        if self._closed.wait(delay):
+            return
+        worker.restarts += 1
+        self._spawn(worker)
+
+    def _pick(self, model_id: Optional[str]) -> _Worker:
+        def _cost(worker: _Worker) -> Tuple[int, int, int]:
+            # A missing model costs about as much as one queued task
+            missing = 0 if model_id in worker.models else 1
+            # Workers still warming up only get tasks when no worker is ready
+            return worker.warmup is None, worker.inflight + missing, missing, worker.index
+
+        running = [worker for worker in self._workers if worker.state == "running"]
+        if not running:
+            # Nothing to route to until the next restart is due
+            restarts = [worker.restart_at for worker in self._workers if worker.state == "restarting"]
+            wait = min(restarts) - time.monotonic() if restarts else WORKER_RESTART_MAX_BACKOFF_SECONDS
+            raise NoWorkerAvailableError(max(1, math.ceil(wait)))
+        return min(running, key=_cost)
+
+    def call(
+        self,
+        name: str,
+        kwargs: Dict[str, Any],
+        *,
+        model_id: Optional[str] = None,
+        cancelled: Optional[Callable[[], bool]] = None,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    ) -> Any:
+        with self._lock:
+            worker = self._pick(model_id)
+            worker.inflight += 1
+            worker.tasks += 1
+            self._next_task += 1
+            task_id = self._next_task
+            pending = worker.pending[task_id] = _PendingTask(on_progress=on_progress, on_event=on_event)
+        try:
+            cancel_sent = False
+            try:
+                with worker.send_lock:
+                    _send_message(worker.conn, ("task", task_id, name, kwargs))
+            except OSError:
+                # The worker died after it was picked; its reader fails this task
+                cancel_sent = True
+            while not pending.done.wait(0.25):
+                if cancelled is not None and not cancel_sent and cancelled():
+                    cancel_sent = True
+                    try:
+                        with worker.send_lock:
+                            _send_message(worker.conn, ("cancel", task_id))
+                    except OSError:
+                        pass
+        finally:
+            with self._lock:
+                worker.inflight -= 1
+        if pending.error is not None:
+            raise _worker_exception(pending.error)
+        return pending.result
+
+    def ready(self) -> bool:
+        # A worker that is down (restarting or failed) leaves the pool not ready
+        return all(
+            worker.state == "running" and worker.warmup is not None and worker.warmup["state"] == "done"
+            for worker in self._workers
+        )
+
+    def close(self) -> None:
+        self._closed.set()
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.terminate()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "index": worker.index,
+                "pid": worker.process.pid if worker.process is not None else None,
+                "cpus": f"{worker.cpus[0]}-{worker.cpus[-1]}",
+                "gpu": worker.gpu,
+                "state": worker.state,
+                "inflight": worker.inflight,
+                "tasks": worker.tasks,
+                "restarts": worker.restarts,
+                "models": worker.models,
+                "warmup": worker.warmup,
+            }
+            for worker in self._workers
+        ]
+
+
+worker_pool = WorkerPool(WORKER_PROCESSES) if WORKER_PROCESSES > 0 and WORKER_INDEX is None else None
+
+
+def _loaded_models() -> List[str]:
+    return [model_id for model_id, info in model_registry.stats()["models"].items() if info["loaded"]]
+
+
+def _worker_main(fd: int) -> None:
+    """Entry point of a pool worker: run tasks from the HTTP process one at a time."""
+    cpus = os.environ.get("AURA_WORKER_CPUS")
+    if cpus and hasattr(os, "sched_setaffinity"):
+        # Before the first parallel op, so torch's thread pool inherits the pinning
+        os.sched_setaffinity(0, {int(cpu) for cpu in cpus.split(",")})
+    conn = multiprocessing.connection.Connection(fd)
+    send_lock = threading.Lock()
+    cancel_events: Dict[int, threading.Event] = {}
+    tasks: "queue.Queue[Optional[Tuple[Any, ...]]]" = queue.Queue()
+
+    def _send(message: Tuple[Any, ...]) -> None:
+        with send_lock:
+            _send_message(conn, message)
+
+    def _receive() -> None:
+        # Runs beside the task loop so cancellations arrive while a pipeline is busy
+        while True:
+            try:
+                message = _receive_message(conn)
+            except (EOFError, OSError):
+                tasks.put(None)
+                return
+            if message[0] == "cancel":
+                event = cancel_events.get(message[1])
+                if event is not None:
+                    event.set()
+            else:
+                cancel_events[message[1]] = threading.Event()
+                tasks.put(message)
+
+    threading.Thread(target=_receive, daemon=True).start()
+    # Tasks sent meanwhile queue up behind the warm-up
+    warmup.run()
+    _send(("ready", _loaded_models(), warmup.report()))
+
+    while True:
+        try:
+            message = tasks.get(timeout=None if warmup.ready else MODEL_LOAD_RETRY_AFTER)
+        except queue.Empty:
+            # Idle after a failed warm-up: retry it so the instance can still become ready
+            warmup.run()
+            _send(("ready", _loaded_models(), warmup.report()))
+            continue
+        if message is None:
+            return
+        _kind, task_id, name, kwargs = message
+        cancelled = cancel_events[task_id]
+        result, error = None, None
+        try:
+            if name == "generate":
+                result = _generate_batch(
+                    kwargs.pop("model_id"),
+                    kwargs.pop("prompts"),
+                    kwargs.pop("seeds"),
+                    **kwargs,
+                    cancelled=cancelled.is_set,
+                    on_progress=lambda step, total: _send(("progress", task_id, step, total)),
+                )
+            elif name == "describe":
+                timer = StageTimer()
+                result = (_describe_images(kwargs["raw_images"], timer), timer.stages)
+            elif name == "img2img":
+                result = _run_img2img(**kwargs)
+            elif name == "stream":
+                result = _run_streaming_generation(
+                    **kwargs, emit=lambda event, data: _send(("event", task_id, event, data)), cancelled=cancelled
+                )
+            elif name == "benchmark":
+                result = _run_benchmark(**kwargs), cpu_profile
+            else:
+                raise ValueError(f"Unknown worker task {name}")
+        except Exception as e:
+            if not isinstance(e, (GenerationCancelled, HTTPException)):
+                logger.error(f"Worker task {name} failed: {str(e)}")
+            error = _worker_error(e)
+        finally:
+            cancel_events.pop(task_id, None)
+        _send(("result", task_id, result, error, _loaded_models()))
+
+
+@app.exception_handler(ServiceUnavailableError)
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    content: Dict[str, Any] = {"detail": exc.detail}
+    if isinstance(exc, QueueFullError):
+        content["queue"] = inference_queue.stats()
+    elif isinstance(exc, ModelLoadError):
+        content["model"] = exc.model_id
+    return JSONResponse(status_code=503, content=content, headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    # Streaming responses are measured until their headers are sent
+    metrics.observe(
+        "aura_request_duration_seconds",
+        time.perf_counter() - started,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    timer = getattr(request.state, "stage_timer", None)
+    if timer is not None and timer.stages:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+_background_tasks: "set[asyncio.Task]" = set()
+
+
+def _spawn(coro) -> "asyncio.Task":
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+BatchBucket = Tuple[str, Optional[int], Optional[int], int, float, int]
+
+
+@dataclass
+class JobControl:
+    """Handle shared with the inference thread: a cancellation flag and denoising progress."""
+
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    started: bool = False
+    step: int = 0
+    total: int = 0
+
+
+@dataclass
+class _BatchEntry:
+    prompt: str
+    future: "asyncio.Future[Tuple[List[Image.Image], List[str], Optional[torch.Tensor]]]"
+    seed: Optional[int] = None
+    timer: Optional[StageTimer] = None
+    control: Optional[JobControl] = None
+
+
+@dataclass
+class _PendingBatch:
+    entries: List[_BatchEntry] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+prompt_cache = PromptEmbeddingCache(PROMPT_CACHE_SIZE) if PROMPT_CACHE_SIZE > 0 else None
+
+
+def _prompt_embeddings(pipe, model_id: str, prompts: List[str], guidance_scale: float) -> Dict[str, torch.Tensor]:
+    """Pipeline kwargs carrying cached prompt/negative embeddings in place of raw prompt text."""
+    execution_device = getattr(pipe, "_execution_device", device)
+
+    def _encode(text: str) -> PromptEmbeddings:
+        key = (model_id, str(pipe.dtype), text)
+
+        def _run_encoder() -> PromptEmbeddings:
+            with torch.no_grad():
+                outputs = pipe.encode_prompt(
+                    prompt=text,
+                    device=execution_device,
+                    num_images_per_prompt=1,
+                    do_classifier_free_guidance=False,
+                )
+            # SDXL pipelines also return pooled embeddings as the third element
+            return outputs[0], outputs[2] if len(outputs) > 2 else None
+
+        return prompt_cache.get_or_encode(key, _run_encoder)
+
+    encoded = [_encode(text) for text in prompts]
+    embeds = torch.cat([embeds for embeds, _pooled in encoded])
+    pooled = torch.cat([pooled for _embeds, pooled in encoded]) if encoded[0][1] is not None else None
+    kwargs = {"prompt_embeds": embeds}
+    if pooled is not None:
+        kwargs["pooled_prompt_embeds"] = pooled
+    if guidance_scale > 1:
+        if getattr(pipe.config, "force_zeros_for_empty_prompt", False):
+            negative, negative_pooled = torch.zeros_like(embeds), torch.zeros_like(pooled) if pooled is not None else None
+        else:
+            # An empty negative prompt is exactly what the pipeline uses for unconditional guidance
+            negative, negative_pooled = _encode("")
+            negative = negative.expand(len(prompts), -1, -1).contiguous()
+            if negative_pooled is not None:
+                negative_pooled = negative_pooled.expand(len(prompts), -1).contiguous()
+        kwargs["negative_prompt_embeds"] = negative
+        if negative_pooled is not None:
+            kwargs["negative_pooled_prompt_embeds"] = negative_pooled
+    return kwargs
+
+
+def _batch_generators(seeds: List[Optional[int]], images_per_prompt: int) -> Optional[List[torch.Generator]]:
+    """One CPU generator per output image so seeded requests stay reproducible inside any batch."""
+    if all(seed is None for seed in seeds):
+        return None
+    generators = []
+    for seed in seeds:
+        generators.extend(image_generators(seed, images_per_prompt))
+    return generators
+
+
+def _generate_batch(
+    model_id: str,
+    prompts: List[str],
+    seeds: List[Optional[int]],
+    *,
+    width: Optional[int],
+    height: Optional[int],
+    steps: int,
+    guidance_scale: float,
+    images_per_prompt: int,
+    cancelled: Callable[[], bool],
+    on_progress: Callable[[int, int], None],
+) -> Tuple[List[Image.Image], List[str], Dict[str, float], Optional[torch.Tensor]]:
+    """Denoise and decode one batched pipeline call, on an inference thread or in a worker process.
+
+    Returns the images, the out-of-memory downgrades that were needed, the stage timings and,
+    when the latent store is enabled, the final latents on the CPU. ``cancelled`` is polled
+    between denoising steps.
+    """
+    timer = StageTimer()
+    downgrades: List[str] = []
+
+    def _on_step(pipe, step_index, _timestep, callback_kwargs):
+        on_progress(step_index + 1, steps)
+        if cancelled():
+            pipe._interrupt = True
+        return callback_kwargs
+
+    if cancelled():
+        raise GenerationCancelled()
+    on_progress(0, steps)
+    with model_registry.acquire(model_id) as pipe, model_registry.use_lock(model_id), _inference_context():
+        latents = _denoise_with_recovery(
+            pipe,
+            model_id,
+            prompts,
+            width=width,
+            height=height,
+            steps=steps,
+            guidance_scale=guidance_scale,
+            images_per_prompt=images_per_prompt,
+            seeds=seeds,
+            downgrades=downgrades,
+            timer=timer,
+            on_step=_on_step,
+        )
+        if cancelled():
+            raise GenerationCancelled()
+        with timer.stage("vae_decode"):
+            images = _decode_latents(pipe, latents)
+    return images, downgrades, timer.stages, latents.cpu() if latent_store is not None else None
+
+
+_img2img_pipelines: "weakref.WeakKeyDictionary[Any, Any]" = weakref.WeakKeyDictionary()
+
+
+def _img2img_pipeline(pipe):
+    """Image-to-image view of a loaded text-to-image pipeline, sharing its weights."""
+    img2img = _img2img_pipelines.get(pipe)
+    if img2img is None:
+        img2img = _img2img_pipelines[pipe] = AutoPipelineForImage2Image.from_pipe(pipe)
+    return img2img
+
+
+def _run_img2img(
+    model_id: str,
+    prompt: str,
+    image: Any,
+    *,
+    strength: float,
+    steps: int,
+    guidance_scale: float,
+    seed: Optional[int],
+    images_per_prompt: int,
+) -> Tuple[List[Image.Image], Dict[str, float], Optional[torch.Tensor]]:
+    """img2img on a loaded text-to-image model's weights, on an inference thread or a worker.
+
+    ``image`` is a PIL image, or 4-channel latents from the latent store, which the pipeline
+    takes as its starting point without a VAE encode. Only the last ``strength`` share of the
+    ``steps`` schedule runs. Returns the images, the stage timings and the final latents on
+    the CPU when the latent store is enabled.
+    """
+    timer = StageTimer()
+    with model_registry.acquire(model_id) as pipe, model_registry.use_lock(model_id), _inference_context():
+        img2img = _img2img_pipeline(pipe)
+        if isinstance(image, torch.Tensor):
+            image = image.to(getattr(pipe, "_execution_device", device), pipe.unet.dtype)
+        if prompt_cache is not None:
+            with timer.stage("text_encode"):
+                prompt_kwargs = _prompt_embeddings(pipe, model_id, [prompt], guidance_scale)
+        else:
+            prompt_kwargs = {"prompt": prompt}
+        with timer.stage("denoise"):
+            latents = img2img(
+                **prompt_kwargs,
+                image=image,
+                strength=strength,
+                guidance_scale=guidance_scale,
+                num_inference_steps=steps,
+                num_images_per_prompt=images_per_prompt,
+                generator=image_generators(seed, images_per_prompt) if seed is not None else None,
+                output_type="latent",
+                callback_on_step_end=_denoise_step_callback(model_id),
+            ).images
+        with timer.stage("vae_decode"):
+            images = _decode_latents(pipe, latents)
+    return images, timer.stages, latents.cpu() if latent_store is not None else None
+
+
+async def _img2img(timer: StageTimer, **kwargs: Any) -> Tuple[List[Image.Image], Optional[torch.Tensor]]:
+    """Run ``_run_img2img`` on an inference thread, or on a worker process when the pool is enabled."""
+    if worker_pool is None:
+        images, stages, latents = await inference_queue.run(_run_img2img, **kwargs)
+    else:
+        images, stages, latents = await inference_queue.run(
+            worker_pool.call, "img2img", kwargs, model_id=kwargs["model_id"]
+        )
+        _observe_stages(stages)
+    timer.merge(stages)
+    return images, latents
+
+
+class BatchScheduler:
+    """Merges concurrent requests with identical generation settings into one pipeline call.
+
+    Requests are bucketed on (model, width, height, steps, guidance, images per prompt). The
+    first request in a bucket opens a window of ``window_ms``; everything that lands in the
+    same bucket before it closes (or until the bucket is full) runs as a single prompt list,
+    and the resulting images are split back out per caller.
+    """
+
+    def __init__(self, window_ms: float):
+        self._window = max(window_ms, 0.0) / 1000.0
+        self._max_images: Optional[int] = None
+        self._pending: Dict[BatchBucket, _PendingBatch] = {}
+
+    @property
+    def max_images(self) -> int:
+        # Derived on first use so the estimate sees the memory left by preloaded models
+        if self._max_images is None:
+            self._max_images = max(_derive_max_batch_images(), 1)
+        return self._max_images
+
+    def _bucket_capacity(self, bucket: BatchBucket) -> int:
+        _model_id, width, height, _steps, _guidance, images_per_prompt = bucket
+        pixels = (width or 512) * (height or 512)
+        scaled = int(self.max_images * BATCH_REFERENCE_PIXELS / pixels)
+        return max(1, scaled // images_per_prompt)
 
-# Optimized configuration for RTX 3050 4GB
-NUM_IMAGES = 2
-OPTIMIZED_STEPS = 15  # Further reduced for speed (from 20)
-OPTIMIZED_GUIDANCE_SCALE = 7  # Lower for faster generation
+    async def submit(
+        self,
+        prompt: str,
+        *,
+        model_id: str = DEFAULT_MODEL_ID,
+        width: Optional[int],
+        height: Optional[int],
+        steps: int,
+        guidance_scale: float,
+        images_per_prompt: int,
+        seed: Optional[int] = None,
+        timer: Optional[StageTimer] = None,
+        control: Optional[JobControl] = None,
+    ) -> Tuple[List[Image.Image], List[str], Optional[torch.Tensor]]:
+        """Generated images for this prompt, any out-of-memory downgrades the batch needed and
+        the images' final latents (None when the latent store is disabled).
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:8082", "http://127.0.0.1:8082"],  # Allow frontend origin
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+        The stages of the (possibly shared) pipeline run are merged into ``timer``. ``control``
+        reports denoising progress; the run stops between steps (raising GenerationCancelled)
+        once every request in the batch has been cancelled through its control.
+        """
+        loop = asyncio.get_running_loop()
+        bucket: BatchBucket = (model_id, width, height, steps, float(guidance_scale), images_per_prompt)
+        entry = _BatchEntry(prompt=prompt, future=loop.create_future(), seed=seed, timer=timer, control=control)
 
-# Load models with optimizations
-device = "cuda" if torch.cuda.is_available() else "cpu"
-try:
-    # Enable mixed precision for better performance on RTX 3050
-    torch_dtype = torch.float16 if device == "cuda" else torch.float32
+        pending = self._pending.setdefault(bucket, _PendingBatch())
+        pending.entries.append(entry)
+        if len(pending.entries) >= self._bucket_capacity(bucket):
+            self._flush(bucket)
+        elif pending.timer is None:
+            pending.timer = loop.call_later(self._window, self._flush, bucket)
 
-    sd_pipe = StableDiffusionPipeline.from_pretrained(
-        "CompVis/stable-diffusion-v1-4",
-        torch_dtype=torch_dtype,  # Use torch_dtype for StableDiffusionPipeline
-        safety_checker=None,  # Disable for speed (add back if needed)
-        requires_safety_checker=False,
-        low_cpu_mem_usage=True  # Enable memory optimization
-    ).to(device)
+        return await entry.future
 
-    # Optimize scheduler for faster generation
-    from diffusers import EulerDiscreteScheduler
-    sd_pipe.scheduler = EulerDiscreteScheduler.from_config(sd_pipe.scheduler.config)
+    def _flush(self, bucket: BatchBucket) -> None:
+        pending = self._pending.pop(bucket, None)
+        if pending is None:
+            return
+        if pending.timer is not None:
+            pending.timer.cancel()
+        _spawn(self._run(bucket, pending.entries))
+
+    async def _run(self, bucket: BatchBucket, entries: List[_BatchEntry]) -> None:
+        model_id, width, height, steps, guidance_scale, images_per_prompt = bucket
+        prompts = [entry.prompt for entry in entries]
+        seeds = [entry.seed for entry in entries]
+        if len(prompts) > 1:
+            logger.info(f"Running batched pipeline call for {len(prompts)} requests in bucket {bucket}")
+
+        batch_timer = StageTimer()
+        submitted = time.perf_counter()
+        controls = [entry.control for entry in entries]
+
+        def _cancelled() -> bool:
+            return all(control is not None and control.cancelled.is_set() for control in controls)
+
+        def _on_progress(step: int, total: int) -> None:
+            for control in controls:
+                if control is not None:
+                    control.started = True
+                    control.step, control.total = step, total
+
+        def _call_pipe():
+            # Already observed by the inference queue; kept here for the callers' Server-Timing
+            batch_timer.record("queue_wait", time.perf_counter() - submitted, observe=False)
+            options = dict(
+                width=width,
+                height=height,
+                steps=steps,
+                guidance_scale=guidance_scale,
+                images_per_prompt=images_per_prompt,
+            )
+            if worker_pool is None:
+                return _generate_batch(
+                    model_id, prompts, seeds, **options, cancelled=_cancelled, on_progress=_on_progress
+                )
+            result = worker_pool.call(
+                "generate",
+                {"model_id": model_id, "prompts": prompts, "seeds": seeds, **options},
+                model_id=model_id,
+                cancelled=_cancelled,
+                on_progress=_on_progress,
+            )
+            _observe_stages(result[2])
+            return result
 
-    # Additional optimizations for CPU mode
-    if device == "cpu":
-        logger.info("Running in CPU mode - enabling CPU-specific optimizations")
-        # Enable CPU offloading for memory efficiency
         try:
-            sd_pipe.enable_model_cpu_offload()
-            logger.info("CPU offloading enabled successfully")
-        except Exception as e:
-            logger.warning(f"CPU offloading not available: {e}")
+            images, downgrades, stages, latents = await inference_queue.run(_call_pipe)
+            batch_timer.merge(stages)
+        except Exception as exc:
+            for entry in entries:
+                if not entry.future.done():
+                    entry.future.set_exception(exc)
+            return
 
-    # Enable memory optimizations
-    if device == "cuda":
-        sd_pipe.enable_attention_slicing()
+        for index, entry in enumerate(entries):
+            if entry.timer is not None:
+                entry.timer.merge(batch_timer.stages)
+            if not entry.future.done():
+                start = index * images_per_prompt
+                end = start + images_per_prompt
+                entry.future.set_result((images[start:end], downgrades, latents[start:end] if latents is not None else None))
+
+
+batch_scheduler = BatchScheduler(BATCH_WINDOW_MS)
+
+
+class RequestCoalescer:
+    """Attaches duplicate requests to the computation already running for them.
+
+    A request is identified by the fingerprint of its canonical generation parameters and,
+    when the client sends one, by its idempotency key. A duplicate that arrives while the
+    original is running awaits the same task instead of starting new compute. Results are
+    replayed after completion only for idempotency keys, so a deliberate repeat of an
+    unseeded request still gets fresh images. Reusing a key for a different payload is
+    rejected with 422.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._inflight: Dict[str, Tuple["asyncio.Task[Any]", str]] = {}
+        self._completed: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        self.coalesced = 0
+        self.replayed = 0
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._completed and now - next(iter(self._completed.values()))[0] > self._ttl:
+            self._completed.popitem(last=False)
+
+    @staticmethod
+    def _check(key: str, stored: str, fingerprint: str) -> None:
+        if key.startswith("key:") and stored != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different payload.")
+
+    async def run(
+        self, fingerprint: str, idempotency_key: Optional[str], compute: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """Result of ``compute()`` or of the matching in-flight run, and whether it was shared."""
+        self._expire()
+        keys = ([f"key:{idempotency_key}"] if idempotency_key else []) + [f"payload:{fingerprint}"]
+        if idempotency_key and keys[0] in self._completed:
+            _finished, stored, result = self._completed[keys[0]]
+            self._check(keys[0], stored, fingerprint)
+            self.replayed += 1
+            return result, True
+        for key in keys:
+            running = self._inflight.get(key)
+            if running is not None:
+                task, stored = running
+                self._check(key, stored, fingerprint)
+                self.coalesced += 1
+                # shield: a waiter that goes away must not cancel the run others are waiting on
+                return await asyncio.shield(task), True
+
+        task = _spawn(compute())
+        for key in keys:
+            self._inflight[key] = (task, fingerprint)
+        task.add_done_callback(lambda done: self._finish(keys, fingerprint, done))
+        return await asyncio.shield(task), False
+
+    def _finish(self, keys: List[str], fingerprint: str, task: "asyncio.Task[Any]") -> None:
+        for key in keys:
+            if self._inflight.get(key, (None,))[0] is task:
+                del self._inflight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if keys[0].startswith("key:") and self._ttl > 0:
+            self._completed[keys[0]] = (time.monotonic(), fingerprint, task.result())
+            while len(self._completed) > self._max_entries:
+                self._completed.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len({id(task) for task, _fingerprint in self._inflight.values()}),
+            "coalesced_total": self.coalesced,
+            "replayed_total": self.replayed,
+            "idempotency_keys": len(self._completed),
+        }
+
+
+request_coalescer = RequestCoalescer(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_ENTRIES)
+
+
+class Warmup:
+    """Loads the preloaded models and exercises them once before the instance reports ready.
+
+    Every run times each step: one load per preloaded model, one short generation per model
+    and warm-up bucket, and one BLIP caption. Failures are recorded instead of raised, leaving
+    the instance not ready; the caller retries after MODEL_LOAD_RETRY_AFTER seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "pending"
+        self.attempts = 0
+        self.steps: List[Dict[str, Any]] = []
+        self.seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "done"
+
+    def _step(self, name: str, fn: Callable[[], Optional[Dict[str, Any]]]) -> bool:
+        started = time.perf_counter()
+        record: Dict[str, Any] = {"name": name}
         try:
-            sd_pipe.enable_xformers_memory_efficient_attention()
-        except ImportError:
-            pass  # xformers not available, continue without it
+            record.update(fn() or {})
+        except Exception as e:
+            record["error"] = str(e)
+            logger.error(f"Warm-up step '{name}' failed: {e}")
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        self.steps.append(record)
+        return "error" not in record
 
-    blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-    blip_model = BlipForConditionalGeneration.from_pretrained(
-        "Salesforce/blip-image-captioning-base",
-        torch_dtype=torch_dtype
-    ).to(device)
+    @staticmethod
+    def _buckets() -> List[Tuple[int, int]]:
+        ratios = list(ASPECT_RATIO_DIMENSIONS) if WARMUP_ASPECT_RATIOS == ["all"] else WARMUP_ASPECT_RATIOS
+        buckets: List[Tuple[int, int]] = []
+        for ratio in ratios:
+            dimensions = ASPECT_RATIO_DIMENSIONS.get(ratio)
+            if dimensions is None:
+                logger.warning(f"Skipping unknown warm-up aspect ratio {ratio}")
+            elif dimensions not in buckets:
+                buckets.append(dimensions)
+        return buckets
+
+    @staticmethod
+    def _load(model_id: str) -> None:
+        with model_registry.acquire(model_id):
+            pass
+
+    @staticmethod
+    def _generate(model_id: str, width: int, height: int) -> Dict[str, Any]:
+        guidance_scale = DRAFT_GUIDANCE_SCALE if model_id == DRAFT_MODEL_ID else OPTIMIZED_GUIDANCE_SCALE
+        _images, downgrades, _stages, _latents = _generate_batch(
+            model_id,
+            ["warm-up"],
+            [0],
+            width=width,
+            height=height,
+            steps=WARMUP_STEPS,
+            guidance_scale=guidance_scale,
+            images_per_prompt=NUM_IMAGES,
+            cancelled=lambda: False,
+            on_progress=lambda _step, _total: None,
+        )
+        return {"downgrades": downgrades} if downgrades else {}
+
+    @staticmethod
+    def _caption() -> None:
+        buffer = io.BytesIO()
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (384, 384, 3), dtype=np.uint8)).save(buffer, "PNG")
+        _describe_images([buffer.getvalue()])
+
+    def run(self) -> bool:
+        with self._lock:
+            self.state = "running"
+            self.attempts += 1
+            self.steps = []
+            started = time.perf_counter()
+            models = [model_id for model_id in PRELOAD_MODELS if model_id in model_registry]
+            for model_id in set(PRELOAD_MODELS) - set(models):
+                logger.warning(f"Skipping preload of unknown model {model_id}")
+            if WARMUP_ENABLED and WARMUP_CAPTION and BLIP_MODEL_ID not in models:
+                models.append(BLIP_MODEL_ID)
+            ok = True
+            for model_id in models:
+                if not self._step(f"load {model_id}", lambda: self._load(model_id)):
+                    ok = False
+                    continue
+                if not WARMUP_ENABLED:
+                    continue
+                if model_id == BLIP_MODEL_ID:
+                    ok = self._step("caption", self._caption) and ok
+                    continue
+                for width, height in self._buckets():
+                    name = f"generate {model_id} {width}x{height}"
+                    ok = self._step(name, lambda: self._generate(model_id, width, height)) and ok
+            self.seconds = round(time.perf_counter() - started, 3)
+            self.state = "done" if ok else "failed"
+        logger.info(f"Warm-up {self.state} in {self.seconds:.2f} seconds (attempt {self.attempts})")
+        return ok
+
+    def report(self) -> Dict[str, Any]:
+        return {"state": self.state, "attempts": self.attempts, "seconds": self.seconds, "steps": list(self.steps)}
 
-except Exception as e:
-    raise RuntimeError(f"Failed to load models: {str(e)}")
 
-def base64_to_image(b64_string: str) -> Image.Image:
-    image_data = base64.b64decode(b64_string)
-    return Image.open(io.BytesIO(image_data))
+warmup = Warmup()
+
+
+def _readiness() -> Tuple[bool, Any]:
+    if worker_pool is not None:
+        return worker_pool.ready(), [
+            {"worker": worker["index"], "state": worker["state"], "warmup": worker["warmup"]}
+            for worker in worker_pool.stats()
+        ]
+    return warmup.ready, warmup.report()
+
+
+@app.on_event("startup")
+async def warm_up():
+    if worker_pool is not None:
+        # Every worker warms up its own models
+        worker_pool.start()
+        return
+
+    async def _warm_up():
+        while not await asyncio.to_thread(warmup.run):
+            await asyncio.sleep(MODEL_LOAD_RETRY_AFTER)
+
+    # In the background so the port opens immediately; /ready answers 503 until it is done
+    _spawn(_warm_up())
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    if worker_pool is not None:
+        worker_pool.close()
+
+
+def _extract_model(payload: Dict[str, Any]) -> str:
+    model_id = payload.get("model") or DEFAULT_MODEL_ID
+    if model_id not in AVAILABLE_MODELS:
+        raise HTTPException(status_code=422, detail=f"Invalid model. Must be one of {AVAILABLE_MODELS}")
+    return model_id
+
+
+def _extract_prompt(payload: Dict[str, Any]) -> str:
+    prompt = payload.get("prompt")
+    if not prompt or not isinstance(prompt, str):
+        raise HTTPException(status_code=422, detail="prompt field is required.")
+    return prompt
+
+
+def _extract_refine_prompt(payload: Dict[str, Any]) -> str:
+    refine_prompt = payload.get("refinePrompt") or payload.get("prompt")
+    if not refine_prompt or not isinstance(refine_prompt, str):
+        raise HTTPException(status_code=422, detail="refinePrompt field is required.")
+    return refine_prompt
+
+
+def _combined_refine_prompt(descriptions: List[str], refine_prompt: str) -> str:
+    return f"Based on: {'; '.join(descriptions)}. Incorporate: {refine_prompt}"
 
-def image_to_base64(image: Image.Image) -> str:
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode()
 
 def _extract_aspect_ratio(payload: Dict[str, Any]) -> str:
     raw_ratio = payload.get("aspectRatio") or payload.get("aspect_ratio") or payload.get("aspectratio")
@@ -116,6 +2104,47 @@ def _extract_aspect_ratio(payload: Dict[str, Any]) -> str:
     return raw_ratio
 
 
+def _extract_seed(payload: Dict[str, Any]) -> Optional[int]:
+    seed = payload.get("seed")
+    if seed is None:
+        return None
+    try:
+        return int(seed)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="seed must be an integer.")
+
+
+def _extract_strength(payload: Dict[str, Any], default: float) -> float:
+    try:
+        strength = float(payload.get("strength", default))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="strength must be a number.")
+    if not 0 < strength <= 1:
+        raise HTTPException(status_code=422, detail="strength must be in (0, 1].")
+    return strength
+
+
+def _extract_tier(payload: Dict[str, Any]) -> str:
+    tier = payload.get("tier") or "full"
+    if tier not in GENERATION_TIERS:
+        raise HTTPException(status_code=422, detail=f"Invalid tier. Must be one of {list(GENERATION_TIERS)}")
+    return tier
+
+
+def _tier_settings(tier: str, model_id: str) -> Tuple[str, int, float]:
+    """Model, denoising steps and guidance scale a generation tier runs with."""
+    if tier == "draft":
+        return DRAFT_MODEL_ID or model_id, DRAFT_STEPS, DRAFT_GUIDANCE_SCALE
+    return model_id, OPTIMIZED_STEPS, OPTIMIZED_GUIDANCE_SCALE
+
+
+def _draft_seeds(seed: Optional[int]) -> Tuple[int, List[int]]:
+    """Base seed of a draft (random unless given) and the per-image seeds /finalize takes."""
+    if seed is None:
+        seed = random.randrange(2 ** 31)
+    return seed, [seed + index for index in range(NUM_IMAGES)]
+
+
 def _extract_temperature(payload: Dict[str, Any]) -> float:
     temp = payload.get("temperature")
     if temp is None:
@@ -127,53 +2156,85 @@ def _extract_temperature(payload: Dict[str, Any]) -> float:
 
 
 @app.post("/generate")
-async def generate_images(payload: Dict[str, Any] = Body(...)):
+async def generate_images(request: Request, payload: Dict[str, Any] = Body(...)):
     try:
-        import time
         start_time = time.time()
+        timer = request.state.stage_timer = StageTimer()
 
-        prompt = payload.get("prompt")
-        if not prompt or not isinstance(prompt, str):
-            raise HTTPException(status_code=422, detail="prompt field is required.")
+        with timer.stage("request_decode"):
+            prompt = _extract_prompt(payload)
+            aspect_ratio = _extract_aspect_ratio(payload)
+            temperature = _extract_temperature(payload)
+            seed = _extract_seed(payload)
+            encoding = _extract_encoding(payload)
+            tier = _extract_tier(payload)
+            # Drafts run a few-step model without classifier-free guidance; "full" keeps the optimized defaults
+            model_id, num_inference_steps, guidance_scale = _tier_settings(tier, _extract_model(payload))
 
-        aspect_ratio = _extract_aspect_ratio(payload)
-        temperature = _extract_temperature(payload)
-
-        logger.info(f"Starting image generation - Prompt: {prompt[:50]}..., Aspect Ratio: {aspect_ratio}, Steps: {OPTIMIZED_STEPS}")
+        logger.info(f"Starting {tier} image generation - Prompt: {prompt[:50]}..., Aspect Ratio: {aspect_ratio}, Steps: {num_inference_steps}")
 
         # Map aspect ratio to SD dimensions
-        ratios = {
-            "1:1": (512, 512),
-            "9:16": (512, 912),
-            "16:9": (912, 512),
-            "3:4": (512, 680),
-            "4:3": (680, 512),
-            "3:2": (768, 512),
-            "2:3": (512, 768),
-            "5:4": (640, 512),
-            "4:5": (512, 640),
-            "21:9": (1152, 512),
-            "Auto": (512, 512),
-        }
-        width, height = ratios.get(aspect_ratio, (512, 512))
+        width, height = ASPECT_RATIO_DIMENSIONS.get(aspect_ratio, (512, 512))
 
-        # Generate images with optimized parameters
-        guidance_scale = OPTIMIZED_GUIDANCE_SCALE  # Use optimized fixed value instead of temperature mapping
-        num_inference_steps = OPTIMIZED_STEPS  # Reduced from default 50 for 50% speed improvement
-
-        images = sd_pipe(
-            prompt,
+        # Canonical parameters: identical requests share a result-cache entry and in-flight run
+        fingerprint = ResultCache.make_key(
+            model_id=model_id,
+            prompt=prompt,
+            negative_prompt=None,
             width=width,
             height=height,
-            num_images_per_prompt=NUM_IMAGES,
+            steps=num_inference_steps,
             guidance_scale=guidance_scale,
-            num_inference_steps=num_inference_steps,
-        ).images
+            scheduler=SD_SCHEDULER_NAME,
+            seed=seed,
+            images=NUM_IMAGES,
+            encoding=encoding,
+        )
+        cache_key = fingerprint if result_cache is not None and seed is not None else None
+        if cache_key is not None:
+            cached = await asyncio.to_thread(result_cache.get, cache_key)
+            if cached is not None:
+                logger.info(f"Serving cached result for seed {seed}")
+                seeds = _draft_seeds(seed)[1] if tier == "draft" else None
+                return _images_response(request, cached, encoding, timer=timer, seeds=seeds)
+
+        async def _compute() -> Tuple[List[bytes], List[str], Dict[str, float], Optional[List[int]], Optional[List[str]]]:
+            # Drafts always run seeded so /finalize can reproduce the chosen image's noise
+            run_seed, seeds = _draft_seeds(seed) if tier == "draft" else (seed, None)
+            async with inference_queue.slot():
+                images, downgrades, latents = await batch_scheduler.submit(
+                    prompt,
+                    model_id=model_id,
+                    width=width,
+                    height=height,
+                    steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    images_per_prompt=NUM_IMAGES,
+                    seed=run_seed,
+                    timer=timer,
+                )
+
+            with timer.stage("image_encode"):
+                encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+            if cache_key is not None:
+                await asyncio.to_thread(result_cache.put, cache_key, encoded)
+            handles = None
+            if latents is not None:
+                handles = latent_store.put(model_id, prompt, num_inference_steps, guidance_scale, latents)
+            return encoded, downgrades, dict(timer.stages), seeds, handles
 
+        idempotency_key = request.headers.get("idempotency-key") or payload.get("idempotencyKey")
+        (encoded, downgrades, stages, seeds, handles), shared = await request_coalescer.run(
+            fingerprint, str(idempotency_key) if idempotency_key else None, _compute
+        )
+        if shared:
+            logger.info("Attached duplicate request to an in-flight or recent generation")
+            timer.merge(stages)
+            return _images_response(request, encoded, encoding, downgrades, timer, seeds, handles)
         generation_time = time.time() - start_time
         logger.info(f"Image generation completed in {generation_time:.2f} seconds for {NUM_IMAGES} images")
-        return {"images": [image_to_base64(img) for img in images]}
-    except HTTPException:
+        return _images_response(request, encoded, encoding, downgrades, timer, seeds, handles)
+    except (HTTPException, ServiceUnavailableError):
         raise
     except torch.cuda.OutOfMemoryError:
         logger.error("CUDA out of memory - consider reducing steps or image size")
@@ -182,102 +2243,546 @@ async def generate_images(payload: Dict[str, Any] = Body(...)):
         logger.error(f"Error in image generation: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
 
+
+def _latents_to_previews(latents: torch.Tensor) -> List[str]:
+    """Cheap linear latent -> RGB projection instead of a full VAE decode."""
+    factors = torch.tensor(LATENT_RGB_FACTORS, dtype=torch.float32)
+    rgb = torch.einsum("bchw,cr->bhwr", latents.detach().float().cpu(), factors)
+    pixels = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).numpy()
+    previews = []
+    for array in pixels:
+        buffered = io.BytesIO()
+        Image.fromarray(array).save(buffered, format="JPEG", quality=70)
+        previews.append(base64.b64encode(buffered.getvalue()).decode())
+    return previews
+
+
+def _decode_latent_image(pipe, latents: torch.Tensor) -> Image.Image:
+    return _decode_latents(pipe, latents)[0]
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _run_streaming_generation(
+    model_id: str,
+    prompt: str,
+    width: int,
+    height: int,
+    seed: Optional[int],
+    steps: int,
+    guidance_scale: float,
+    preview_interval: int,
+    encoding: ImageEncoding,
+    emit: Callable[[str, Dict[str, Any]], None],
+    cancelled: threading.Event,
+) -> Tuple[bool, Dict[str, float]]:
+    """Denoise to latents while emitting progress, then decode and emit one image at a time.
+
+    Returns whether the run completed (False when the client went away and it was
+    interrupted) and its stage timings.
+    """
+    timer = StageTimer()
+
+    def _on_step_end(pipe, step_index, _timestep, callback_kwargs):
+        step = step_index + 1
+        emit("progress", {"step": step, "total": steps})
+        if preview_interval > 0 and step % preview_interval == 0 and step < steps:
+            emit("preview", {"step": step, "images": _latents_to_previews(callback_kwargs["latents"])})
+        if cancelled.is_set():
+            pipe._interrupt = True
+        return callback_kwargs
+
+    with model_registry.acquire(model_id) as pipe:
+        with model_registry.use_lock(model_id), _inference_context():
+            if prompt_cache is not None:
+                with timer.stage("text_encode"):
+                    prompt_kwargs = _prompt_embeddings(pipe, model_id, [prompt], guidance_scale)
+            else:
+                prompt_kwargs = {"prompt": prompt}
+            with timer.stage("denoise"):
+                latents = pipe(
+                    **prompt_kwargs,
+                    width=width,
+                    height=height,
+                    num_images_per_prompt=NUM_IMAGES,
+                    guidance_scale=guidance_scale,
+                    num_inference_steps=steps,
+                    generator=image_generators(seed, NUM_IMAGES),
+                    output_type="latent",
+                    callback_on_step_end=_denoise_step_callback(model_id, _on_step_end),
+                    callback_on_step_end_tensor_inputs=["latents"],
+                ).images
+
+        for index in range(latents.shape[0]):
+            if cancelled.is_set():
+                return False, timer.stages
+            with model_registry.use_lock(model_id), _inference_context(), timer.stage("vae_decode"):
+                image = _decode_latent_image(pipe, latents[index:index + 1])
+            with timer.stage("image_encode"):
+                encoded = encode_image(image, encoding)
+            with timer.stage("base64"):
+                data = base64.b64encode(encoded).decode()
+            emit("image", {"index": index, "image": data, "mimeType": encoding.media_type})
+    return True, timer.stages
+
+
+@app.post("/generate/stream")
+async def generate_images_stream(payload: Dict[str, Any] = Body(...)):
+    """Server-Sent Events variant of /generate.
+
+    Emits ``progress`` after every denoising step, a low-resolution ``preview`` every
+    ``previewInterval`` steps, one ``image`` event per finished image and a final
+    ``done`` (or ``error``) event.
+    """
+    prompt = _extract_prompt(payload)
+    aspect_ratio = _extract_aspect_ratio(payload)
+    _extract_temperature(payload)
+    seed = _extract_seed(payload)
+    encoding = _extract_encoding(payload)
+    tier = _extract_tier(payload)
+    model_id, steps, guidance_scale = _tier_settings(tier, _extract_model(payload))
+    seed, seeds = _draft_seeds(seed) if tier == "draft" else (seed, None)
+    try:
+        preview_interval = int(payload.get("previewInterval", PREVIEW_INTERVAL))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="previewInterval must be an integer.")
+    width, height = ASPECT_RATIO_DIMENSIONS.get(aspect_ratio, (512, 512))
+
+    admitted = inference_queue.admit()
+    loop = asyncio.get_running_loop()
+    events: "asyncio.Queue[Optional[Tuple[str, Dict[str, Any]]]]" = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def emit(event: str, data: Dict[str, Any]) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    async def _produce() -> None:
+        start_time = time.time()
+        kwargs = dict(
+            model_id=model_id,
+            prompt=prompt,
+            width=width,
+            height=height,
+            seed=seed,
+            steps=steps,
+            guidance_scale=guidance_scale,
+            preview_interval=preview_interval,
+            encoding=encoding,
+        )
+        try:
+            if worker_pool is None:
+                completed, _stages = await inference_queue.run(
+                    _run_streaming_generation, **kwargs, emit=emit, cancelled=cancelled
+                )
+            else:
+                completed, stages = await inference_queue.run(
+                    worker_pool.call, "stream", kwargs, model_id=model_id, cancelled=cancelled.is_set, on_event=emit
+                )
+                _observe_stages(stages)
+            generation_time = time.time() - start_time
+            if completed:
+                logger.info(f"Streamed generation completed in {generation_time:.2f} seconds for {NUM_IMAGES} images")
+            done = {"images": NUM_IMAGES, "cancelled": not completed, "seconds": round(generation_time, 2)}
+            if seeds is not None:
+                done["seeds"] = seeds
+            events.put_nowait(("done", done))
+        except torch.cuda.OutOfMemoryError:
+            logger.error("CUDA out of memory during streamed generation")
+            events.put_nowait(("error", {"detail": "GPU memory insufficient. Try reducing steps or image size."}))
+        except ModelLoadError as e:
+            events.put_nowait(("error", {"detail": e.detail, "retryAfter": e.retry_after}))
+        except Exception as e:
+            logger.error(f"Error in streamed generation: {str(e)}")
+            events.put_nowait(("error", {"detail": f"Generation failed: {str(e)}"}))
+        finally:
+            inference_queue.release(admitted)
+            events.put_nowait(None)
+
+    _spawn(_produce())
+
+    async def _stream():
+        try:
+            while True:
+                item = await events.get()
+                if item is None:
+                    break
+                yield _sse_event(*item)
+        finally:
+            # Client disconnected or stream finished; stop denoising nobody is waiting for
+            cancelled.set()
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/live")
+async def liveness():
+    """Liveness probe: the process is up and its event loop responds."""
+    return {"status": "alive"}
+
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until the startup warm-up has finished."""
+    ready, report = _readiness()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "warmup": report})
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for monitoring"""
+    ready, report = _readiness()
     return {
-        "status": "healthy",
+        "status": "healthy" if ready else "starting",
+        "ready": ready,
+        "warmup": report,
         "device": device,
-        "model": "CompVis/stable-diffusion-v1-4",
+        "model": DEFAULT_MODEL_ID,
         "optimizations": {
             "steps": OPTIMIZED_STEPS,
             "guidance_scale": OPTIMIZED_GUIDANCE_SCALE,
             "scheduler": "DPMSolverMultistepScheduler",
-            "memory_optimizations": "attention_slicing" if device == "cuda" else "cpu_offloading"
-        }
+            "memory_optimizations": "attention_slicing" if device == "cuda" else "cpu_profile",
+            "cpu_profile": cpu_profile,
+            "batch_window_ms": BATCH_WINDOW_MS,
+            "max_batch_images": batch_scheduler.max_images,
+        },
+        "tiers": {
+            "full": {"model": DEFAULT_MODEL_ID, "steps": OPTIMIZED_STEPS, "guidance_scale": OPTIMIZED_GUIDANCE_SCALE},
+            "draft": {"model": DRAFT_MODEL_ID or None, "steps": DRAFT_STEPS, "guidance_scale": DRAFT_GUIDANCE_SCALE},
+            "finalize_strength": FINALIZE_STRENGTH,
+        },
+        "queue": inference_queue.stats(),
+        "models": model_registry.stats(),
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+        "oom_recovery": oom_recovery.stats(),
+        "coalescing": request_coalescer.stats(),
+        "result_cache": result_cache.stats() if result_cache is not None else None,
+        "prompt_cache": prompt_cache.stats() if prompt_cache is not None else None,
+        "caption_cache": caption_cache.stats() if caption_cache is not None else None,
+        "latent_store": latent_store.stats() if latent_store is not None else None,
+        "model_store": model_store.stats(),
     }
 
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape target: latency histograms plus cache, queue and model gauges."""
+    caches = {"result": result_cache, "prompt": prompt_cache, "caption": caption_cache}
+    enabled = {name: cache for name, cache in caches.items() if cache is not None}
+    queue = inference_queue.stats()
+    registry = model_registry.stats()
+    extra = [
+        (
+            "aura_cache_hits_total", "counter", "Cache lookups that found an entry.",
+            [({"cache": name}, cache.hits) for name, cache in enabled.items()],
+        ),
+        (
+            "aura_cache_misses_total", "counter", "Cache lookups that found nothing.",
+            [({"cache": name}, cache.misses) for name, cache in enabled.items()],
+        ),
+        ("aura_queue_depth", "gauge", "Admitted requests, queued or running.", [({}, queue["depth"])]),
+        ("aura_queue_rejected_total", "counter", "Requests rejected with 503 because the queue was full.", [({}, queue["rejected_total"])]),
+        (
+            "aura_model_loaded", "gauge", "1 when the model is resident in memory.",
+            [({"model": model_id}, int(info["loaded"])) for model_id, info in registry["models"].items()],
+        ),
+        ("aura_oom_recoveries_total", "counter", "Generations that recovered from out-of-memory errors.", [({}, oom_recovery.recoveries)]),
+        (
+            "aura_requests_deduplicated_total", "counter", "Duplicate requests served without new compute.",
+            [({"kind": "in_flight"}, request_coalescer.coalesced), ({"kind": "idempotency_replay"}, request_coalescer.replayed)],
+        ),
+    ]
+    return Response(content=metrics.render(extra), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/queue")
+async def queue_status():
+    """Admission queue depth and wait times"""
+    return inference_queue.stats()
+
+
+BENCHMARK_PROMPT = "A beautiful landscape with mountains and a lake"
+BENCHMARK_MAX_CONFIGS = 32
+BENCHMARK_STAGES = ("text_encode", "denoise", "vae_decode", "png_encode")
+
+
+def _resolve_benchmark_scheduler(name: str):
+    import diffusers
+    from diffusers import SchedulerMixin
+
+    scheduler_cls = getattr(diffusers, name, None)
+    if not isinstance(scheduler_cls, type) or not issubclass(scheduler_cls, SchedulerMixin):
+        raise HTTPException(status_code=422, detail=f"Unknown scheduler '{name}'.")
+    return scheduler_cls
+
+
+def _benchmark_iteration(pipe, width: int, height: int, steps: int, batch: int) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    execution_device = getattr(pipe, "_execution_device", device)
+    started = time.perf_counter()
+
+    # Encodes directly rather than through the prompt cache so the stage is actually measured
+    stage = time.perf_counter()
+    outputs = pipe.encode_prompt(
+        prompt=BENCHMARK_PROMPT,
+        device=execution_device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=OPTIMIZED_GUIDANCE_SCALE > 1,
+    )
+    prompt_kwargs = {"prompt_embeds": outputs[0], "negative_prompt_embeds": outputs[1]}
+    if len(outputs) > 2:
+        prompt_kwargs["pooled_prompt_embeds"] = outputs[2]
+        prompt_kwargs["negative_pooled_prompt_embeds"] = outputs[3]
+    if device == "cuda":
+        torch.cuda.synchronize()
+    timings["text_encode"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    latents = pipe(
+        **prompt_kwargs,
+        width=width,
+        height=height,
+        num_images_per_prompt=batch,
+        guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
+        num_inference_steps=steps,
+        generator=image_generators(0, batch),
+        output_type="latent",
+    ).images
+    if device == "cuda":
+        torch.cuda.synchronize()
+    timings["denoise"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    images = _decode_latents(pipe, latents)
+    timings["vae_decode"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    for image in images:
+        encode_image(image, DEFAULT_ENCODING)
+    timings["png_encode"] = time.perf_counter() - stage
+
+    timings["wall"] = time.perf_counter() - started
+    return timings
+
+
+def _run_benchmark(model_id: str, configs: List[Dict[str, Any]], warmup: int, iterations: int) -> List[Dict[str, Any]]:
+    """Time every configuration on the loaded pipeline; warm-up iterations are not recorded."""
+    results = []
+    with model_registry.acquire(model_id) as pipe:
+        for config in configs:
+            entry: Dict[str, Any] = {"config": config}
+            try:
+                with model_registry.use_lock(model_id), _inference_context():
+                    bench_pipe = pipe
+                    if config["scheduler"] != "default":
+                        scheduler_cls = _resolve_benchmark_scheduler(config["scheduler"])
+                        # A transient copy sharing every component, so the cached pipeline keeps its scheduler
+                        bench_pipe = type(pipe).from_pipe(pipe, scheduler=scheduler_cls.from_config(pipe.scheduler.config))
+                    args = (config["width"], config["height"], config["steps"], config["batch"])
+                    for _ in range(warmup):
+                        _benchmark_iteration(bench_pipe, *args)
+                    reset_peak_memory(device)
+                    samples = [_benchmark_iteration(bench_pipe, *args) for _ in range(iterations)]
+                    entry.update(peak_memory_mb(device))
+            except Exception as e:
+                if is_out_of_memory(e):
+                    free_memory()
+                entry["error"] = str(e)
+                results.append(entry)
+                continue
+
+            wall = summarize_timings([sample["wall"] for sample in samples])
+            denoise = summarize_timings([sample["denoise"] for sample in samples])
+            entry.update({
+                "wall_seconds": wall,
+                "images_per_second": round(config["batch"] / wall["p50"], 4),
+                "seconds_per_step": round(denoise["p50"] / config["steps"], 4),
+                "components": {name: summarize_timings([sample[name] for sample in samples]) for name in BENCHMARK_STAGES},
+            })
+            logger.info(
+                f"Benchmark {config['width']}x{config['height']} steps={config['steps']} batch={config['batch']} "
+                f"scheduler={config['scheduler']}: p50 {wall['p50']:.2f}s, {entry['images_per_second']:.3f} images/s"
+            )
+            results.append(entry)
+    return results
+
+
+def _benchmark_list(value: str, name: str, cast: Callable[[str], Any]) -> List[Any]:
+    try:
+        items = [cast(item.strip()) for item in value.split(",") if item.strip()]
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid {name} '{value}'.")
+    if not items:
+        raise HTTPException(status_code=422, detail=f"{name} must not be empty.")
+    return items
+
+
+def _benchmark_resolution(value: str) -> Tuple[int, int]:
+    width, height = (int(part) for part in value.lower().split("x"))
+    if width <= 0 or height <= 0 or width % 8 or height % 8:
+        raise ValueError(value)
+    return width, height
+
+
 @app.get("/benchmark")
-async def benchmark_system():
-    """Benchmark endpoint to test generation performance"""
-    import time
+async def benchmark_system(
+    model: Optional[str] = None,
+    resolutions: str = "512x512",
+    steps: str = str(OPTIMIZED_STEPS),
+    batch: str = "1",
+    schedulers: str = "default",
+    warmup: int = 1,
+    iterations: int = 3,
+):
+    """Sweep resolution x steps x batch x scheduler and report latency percentiles per configuration.
+
+    Precision is fixed per process (AURA_PRECISION) and reported rather than swept; use
+    scripts/benchmark.py for precision sweeps and results that compare across commits.
+    """
+    model_id = _extract_model({"model": model} if model else {})
+    sizes = _benchmark_list(resolutions, "resolutions", _benchmark_resolution)
+    step_counts = _benchmark_list(steps, "steps", int)
+    batch_sizes = _benchmark_list(batch, "batch", int)
+    scheduler_names = _benchmark_list(schedulers, "schedulers", str)
+    for name in scheduler_names:
+        if name != "default":
+            _resolve_benchmark_scheduler(name)
+    if warmup < 0 or iterations < 1 or min(step_counts) < 1 or min(batch_sizes) < 1:
+        raise HTTPException(status_code=422, detail="warmup must be >= 0; iterations, steps and batch must be >= 1.")
+
+    configs = [
+        {"width": width, "height": height, "steps": step_count, "batch": batch_size, "scheduler": scheduler}
+        for (width, height) in sizes
+        for step_count in step_counts
+        for batch_size in batch_sizes
+        for scheduler in scheduler_names
+    ]
+    if len(configs) > BENCHMARK_MAX_CONFIGS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Benchmark sweep has {len(configs)} configurations; at most {BENCHMARK_MAX_CONFIGS} are allowed.",
+        )
 
-    test_prompt = "A beautiful landscape with mountains and a lake"
     start_time = time.time()
+    benchmark_kwargs = dict(model_id=model_id, configs=configs, warmup=warmup, iterations=iterations)
+    async with inference_queue.slot():
+        if worker_pool is None:
+            results, profile = await inference_queue.run(_run_benchmark, **benchmark_kwargs), cpu_profile
+        else:
+            # Reports the profile of the worker that ran the sweep, not of the HTTP process
+            results, profile = await inference_queue.run(
+                worker_pool.call, "benchmark", benchmark_kwargs, model_id=model_id
+            )
 
-    try:
-        # Generate a single test image
-        images = sd_pipe(
-            test_prompt,
-            width=512,
-            height=512,
-            num_images_per_prompt=1,
-            guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
-            num_inference_steps=OPTIMIZED_STEPS
-        ).images
+    return {
+        "benchmark": "completed",
+        "model": model_id,
+        "prompt": BENCHMARK_PROMPT,
+        "device": device,
+        "precision": "int8" if quantize_int8 else str(torch_dtype).replace("torch.", ""),
+        "guidance_scale": OPTIMIZED_GUIDANCE_SCALE,
+        "cpu_profile": profile,
+        "warmup": warmup,
+        "iterations": iterations,
+        "total_seconds": round(time.time() - start_time, 2),
+        "results": results,
+    }
 
-        generation_time = time.time() - start_time
 
-        return {
-            "benchmark": "completed",
-            "prompt": test_prompt,
-            "generation_time_seconds": round(generation_time, 2),
-            "steps": OPTIMIZED_STEPS,
-            "device": device,
-            "guidance_scale": OPTIMIZED_GUIDANCE_SCALE,
-            "images_generated": len(images),
-            "performance_rating": "excellent" if generation_time < 60 else "good" if generation_time < 120 else "needs_optimization"
-        }
-    except Exception as e:
-        return {
-            "benchmark": "failed",
-            "error": str(e),
-            "device": device
-        }
+async def _refine_from_handle(
+    request: Request,
+    payload: Dict[str, Any],
+    handle: str,
+    refine_prompt: str,
+    encoding: ImageEncoding,
+    timer: StageTimer,
+):
+    """img2img straight from a stored generation's latents: no image decode, VAE encode or BLIP.
+
+    Runs with the stored generation's model, steps and guidance; ``strength`` sets the share of
+    those steps that are re-run (0.5 costs about half a fresh generation).
+    """
+    start_time = time.time()
+    entry = latent_store.get(handle) if latent_store is not None else None
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired image handle.")
+    strength = _extract_strength(payload, LATENT_REFINE_STRENGTH)
+    seed = _extract_seed(payload)
+    combined_prompt = _combined_refine_prompt([entry.prompt], refine_prompt)
+
+    logger.info(f"Starting latent refinement - Handle: {handle}, Strength: {strength}, Steps: {entry.steps}")
+    async with inference_queue.slot():
+        images, latents = await _img2img(
+            timer,
+            model_id=entry.model_id,
+            prompt=combined_prompt,
+            image=entry.latents,
+            strength=strength,
+            steps=entry.steps,
+            guidance_scale=entry.guidance_scale,
+            seed=seed,
+            images_per_prompt=NUM_IMAGES,
+        )
+
+    with timer.stage("image_encode"):
+        encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+    handles = latent_store.put(entry.model_id, combined_prompt, entry.steps, entry.guidance_scale, latents)
+    logger.info(f"Latent refinement completed in {time.time() - start_time:.2f} seconds for {NUM_IMAGES} images")
+    return _images_response(request, encoded, encoding, timer=timer, handles=handles)
+
 
 @app.post("/refine")
-async def refine_images(payload: Dict[str, Any] = Body(...)):
+async def refine_images(request: Request):
     try:
-        import time
         start_time = time.time()
+        timer = request.state.stage_timer = StageTimer()
 
-        raw_images = payload.get("images") or payload.get("baseImages")
-        if not isinstance(raw_images, list) or not raw_images:
-            raise HTTPException(status_code=422, detail="images field must contain base64 strings.")
+        with timer.stage("request_decode"):
+            payload, raw_images = await _read_refine_request(request)
+            encoding = _extract_encoding(payload)
+            model_id = _extract_model(payload)
+            refine_prompt = _extract_refine_prompt(payload)
 
-        refine_prompt = payload.get("refinePrompt") or payload.get("prompt")
-        if not refine_prompt or not isinstance(refine_prompt, str):
-            raise HTTPException(status_code=422, detail="refinePrompt field is required.")
+        handle = payload.get("handle")
+        if handle:
+            return await _refine_from_handle(request, payload, str(handle), refine_prompt, encoding, timer)
 
         logger.info(f"Starting image refinement - Images: {len(raw_images)}, Steps: {OPTIMIZED_STEPS}")
 
-        # Describe images using BLIP
-        descriptions = []
-        for b64 in raw_images:
-            try:
-                image = base64_to_image(b64)
-            except Exception:
-                raise HTTPException(status_code=400, detail="Invalid base64 string in images")
-            inputs = blip_processor(image, return_tensors="pt").to(device)
-            out = blip_model.generate(**inputs, max_length=50)
-            description = blip_processor.decode(out[0], skip_special_tokens=True)
-            descriptions.append(description)
-
-        # Combine descriptions with refine prompt
-        combined_prompt = f"Based on: {'; '.join(descriptions)}. Incorporate: {refine_prompt}"
-
-        # Generate new images with optimized parameters
-        images = sd_pipe(
-            combined_prompt,
-            num_images_per_prompt=NUM_IMAGES,
-            guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
-            num_inference_steps=OPTIMIZED_STEPS
-        ).images
+        async with inference_queue.slot():
+            # Describe images using BLIP
+            descriptions = await _caption_images(raw_images, timer)
+
+            # Combine descriptions with refine prompt
+            combined_prompt = _combined_refine_prompt(descriptions, refine_prompt)
+
+            # Generate new images with optimized parameters
+            images, downgrades, latents = await batch_scheduler.submit(
+                combined_prompt,
+                model_id=model_id,
+                width=None,
+                height=None,
+                steps=OPTIMIZED_STEPS,
+                guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
+                images_per_prompt=NUM_IMAGES,
+                timer=timer,
+            )
 
         refinement_time = time.time() - start_time
         logger.info(f"Image refinement completed in {refinement_time:.2f} seconds for {NUM_IMAGES} images")
-        return {"images": [image_to_base64(img) for img in images]}
-    except HTTPException:
+        with timer.stage("image_encode"):
+            encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+        handles = None
+        if latents is not None:
+            handles = latent_store.put(model_id, combined_prompt, OPTIMIZED_STEPS, OPTIMIZED_GUIDANCE_SCALE, latents)
+        return _images_response(request, encoded, encoding, downgrades, timer, handles=handles)
+    except (HTTPException, ServiceUnavailableError):
         raise
     except torch.cuda.OutOfMemoryError:
         logger.error("CUDA out of memory during refinement")
@@ -286,6 +2791,398 @@ async def refine_images(payload: Dict[str, Any] = Body(...)):
         logger.error(f"Error in image refinement: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Refinement failed: {str(e)}")
 
+
+def _load_draft(raw_image: bytes, width: int, height: int) -> Image.Image:
+    try:
+        draft = Image.open(io.BytesIO(raw_image)).convert("RGB")
+    except Exception:
+        raise HTTPException(status_code=422, detail="image must be a PNG, JPEG or WebP image.")
+    # Drafts may come from a smaller model; upscale to the full-quality size before re-denoising
+    if draft.size != (width, height):
+        draft = draft.resize((width, height), Image.LANCZOS)
+    return draft
+
+
+@app.post("/finalize")
+async def finalize_image(request: Request, payload: Dict[str, Any] = Body(...)):
+    """Re-run one image from a ``tier: "draft"`` generation at full quality.
+
+    Takes the chosen draft as ``image`` (base64), its seed from the draft response's
+    ``seeds`` and the original prompt and aspect ratio; ``strength`` (0-1] sets how much of
+    the full-quality schedule runs on top of the draft.
+    """
+    try:
+        start_time = time.time()
+        timer = request.state.stage_timer = StageTimer()
+
+        with timer.stage("request_decode"):
+            prompt = _extract_prompt(payload)
+            aspect_ratio = _extract_aspect_ratio(payload)
+            encoding = _extract_encoding(payload)
+            model_id = _extract_model(payload)
+            seed = _extract_seed(payload)
+            if seed is None:
+                raise HTTPException(status_code=422, detail="seed field is required; use the draft's seed.")
+            strength = _extract_strength(payload, FINALIZE_STRENGTH)
+            image = payload.get("image")
+            if not isinstance(image, str) or not image:
+                raise HTTPException(status_code=422, detail="image field must be a base64 string.")
+            try:
+                raw_image = base64.b64decode(image)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid base64 string in image")
+
+        width, height = ASPECT_RATIO_DIMENSIONS.get(aspect_ratio, (512, 512))
+        with timer.stage("image_decode"):
+            draft = await asyncio.to_thread(_load_draft, raw_image, width, height)
+
+        logger.info(f"Finalizing draft - Prompt: {prompt[:50]}..., Seed: {seed}, Strength: {strength}")
+        async with inference_queue.slot():
+            images, latents = await _img2img(
+                timer,
+                model_id=model_id,
+                prompt=prompt,
+                image=draft,
+                strength=strength,
+                steps=OPTIMIZED_STEPS,
+                guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
+                seed=seed,
+                images_per_prompt=1,
+            )
+
+        with timer.stage("image_encode"):
+            encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+        handles = None
+        if latents is not None:
+            handles = latent_store.put(model_id, prompt, OPTIMIZED_STEPS, OPTIMIZED_GUIDANCE_SCALE, latents)
+        logger.info(f"Draft finalized in {time.time() - start_time:.2f} seconds")
+        return _images_response(request, encoded, encoding, timer=timer, seeds=[seed], handles=handles)
+    except (HTTPException, ServiceUnavailableError):
+        raise
+    except torch.cuda.OutOfMemoryError:
+        logger.error("CUDA out of memory while finalizing a draft")
+        raise HTTPException(status_code=503, detail="GPU memory insufficient. Try reducing steps or image size.")
+    except Exception as e:
+        logger.error(f"Error finalizing draft: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Finalize failed: {str(e)}")
+
+
+JOB_TYPES = ("generate", "refine")
+JOB_FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobStore:
+    """SQLite records of asynchronous jobs, with result images stored as files next to the database.
+
+    Payloads are kept with the job so unfinished jobs can be resubmitted after a restart.
+    Finished jobs and their files are purged ``retention_seconds`` after completion.
+    """
+
+    def __init__(self, directory: str, retention_seconds: int):
+        self._directory = Path(directory).expanduser()
+        self._results = self._directory / "results"
+        self._results.mkdir(parents=True, exist_ok=True)
+        self._retention = retention_seconds
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self._directory / "jobs.sqlite3"), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock, self._db:
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    finished REAL,
+                    error TEXT,
+                    mime_type TEXT,
+                    images INTEGER NOT NULL DEFAULT 0,
+                    downgrades TEXT
+                )
+                """
+            )
+
+    def create(self, job_type: str, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO jobs (id, type, status, payload, created) VALUES (?, ?, 'queued', ?, ?)",
+                (job_id, job_type, json.dumps(payload), time.time()),
+            )
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, type, status, created, finished, error, mime_type, images, downgrades FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return dict(row) if row is not None else None
+
+    def unfinished(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, type, payload FROM jobs WHERE status = 'queued' ORDER BY created"
+            ).fetchall()
+        return [(row["id"], row["type"], json.loads(row["payload"])) for row in rows]
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        *,
+        images: Optional[List[bytes]] = None,
+        mime_type: Optional[str] = None,
+        downgrades: Optional[List[str]] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        if images:
+            tmp_dir = self._results / f".{job_id}.tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            tmp_dir.mkdir(parents=True)
+            for index, data in enumerate(images):
+                (tmp_dir / f"{index}.img").write_bytes(data)
+            tmp_dir.rename(self._results / job_id)
+        with self._lock, self._db:
+            # The payload (which may hold base images) is no longer needed once the job finished
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished = ?, error = ?, mime_type = ?, images = ?, downgrades = ?, "
+                "payload = '{}' WHERE id = ?",
+                (
+                    status,
+                    time.time(),
+                    error,
+                    mime_type,
+                    len(images or []),
+                    json.dumps(downgrades) if downgrades else None,
+                    job_id,
+                ),
+            )
+
+    def image(self, job_id: str, index: int) -> Optional[bytes]:
+        path = self._results / job_id / f"{index}.img"
+        return path.read_bytes() if path.is_file() else None
+
+    def purge(self) -> int:
+        cutoff = time.time() - self._retention
+        with self._lock, self._db:
+            expired = [
+                row["id"]
+                for row in self._db.execute(
+                    "SELECT id FROM jobs WHERE finished IS NOT NULL AND finished < ?", (cutoff,)
+                ).fetchall()
+            ]
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self._results / job_id, ignore_errors=True)
+        return len(expired)
+
+
+async def _execute_generate_job(payload: Dict[str, Any], control: JobControl) -> Tuple[List[bytes], ImageEncoding, List[str]]:
+    prompt = _extract_prompt(payload)
+    width, height = ASPECT_RATIO_DIMENSIONS.get(_extract_aspect_ratio(payload), (512, 512))
+    encoding = _extract_encoding(payload)
+    model_id, steps, guidance_scale = _tier_settings(_extract_tier(payload), _extract_model(payload))
+    images, downgrades, _latents = await batch_scheduler.submit(
+        prompt,
+        model_id=model_id,
+        width=width,
+        height=height,
+        steps=steps,
+        guidance_scale=guidance_scale,
+        images_per_prompt=NUM_IMAGES,
+        seed=_extract_seed(payload),
+        control=control,
+    )
+    encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+    return encoded, encoding, downgrades
+
+
+async def _execute_refine_job(payload: Dict[str, Any], control: JobControl) -> Tuple[List[bytes], ImageEncoding, List[str]]:
+    raw_images = await asyncio.to_thread(_decode_base64_images, payload)
+    encoding = _extract_encoding(payload)
+    control.started = True
+    descriptions = await _caption_images(raw_images)
+    if control.cancelled.is_set():
+        raise GenerationCancelled()
+    images, downgrades, _latents = await batch_scheduler.submit(
+        _combined_refine_prompt(descriptions, _extract_refine_prompt(payload)),
+        model_id=_extract_model(payload),
+        width=None,
+        height=None,
+        steps=OPTIMIZED_STEPS,
+        guidance_scale=OPTIMIZED_GUIDANCE_SCALE,
+        images_per_prompt=NUM_IMAGES,
+        control=control,
+    )
+    encoded = await asyncio.to_thread(lambda: [encode_image(img, encoding) for img in images])
+    return encoded, encoding, downgrades
+
+
+class JobRunner:
+    """Runs stored jobs in the background through the same batch scheduler as /generate and /refine."""
+
+    def __init__(self, store: JobStore):
+        self._store = store
+        self._active: Dict[str, JobControl] = {}
+
+    def submit(self, job_id: str, job_type: str, payload: Dict[str, Any], admitted: float) -> None:
+        control = self._active[job_id] = JobControl()
+        _spawn(self._run(job_id, job_type, payload, control, admitted))
+
+    def control(self, job_id: str) -> Optional[JobControl]:
+        return self._active.get(job_id)
+
+    async def _run(self, job_id: str, job_type: str, payload: Dict[str, Any], control: JobControl, admitted: float) -> None:
+        execute = _execute_refine_job if job_type == "refine" else _execute_generate_job
+        start_time = time.time()
+        try:
+            encoded, encoding, downgrades = await execute(payload, control)
+            if control.cancelled.is_set():
+                # Shared a batch with requests that were not cancelled
+                raise GenerationCancelled()
+            await asyncio.to_thread(
+                self._store.finish, job_id, "succeeded", images=encoded, mime_type=encoding.media_type, downgrades=downgrades
+            )
+            logger.info(f"Job {job_id} ({job_type}) completed in {time.time() - start_time:.2f} seconds")
+        except GenerationCancelled:
+            logger.info(f"Job {job_id} cancelled")
+            await asyncio.to_thread(self._store.finish, job_id, "cancelled")
+        except (HTTPException, ServiceUnavailableError) as e:
+            await asyncio.to_thread(self._store.finish, job_id, "failed", error=str(e.detail))
+        except Exception as e:
+            logger.error(f"Error in job {job_id}: {str(e)}")
+            await asyncio.to_thread(self._store.finish, job_id, "failed", error=str(e))
+        finally:
+            inference_queue.release(admitted)
+            self._active.pop(job_id, None)
+
+    def resume(self) -> None:
+        """Resubmit jobs that were queued or running when the previous process stopped."""
+        for job_id, job_type, payload in self._store.unfinished():
+            logger.info(f"Resuming job {job_id} ({job_type})")
+            self.submit(job_id, job_type, payload, inference_queue.admit(force=True))
+
+
+job_store = JobStore(JOBS_DIR, JOB_RETENTION_SECONDS)
+job_runner = JobRunner(job_store)
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    await asyncio.to_thread(job_store.purge)
+    job_runner.resume()
+
+
+def _job_status(job: Dict[str, Any], include_images: bool) -> Dict[str, Any]:
+    job_id = job["id"]
+    status = job["status"]
+    control = job_runner.control(job_id)
+    body: Dict[str, Any] = {"id": job_id, "type": job["type"], "status": status, "createdAt": job["created"]}
+    if control is not None:
+        if control.cancelled.is_set():
+            status = "cancelling"
+        elif control.started:
+            status = "running"
+        body["status"] = status
+        body["progress"] = {"step": control.step, "total": control.total or OPTIMIZED_STEPS}
+    if job["finished"] is not None:
+        body["finishedAt"] = job["finished"]
+    if job["error"]:
+        body["error"] = job["error"]
+    if status == "succeeded":
+        body["mimeType"] = job["mime_type"]
+        body["imageUrls"] = [f"/jobs/{job_id}/images/{index}" for index in range(job["images"])]
+        if job["downgrades"]:
+            body["downgrades"] = json.loads(job["downgrades"])
+        if include_images:
+            body["images"] = [
+                base64.b64encode(job_store.image(job_id, index) or b"").decode() for index in range(job["images"])
+            ]
+    return body
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(payload: Dict[str, Any] = Body(...)):
+    """Queue a generate or refine job and return immediately with its id.
+
+    The body is a /generate or /refine JSON payload plus ``"type"``; poll ``GET /jobs/{id}``
+    for progress and results, and ``POST /jobs/{id}/cancel`` to stop it between steps.
+    """
+    job_type = payload.get("type", "generate")
+    if job_type not in JOB_TYPES:
+        raise HTTPException(status_code=422, detail=f"Invalid type. Must be one of {list(JOB_TYPES)}")
+    # Validate up front so a malformed payload fails the POST instead of the job
+    _extract_encoding(payload)
+    _extract_model(payload)
+    seeds = None
+    if job_type == "generate":
+        _extract_prompt(payload)
+        _extract_aspect_ratio(payload)
+        _extract_temperature(payload)
+        seed = _extract_seed(payload)
+        if _extract_tier(payload) == "draft":
+            # Stored with the job so a resumed draft reproduces the seeds reported here
+            seed, seeds = _draft_seeds(seed)
+            payload = {**payload, "seed": seed}
+    else:
+        _extract_refine_prompt(payload)
+        await asyncio.to_thread(_decode_base64_images, payload)
+
+    admitted = inference_queue.admit()
+    try:
+        job_id = await asyncio.to_thread(job_store.create, job_type, payload)
+    except Exception:
+        inference_queue.release(admitted)
+        raise
+    job_runner.submit(job_id, job_type, payload, admitted)
+    _spawn(asyncio.to_thread(job_store.purge))
+    logger.info(f"Queued {job_type} job {job_id}")
+    body = {"id": job_id, "type": job_type, "status": "queued", "statusUrl": f"/jobs/{job_id}"}
+    if seeds is not None:
+        body["seeds"] = seeds
+    return body
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, images: bool = True):
+    """Job status and progress; finished jobs include their images unless ``images=false``."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return await asyncio.to_thread(_job_status, job, images)
+
+
+@app.get("/jobs/{job_id}/images/{index}")
+async def get_job_image(job_id: str, index: int):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    data = await asyncio.to_thread(job_store.image, job_id, index) if job is not None else None
+    if data is None:
+        raise HTTPException(status_code=404, detail="Image not found.")
+    return Response(content=data, media_type=job["mime_type"])
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Stop a queued or running job; a running pipeline stops after its current denoising step."""
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    control = job_runner.control(job_id)
+    if control is not None:
+        control.cancelled.set()
+    elif job["status"] not in JOB_FINISHED:
+        # Queued in the store but not running in this process
+        await asyncio.to_thread(job_store.finish, job_id, "cancelled")
+        job = await asyncio.to_thread(job_store.get, job_id)
+    return await asyncio.to_thread(_job_status, job, False)
+
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if len(sys.argv) == 3 and sys.argv[1] == "--worker":
+        _worker_main(int(sys.argv[2]))
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
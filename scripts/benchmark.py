@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""Benchmark Stable Diffusion generation across resolution, steps, batch, scheduler and precision.
+
+Every combination of the requested settings runs through the same loading, scheduler
+and VAE decode code as ``diffusion_runner.py``. Warm-up iterations are excluded from the
+statistics. Each configuration reports p50/p95 wall time, images per second, seconds per
+denoising step, peak RSS/VRAM and a per-component breakdown (text encode, denoise, VAE
+decode, PNG encode).
+
+Results are written as JSON so runs from different commits can be compared:
+
+    python scripts/benchmark.py --tiny --output bench-main.json
+    python scripts/benchmark.py --tiny --output bench-branch.json --compare bench-main.json
+
+``--tiny`` builds a small randomly initialized pipeline on disk, so the harness runs
+offline and in seconds; pass ``--model`` to benchmark real weights.
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import diffusers
+import torch
+
+import diffusion_runner as runner
+from aura_diffusion import cgroup_cpu_limit, encode_image, peak_memory_mb, reset_peak_memory, summarize_timings
+
+RESULTS_VERSION = 1
+DEFAULT_PROMPT = "A beautiful landscape with mountains and a lake"
+
+
+def _csv(text: str, cast: Callable[[str], Any] = str) -> List[Any]:
+    return [cast(item.strip()) for item in text.split(",") if item.strip()]
+
+
+def _parse_resolution(text: str) -> Tuple[int, int]:
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid resolution '{text}', expected WIDTHxHEIGHT")
+    return width, height
+
+
+def _sync(device: str) -> None:
+    if device == "cuda":
+        torch.cuda.synchronize()
+
+
+def _encode_prompt(pipeline, prompt: str, guidance_scale: float) -> Dict[str, torch.Tensor]:
+    outputs = pipeline.encode_prompt(
+        prompt=prompt,
+        device=pipeline._execution_device,
+        num_images_per_prompt=1,
+        do_classifier_free_guidance=guidance_scale > 1,
+    )
+    kwargs = {"prompt_embeds": outputs[0], "negative_prompt_embeds": outputs[1]}
+    if len(outputs) > 2:
+        # SDXL also returns pooled embeddings
+        kwargs["pooled_prompt_embeds"] = outputs[2]
+        kwargs["negative_pooled_prompt_embeds"] = outputs[3]
+    return kwargs
+
+
+def _run_iteration(pipeline, config: Dict[str, Any], device: str, prompt: str) -> Dict[str, float]:
+    timings: Dict[str, float] = {}
+    encoding = runner._parse_encoding({})
+    started = time.perf_counter()
+
+    stage = time.perf_counter()
+    prompt_kwargs = _encode_prompt(pipeline, prompt, config["guidance_scale"])
+    _sync(device)
+    timings["text_encode"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    latents = pipeline(
+        **prompt_kwargs,
+        width=config["width"],
+        height=config["height"],
+        num_inference_steps=config["steps"],
+        guidance_scale=config["guidance_scale"],
+        num_images_per_prompt=config["batch"],
+        generator=torch.Generator("cpu").manual_seed(0),
+        output_type="latent",
+    ).images
+    _sync(device)
+    timings["denoise"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    images = runner._decode_latents(pipeline, latents)
+    _sync(device)
+    timings["vae_decode"] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    for image in images:
+        encode_image(image, encoding)
+    timings["png_encode"] = time.perf_counter() - stage
+
+    timings["wall"] = time.perf_counter() - started
+    return timings
+
+
+def config_key(config: Dict[str, Any]) -> str:
+    return (
+        f"{config['width']}x{config['height']}/steps{config['steps']}/batch{config['batch']}"
+        f"/{config['scheduler']}/{config['precision']}"
+    )
+
+
+def benchmark_config(
+    model_id: str, config: Dict[str, Any], device_pref: str, warmup: int, iterations: int, prompt: str
+) -> Dict[str, Any]:
+    device = runner._select_device(device_pref)
+    dtype = runner._select_dtype(device, config["precision"])
+    quantize = runner._wants_int8(device, config["precision"])
+    pipeline = runner._load_pipeline("txt2img", model_id, device, dtype, quantize)
+    scheduler = None if config["scheduler"] == "default" else config["scheduler"]
+    pipeline_key = runner._pipeline_key(model_id, device, dtype, quantize)
+
+    with runner.SCHEDULER_POOL.checkout(pipeline_key, "txt2img", pipeline, scheduler) as scheduled, \
+            runner._inference_context(device, autocast=not quantize):
+        scheduled.set_progress_bar_config(disable=True)
+        for _ in range(warmup):
+            _run_iteration(scheduled, config, device, prompt)
+        reset_peak_memory(device)
+        samples = [_run_iteration(scheduled, config, device, prompt) for _ in range(iterations)]
+        peak_memory = peak_memory_mb(device)
+
+    wall = summarize_timings([sample["wall"] for sample in samples])
+    denoise = summarize_timings([sample["denoise"] for sample in samples])
+    return {
+        "device": device,
+        # Precision actually used, e.g. fp16 falls back to float32 on the CPU
+        "variant": pipeline_key[2].replace("torch.", ""),
+        "wall_seconds": wall,
+        "images_per_second": round(config["batch"] / wall["p50"], 4),
+        "seconds_per_step": round(denoise["p50"] / config["steps"], 4),
+        "components": {
+            name: summarize_timings([sample[name] for sample in samples])
+            for name in ("text_encode", "denoise", "vae_decode", "png_encode")
+        },
+        **peak_memory,
+    }
+
+
+def build_tiny_pipeline(directory: Path) -> Path:
+    """Save a tiny randomly initialized SD pipeline (with its own byte-level tokenizer) to ``directory``."""
+    from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    if (directory / "model_index.json").exists():
+        return directory
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Same byte -> printable character table as GPT-2/CLIP BPE, without any merges
+    printable = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1))
+    printable += list(range(ord("®"), ord("ÿ") + 1))
+    characters = [chr(code) for code in printable]
+    characters += [chr(256 + offset) for offset in range(256 - len(printable))]
+    vocab: Dict[str, int] = {}
+    for suffix in ("", "</w>"):
+        for character in characters:
+            vocab[character + suffix] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+    tokenizer_dir = Path(tempfile.mkdtemp(prefix="tiny-tokenizer-"))
+    (tokenizer_dir / "vocab.json").write_text(json.dumps(vocab))
+    (tokenizer_dir / "merges.txt").write_text("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(str(tokenizer_dir / "vocab.json"), str(tokenizer_dir / "merges.txt"), model_max_length=77)
+
+    torch.manual_seed(0)
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            bos_token_id=vocab["<|startoftext|>"],
+            eos_token_id=vocab["<|endoftext|>"],
+            pad_token_id=vocab["<|endoftext|>"],
+            hidden_size=32,
+            intermediate_size=37,
+            num_attention_heads=4,
+            num_hidden_layers=2,
+            vocab_size=len(vocab),
+            projection_dim=32,
+        )
+    )
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+        norm_num_groups=8,
+        attention_head_dim=4,
+    )
+    # Four blocks give the usual 8x latent scale factor
+    vae = AutoencoderKL(
+        block_out_channels=[8, 8, 16, 16],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 4,
+        up_block_types=["UpDecoderBlock2D"] * 4,
+        latent_channels=4,
+        norm_num_groups=8,
+        sample_size=64,
+    )
+    pipeline = StableDiffusionPipeline(
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        unet=unet,
+        scheduler=EulerDiscreteScheduler(),
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    pipeline.save_pretrained(directory)
+    return directory
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip() or None
+
+
+def _environment(device_pref: str) -> Dict[str, Any]:
+    device = runner._select_device(device_pref)
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "platform": platform.platform(),
+        "device": device,
+        "device_name": torch.cuda.get_device_name() if device == "cuda" else platform.processor() or None,
+        "cpu_count": cgroup_cpu_limit(),
+        "cpu_profile": runner._cpu_profile() if device == "cpu" else None,
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """One line per configuration present in both runs: p50 wall time and its relative change."""
+    previous = {entry["key"]: entry for entry in baseline.get("results", []) if "wall_seconds" in entry}
+    lines = []
+    for entry in results["results"]:
+        before = previous.get(entry["key"])
+        if before is None or "wall_seconds" not in entry:
+            continue
+        old, new = before["wall_seconds"]["p50"], entry["wall_seconds"]["p50"]
+        change = (new - old) / old * 100 if old else 0.0
+        lines.append(f"{entry['key']:<48} {old:>9.3f}s -> {new:>9.3f}s  {change:+6.1f}%")
+    return lines
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark Stable Diffusion generation settings.")
+    parser.add_argument("--model", default=runner.DEFAULT_TEXT_MODEL, help="Model id or local path to benchmark.")
+    parser.add_argument(
+        "--tiny",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="DIR",
+        help="Benchmark a tiny random pipeline (built in DIR, or a temporary directory) instead of --model.",
+    )
+    parser.add_argument("--resolutions", type=lambda text: _csv(text, _parse_resolution), default=[(512, 512)])
+    parser.add_argument("--steps", type=lambda text: _csv(text, int), default=[15])
+    parser.add_argument("--batch", type=lambda text: _csv(text, int), default=[1])
+    parser.add_argument(
+        "--schedulers",
+        type=_csv,
+        default=["default"],
+        help=f"Comma-separated scheduler names: default, {', '.join(runner.SCHEDULER_REGISTRY)}.",
+    )
+    parser.add_argument("--precisions", type=_csv, default=[runner.DEFAULT_PRECISION])
+    parser.add_argument("--guidance-scale", type=float, default=7.0)
+    parser.add_argument("--device", default=runner.DEFAULT_DEVICE)
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed iterations per configuration.")
+    parser.add_argument("--iterations", type=int, default=3, help="Timed iterations per configuration.")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--output", help="Write JSON results to this file.")
+    parser.add_argument("--compare", help="Previous JSON results to compare p50 wall times against.")
+    args = parser.parse_args(argv)
+    if args.iterations < 1:
+        parser.error("--iterations must be at least 1")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    model_id = args.model
+    if args.tiny is not None:
+        tiny_dir = Path(args.tiny) if args.tiny else Path(tempfile.mkdtemp(prefix="tiny-sd-"))
+        model_id = str(build_tiny_pipeline(tiny_dir))
+
+    results: Dict[str, Any] = {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": _git_commit(),
+        "model": "tiny-random" if args.tiny is not None else model_id,
+        "settings": {
+            "warmup": args.warmup,
+            "iterations": args.iterations,
+            "guidance_scale": args.guidance_scale,
+            "prompt": args.prompt,
+        },
+        "environment": _environment(args.device),
+        "results": [],
+    }
+
+    sweep = itertools.product(args.resolutions, args.steps, args.batch, args.schedulers, args.precisions)
+    for (width, height), steps, batch, scheduler, precision in sweep:
+        config = {
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "batch": batch,
+            "scheduler": scheduler,
+            "precision": precision,
+            "guidance_scale": args.guidance_scale,
+        }
+        entry: Dict[str, Any] = {"key": config_key(config), "config": config}
+        try:
+            entry.update(benchmark_config(model_id, config, args.device, args.warmup, args.iterations, args.prompt))
+            print(
+                f"{entry['key']:<48} p50 {entry['wall_seconds']['p50']:.3f}s  "
+                f"p95 {entry['wall_seconds']['p95']:.3f}s  {entry['images_per_second']:.3f} img/s  "
+                f"{entry['seconds_per_step']:.4f} s/step",
+                file=sys.stderr,
+                flush=True,
+            )
+        except Exception as exc:  # noqa: BLE001
+            entry["error"] = str(exc)
+            print(f"{entry['key']:<48} failed: {exc}", file=sys.stderr, flush=True)
+        results["results"].append(entry)
+
+    document = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(document + "\n")
+    else:
+        sys.stdout.write(document + "\n")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        print(f"Compared with {baseline.get('git_commit') or args.compare}:", file=sys.stderr)
+        for line in compare(results, baseline):
+            print(line, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
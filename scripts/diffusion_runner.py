@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-"""Executes Stable Diffusion pipelines and returns PNG images encoded as base64 strings.
+"""Executes Stable Diffusion pipelines and returns encoded images as base64 strings or files.
 
 The script expects a JSON payload on stdin with the shape:
 {
@@ -10,48 +10,143 @@ The script expects a JSON payload on stdin with the shape:
   "height": 1024,
   "guidance_scale": 7.5,
   "num_inference_steps": 30,
-  "precision": "auto" | "fp16" | "bf16" | "fp32",
+  "precision": "auto" | "fp16" | "bf16" | "fp32" | "int8",
   "device": "auto" | "cuda" | "cpu" | "mps",
-  "output_format": "png",
+  "output_format": "png" | "webp" | "jpeg",
+  "quality": 90,
+  "compress_level": 6,
+  "output_dir": "/optional/dir",
   "scheduler": "DDIM",
   "strength": 0.6,
-  "init_images": ["<base64>"]
+  "init_images": ["<base64>"],
+  "init_image_paths": ["/optional/file.png"],
+  "init_image_weights": [0.7, 0.3],
+  "blend_mode": "pixel" | "latent",
+  "seed": 1234,
+  "tier": "full" | "draft",
+  "finalize": false
 }
 
 It prints a JSON document to stdout with either:
-- {"success": true, "images": ["<base64>", ...], "diagnostics": {...}}
+- {"success": true, "images": ["<base64>", ...], "mimeType": "image/png", "diagnostics": {...}}
 - {"success": false, "error": "message", "errorType": "vram"|"runtime"|"validation", "diagnostics": {...}}
+
+When started with ``--serve`` the runner stays alive and keeps its pipelines warm
+between requests. It reads newline-delimited JSON payloads (each carrying an
+``"id"``) from stdin, or from a Unix socket when ``--socket PATH`` is given, and
+writes exactly one JSON line per request echoing that ``"id"``. Pipelines load on
+first use (or up front with ``--preload MODEL_ID``) and the least recently used
+ones are evicted once ``SD_MODEL_MEMORY_BUDGET_MB`` is exceeded.
+
+When ``output_dir`` is given, encoded images are written there and returned as
+``"paths"`` instead of base64, and ``init_image_paths`` lets callers pass base
+images as files; both skip the base64/JSON copies for local callers.
+
+``"tier": "draft"`` swaps in a few-step distilled model (``SD_DRAFT_MODEL_ID``) with
+``SD_DRAFT_STEPS`` steps and no classifier-free guidance, and always reports the seed
+it used in ``diagnostics.seed``. Each image of a seeded request is denoised from its own
+seed (``seed + index``), listed in ``diagnostics.seeds``. To finalize a chosen draft,
+send it back as an img2img ``init_images`` entry with that image's seed and
+``"finalize": true``; the draft is resized to ``width`` x ``height`` and re-denoised by
+the full-quality model.
 """
 
 from __future__ import annotations
 
+import argparse
 import base64
+import gc
+import hashlib
 import io
 import json
+import logging
 import os
+import socketserver
 import sys
+import threading
+import time
 import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import torch
 from diffusers import (
+    AutoPipelineForImage2Image,
+    AutoPipelineForText2Image,
     DDIMScheduler,
     DPMSolverMultistepScheduler,
     EulerAncestralDiscreteScheduler,
     EulerDiscreteScheduler,
-    StableDiffusionImg2ImgPipeline,
-    StableDiffusionPipeline,
 )
 from PIL import Image
 
-PIPELINE_CACHE: Dict[Tuple[str, str, str], Any] = {}
+from aura_diffusion import (
+    DEFAULT_IMAGE_QUALITY,
+    DEFAULT_PNG_COMPRESS_LEVEL,
+    DEFAULT_VAE_TILING_PIXELS,
+    IMAGE_FORMATS,
+    ImageEncoding,
+    ModelStore,
+    OomRecovery,
+    PromptEmbeddingCache,
+    PromptEmbeddings,
+    ResultCache,
+    apply_cpu_profile,
+    configure_cpu,
+    decode_latents,
+    encode_image,
+    free_memory,
+    image_generators,
+    inference_context,
+    is_out_of_memory,
+    load_int8_components,
+    weights_revision,
+)
 
 DEFAULT_TEXT_MODEL = os.environ.get("SD_MODEL_ID", "stabilityai/stable-diffusion-xl-base-1.0")
 DEFAULT_IMG2IMG_MODEL = os.environ.get("SD_IMG2IMG_MODEL_ID", DEFAULT_TEXT_MODEL)
 DEFAULT_PRECISION = os.environ.get("SD_PRECISION", "auto")
 DEFAULT_DEVICE = os.environ.get("SD_DEVICE", "auto")
 DEFAULT_SCHEDULER = os.environ.get("SD_SCHEDULER")
+# Few-step distilled model behind tier "draft" (empty = the requested model at draft settings)
+DRAFT_MODEL_ID = os.environ.get("SD_DRAFT_MODEL_ID", "stabilityai/sdxl-turbo")
+# Draft steps and guidance; guidance <= 1 skips classifier-free guidance (one UNet pass per step)
+DRAFT_STEPS = int(os.environ.get("SD_DRAFT_STEPS", "4"))
+DRAFT_GUIDANCE_SCALE = float(os.environ.get("SD_DRAFT_GUIDANCE_SCALE", "0"))
+GENERATION_TIERS = ("full", "draft")
+# How several img2img init images are merged: averaged pixels, or averaged VAE latents
+BLEND_MODES = ("pixel", "latent")
+
+RESULT_CACHE_ENABLED = os.environ.get("SD_RESULT_CACHE", "0") == "1"
+RESULT_CACHE_MEMORY_MB = int(os.environ.get("SD_RESULT_CACHE_MEMORY_MB", "256"))
+RESULT_CACHE_DIR = os.environ.get("SD_RESULT_CACHE_DIR")
+RESULT_CACHE_DISK_MB = int(os.environ.get("SD_RESULT_CACHE_DISK_MB", "2048"))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("SD_RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+PROMPT_CACHE_SIZE = int(os.environ.get("SD_PROMPT_CACHE_SIZE", "256"))
+PNG_COMPRESS_LEVEL = int(os.environ.get("SD_PNG_COMPRESS_LEVEL", str(DEFAULT_PNG_COMPRESS_LEVEL)))
+# VAE decode: images decoded per VAE call, and tiled decoding from this many output pixels up
+VAE_DECODE_BATCH = int(os.environ.get("SD_VAE_DECODE_BATCH", "1"))
+VAE_TILING_PIXELS = int(os.environ.get("SD_VAE_TILING_PIXELS", str(DEFAULT_VAE_TILING_PIXELS)))
+# CPU performance profile, applied to pipelines loaded on the CPU
+CPU_CHANNELS_LAST = os.environ.get("SD_CPU_CHANNELS_LAST", "1") == "1"
+CPU_TORCH_COMPILE = os.environ.get("SD_TORCH_COMPILE", "0") == "1"
+TORCH_COMPILE_CACHE_DIR = os.environ.get(
+    "SD_TORCH_COMPILE_CACHE_DIR", str(Path.home() / ".cache" / "aura-reflect" / "torch-compile")
+)
+CPU_BF16 = os.environ.get("SD_CPU_BF16", "auto").lower()
+CPU_THREADS = int(os.environ.get("SD_CPU_THREADS", "0"))
+# Dynamically quantized modules for precision "int8", saved once per model and component
+QUANTIZED_CACHE_DIR = os.environ.get(
+    "SD_QUANTIZED_CACHE_DIR", str(Path.home() / ".cache" / "aura-reflect" / "int8")
+)
+# Warm pipelines beyond this many MB are evicted least recently used first (0 = unlimited)
+MODEL_MEMORY_BUDGET_MB = int(os.environ.get("SD_MODEL_MEMORY_BUDGET_MB", "0"))
+# Local model store written by scripts/download_models.py; ids in its manifest load offline
+MODELS_DIR = os.environ.get("SD_MODELS_DIR", str(Path(__file__).resolve().parent.parent / "models"))
 
 SCHEDULER_REGISTRY = {
     "ddim": DDIMScheduler,
@@ -75,12 +170,24 @@ class DiffusionDiagnostics:
     scheduler: Optional[str] = None
     steps: Optional[int] = None
     images: Optional[int] = None
+    cache: Optional[str] = None
+    prompt_cache: Optional[Dict[str, int]] = None
+    pipelines: Optional[Dict[str, Any]] = None
+    cpu_profile: Optional[Dict[str, Any]] = None
+    downgrades: Optional[List[str]] = None
+    timings: Optional[Dict[str, float]] = None
+    tier: Optional[str] = None
+    seed: Optional[int] = None
+    # Per-image seeds (seed + index) of a seeded request
+    seeds: Optional[List[int]] = None
 
 
 @dataclass
 class DiffusionResponse:
     success: bool
     images: Optional[List[str]] = None
+    paths: Optional[List[str]] = None
+    mimeType: Optional[str] = None
     error: Optional[str] = None
     errorType: Optional[str] = None
     diagnostics: Optional[Dict[str, Any]] = None
@@ -90,6 +197,135 @@ class ValidationError(Exception):
     pass
 
 
+class StageTimings:
+    """Wall-clock seconds per request stage, reported as ``diagnostics.timings``.
+
+    ``on_step_end`` is passed to the pipeline as ``callback_on_step_end`` to time the
+    individual denoising steps, which are reported as count, mean and max.
+    """
+
+    def __init__(self) -> None:
+        self.stages: Dict[str, float] = {}
+        self.steps: List[float] = []
+        self._last_step = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = self._last_step = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def on_step_end(self, pipeline, step_index, timestep, callback_kwargs):
+        now = time.perf_counter()
+        self.steps.append(now - self._last_step)
+        self._last_step = now
+        return callback_kwargs
+
+    def as_dict(self) -> Dict[str, float]:
+        timings = {name: round(seconds, 4) for name, seconds in self.stages.items()}
+        if self.steps:
+            timings["denoise_steps"] = len(self.steps)
+            timings["denoise_step_mean"] = round(sum(self.steps) / len(self.steps), 4)
+            timings["denoise_step_max"] = round(max(self.steps), 4)
+        return timings
+
+
+# Serializes pipeline access when the runner serves several socket clients.
+PIPELINE_LOCK = threading.Lock()
+
+
+def _pipeline_bytes(pipeline) -> int:
+    total = 0
+    for component in pipeline.components.values():
+        if isinstance(component, torch.nn.Module):
+            for tensor in list(component.parameters()) + list(component.buffers()):
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class PipelineCache:
+    """LRU of loaded models keyed by (model id, device, dtype), bounded by parameter bytes.
+
+    Each entry maps mode -> pipeline; every mode shares the modules of the txt2img
+    pipeline, so a model costs one set of weights however many modes use it. Entries
+    are only looked up and evicted while PIPELINE_LOCK is held, so the pipeline serving
+    the current request is never dropped underneath it.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self._budget = max(budget_bytes, 0)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Tuple[str, str, str], pipelines: Dict[str, Any]) -> None:
+        self._entries[key] = (pipelines, _pipeline_bytes(pipelines["txt2img"]))
+        self._entries.move_to_end(key)
+        self.loads += 1
+        if self._budget <= 0:
+            return
+        evicted = False
+        while len(self._entries) > 1 and self._resident_bytes() > self._budget:
+            old_key, _entry = self._entries.popitem(last=False)
+            SCHEDULER_POOL.drop(old_key)
+            _log_debug(f"Evicting model {old_key} to stay within the model memory budget")
+            self.evictions += 1
+            evicted = True
+        if evicted:
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def _resident_bytes(self) -> int:
+        return sum(size for _pipeline, size in self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": [
+                f"{'/'.join(key)} ({', '.join(pipelines)})" for key, (pipelines, _size) in self._entries.items()
+            ],
+            "resident_mb": round(self._resident_bytes() / (1024 * 1024), 1),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+PIPELINE_CACHE = PipelineCache(MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
+
+
+MODEL_STORE = ModelStore(MODELS_DIR)
+
+# Pipeline class per mode; all modes of a model are built from its txt2img components
+MODE_PIPELINES = {
+    "txt2img": AutoPipelineForText2Image,
+    "img2img": AutoPipelineForImage2Image,
+}
+
+
+RESULT_CACHE: Optional[ResultCache] = (
+    ResultCache(
+        RESULT_CACHE_MEMORY_MB * 1024 ** 2,
+        RESULT_CACHE_DIR,
+        RESULT_CACHE_DISK_MB * 1024 ** 2,
+        RESULT_CACHE_TTL_SECONDS,
+    )
+    if RESULT_CACHE_ENABLED
+    else None
+)
+
+
 def _log_debug(message: str) -> None:
     print(message, file=sys.stderr, flush=True)
 
@@ -111,6 +347,35 @@ def _select_device(preferred: str) -> str:
     return "cpu"
 
 
+_CPU_PROFILE: Optional[Dict[str, Any]] = None
+
+
+def _cpu_profile() -> Dict[str, Any]:
+    """Configure torch threading for the CPU once, on the first CPU request."""
+    global _CPU_PROFILE
+    if _CPU_PROFILE is None:
+        _CPU_PROFILE = configure_cpu(
+            CPU_THREADS,
+            channels_last=CPU_CHANNELS_LAST,
+            torch_compile=CPU_TORCH_COMPILE,
+            compile_cache_dir=TORCH_COMPILE_CACHE_DIR,
+            bf16=CPU_BF16,
+        )
+    return _CPU_PROFILE
+
+
+def _inference_context(device: str, autocast: bool = True):
+    return inference_context(autocast and device == "cpu" and _cpu_profile()["bf16_autocast"])
+
+
+def _wants_int8(device: str, precision: Optional[str]) -> bool:
+    if (precision or "").lower() != "int8":
+        return False
+    if device != "cpu":
+        raise ValidationError("int8 precision is only supported on the CPU.")
+    return True
+
+
 def _select_dtype(device: str, precision: str) -> torch.dtype:
     precision = (precision or "auto").lower()
 
@@ -126,36 +391,76 @@ def _select_dtype(device: str, precision: str) -> torch.dtype:
     return torch.float32
 
 
-def _load_pipeline(mode: str, model_id: str, device: str, dtype: torch.dtype):
-    cache_key = (mode, model_id, str(dtype))
-    pipeline = PIPELINE_CACHE.get(cache_key)
-    if pipeline is not None:
-        return pipeline
+def _pipeline_key(model_id: str, device: str, dtype: torch.dtype, quantize: bool = False) -> Tuple[str, str, str]:
+    return (model_id, device, "int8" if quantize else str(dtype))
 
+
+def _load_pipeline(mode: str, model_id: str, device: str, dtype: torch.dtype, quantize: bool = False):
+    pipeline_cls = MODE_PIPELINES.get(mode)
+    if pipeline_cls is None:
+        raise ValidationError(f"Unsupported mode '{mode}'.")
+
+    cache_key = _pipeline_key(model_id, device, dtype, quantize)
+    pipelines = PIPELINE_CACHE.get(cache_key)
+    if pipelines is None:
+        pipelines = {"txt2img": _load_base_pipeline(model_id, device, dtype, quantize)}
+        PIPELINE_CACHE.put(cache_key, pipelines)
+
+    pipeline = pipelines.get(mode)
+    if pipeline is None:
+        # Wraps the already-loaded UNet, VAE and text encoders; no weights are read or copied
+        pipeline = pipeline_cls.from_pipe(pipelines["txt2img"])
+        pipelines[mode] = pipeline
+    return pipeline
+
+
+def _load_base_pipeline(model_id: str, device: str, dtype: torch.dtype, quantize: bool = False):
+    _log_debug(f"Loading pipeline {model_id} ({dtype}) on {device}")
+
+    source, store_kwargs = MODEL_STORE.resolve(model_id, dtype)
     load_kwargs = {
         "use_safetensors": True,
+        **store_kwargs,
     }
+    revision = None
+    if quantize:
+        # Components found in the int8 cache are never loaded in fp32
+        revision = weights_revision(model_id, source, MODEL_STORE)
+        load_kwargs.update(load_int8_components(source, revision, QUANTIZED_CACHE_DIR, store_kwargs))
 
-    if mode == "txt2img":
-        pipeline = StableDiffusionPipeline.from_pretrained(model_id, torch_dtype=dtype, **load_kwargs)
-    elif mode == "img2img":
-        pipeline = StableDiffusionImg2ImgPipeline.from_pretrained(model_id, torch_dtype=dtype, **load_kwargs)
-    else:
-        raise ValidationError(f"Unsupported mode '{mode}'.")
+    pipeline = AutoPipelineForText2Image.from_pretrained(source, torch_dtype=dtype, **load_kwargs)
 
     if device == "cuda":
         pipeline = pipeline.to("cuda")
         pipeline.enable_attention_slicing()
-        pipeline.enable_vae_tiling()
     elif device == "mps":
         pipeline = pipeline.to("mps")
     else:
         pipeline = pipeline.to("cpu")
+        _cpu_profile()
+        if quantize and revision is None:
+            # A first hub download only has a snapshot commit once from_pretrained has fetched it
+            revision = weights_revision(model_id, source, MODEL_STORE)
+        apply_cpu_profile(
+            pipeline,
+            model_id,
+            channels_last=CPU_CHANNELS_LAST,
+            quantize=quantize,
+            torch_compile=CPU_TORCH_COMPILE,
+            quantized_cache_dir=QUANTIZED_CACHE_DIR,
+            revision=revision,
+        )
 
-    PIPELINE_CACHE[cache_key] = pipeline
     return pipeline
 
 
+def _load_init_image(path: str) -> Image.Image:
+    try:
+        return Image.open(path).convert("RGB")
+    except Exception as exc:  # noqa: BLE001
+        raise ValidationError(f"Failed to read base image '{path}'.") from exc
+
+
 def _decode_base64_image(payload: str) -> Image.Image:
     try:
         data = base64.b64decode(payload)
@@ -164,10 +469,74 @@ def _decode_base64_image(payload: str) -> Image.Image:
         raise ValidationError("Failed to decode base image. Ensure it is valid base64 PNG data.") from exc
 
 
-def _encode_png(image: Image.Image) -> str:
-    buffer = io.BytesIO()
-    image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+def _parse_encoding(payload: Dict[str, Any]) -> ImageEncoding:
+    image_format = str(payload.get("output_format") or "png").lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    if image_format not in IMAGE_FORMATS:
+        raise ValidationError(f"Unsupported output_format '{image_format}'.")
+    quality = int(payload.get("quality", DEFAULT_IMAGE_QUALITY))
+    compress_level = int(payload.get("compress_level", PNG_COMPRESS_LEVEL))
+    if not 1 <= quality <= 100 or not 0 <= compress_level <= 9:
+        raise ValidationError("quality must be 1-100 and compress_level 0-9.")
+    return ImageEncoding(format=image_format, quality=quality, compress_level=compress_level)
+
+
+def _image_response(
+    encoded: List[bytes],
+    encoding: ImageEncoding,
+    output_dir: Optional[str],
+    diagnostics: DiffusionDiagnostics,
+    timings: StageTimings,
+) -> DiffusionResponse:
+    media_type = encoding.media_type
+    if not output_dir:
+        with timings.stage("base64"):
+            images = [base64.b64encode(data).decode("utf-8") for data in encoded]
+        diagnostics.timings = timings.as_dict()
+        return DiffusionResponse(success=True, images=images, mimeType=media_type, diagnostics=diagnostics.__dict__)
+
+    with timings.stage("write"):
+        directory = Path(output_dir).expanduser()
+        directory.mkdir(parents=True, exist_ok=True)
+        extension = "jpg" if encoding.format == "jpeg" else encoding.format
+        stem = f"{int(time.time() * 1000)}-{os.getpid()}"
+        paths = []
+        for index, data in enumerate(encoded):
+            path = directory / f"{stem}-{index}.{extension}"
+            path.write_bytes(data)
+            paths.append(str(path))
+    diagnostics.timings = timings.as_dict()
+    return DiffusionResponse(success=True, paths=paths, mimeType=media_type, diagnostics=diagnostics.__dict__)
+
+
+def _result_cache_key(payload: Dict[str, Any], **resolved: Any) -> str:
+    init_images = payload.get("init_images") or []
+    init_image_paths = payload.get("init_image_paths") or []
+    init_digest = None
+    if init_images or init_image_paths:
+        digest = hashlib.sha256()
+        sources = [(b"b", item.encode("utf-8")) for item in init_images]
+        for path in init_image_paths:
+            try:
+                sources.append((b"f", Path(path).read_bytes()))
+            except OSError as exc:
+                raise ValidationError(f"Failed to read base image '{path}'.") from exc
+        # Kind and length prefixes keep different image lists from hashing the same bytes
+        for kind, data in sources:
+            digest.update(kind + len(data).to_bytes(8, "big"))
+            digest.update(data)
+        init_digest = digest.hexdigest()
+    return ResultCache.make_key(
+        prompt=payload.get("prompt"),
+        negative_prompt=payload.get("negative_prompt"),
+        strength=payload.get("strength") if init_digest else None,
+        init_images=init_digest,
+        init_image_weights=payload.get("init_image_weights") if init_digest else None,
+        blend_mode=payload.get("blend_mode") if init_digest else None,
+        finalize=bool(payload.get("finalize")) if init_digest else None,
+        **resolved,
+    )
 
 
 def _is_vram_error(error: BaseException) -> bool:
@@ -184,44 +553,265 @@ def _is_vram_error(error: BaseException) -> bool:
     )
 
 
-def _prepare_generator(device: str, seed: Optional[int]) -> Optional[torch.Generator]:
-    if seed is None:
-        return None
+def _decode_latents(pipeline, latents: torch.Tensor) -> List[Image.Image]:
+    return decode_latents(pipeline, latents, batch=VAE_DECODE_BATCH, tiling_pixels=VAE_TILING_PIXELS)
+
+
+# Images per pipeline call that worked after an OOM, per (model id, mode, width, height)
+OOM_RECOVERY = OomRecovery()
+
 
-    generator_device = device if device != "cpu" else "cpu"
-    generator = torch.Generator(generator_device)
-    generator.manual_seed(int(seed))
-    return generator
+def _denoise_with_recovery(
+    pipeline,
+    size_key: Tuple[str, str, int, int],
+    num_images: int,
+    seed: Optional[int],
+    call_kwargs: Dict[str, Any],
+    diagnostics: DiffusionDiagnostics,
+) -> torch.Tensor:
+    """Denoise to latents; on memory errors free caches and retry with cheaper settings.
+
+    The ladder halves the images per call down to sequential single-image runs, then
+    enables attention slicing, then (on CUDA) model CPU offload. Slicing and offload
+    only last for this call. Every step taken is recorded in ``diagnostics.downgrades``
+    and the images-per-call that worked is remembered in OOM_RECOVERY so later
+    requests start from it.
+
+    A seeded request gets one generator per image (``seed + index``), re-created for
+    every attempt, so its images do not depend on how the work was split.
+    """
+    downgrades: List[str] = []
+    limit = min(num_images, OOM_RECOVERY.safe_batch(size_key) or num_images)
+    if limit < num_images:
+        downgrades.append(f"split into runs of {limit} image(s) (learned)")
+    recovered = False
+    try:
+        with OOM_RECOVERY.ladder(pipeline) as degrade:
+            while True:
+                generators = image_generators(seed, num_images) if seed is not None else None
+                try:
+                    runs = []
+                    for start in range(0, num_images, limit):
+                        count = min(limit, num_images - start)
+                        run_generators = generators[start:start + count] if generators is not None else None
+                        runs.append(
+                            pipeline(
+                                **call_kwargs, num_images_per_prompt=count, generator=run_generators, output_type="latent"
+                            ).images
+                        )
+                except Exception as exc:  # noqa: BLE001
+                    if not is_out_of_memory(exc):
+                        raise
+                    free_memory()
+                    step = degrade(limit)
+                    if step is None:
+                        raise
+                    limit, downgrade = step
+                    recovered = True
+                    _log_debug(f"Out of memory generating {num_images} image(s); retrying with {downgrade}")
+                    downgrades.append(downgrade)
+                    continue
+                if recovered:
+                    OOM_RECOVERY.record(size_key, limit)
+                return torch.cat(runs)
+    finally:
+        diagnostics.downgrades = downgrades or None
 
 
 def _resolve_scheduler(pipeline, scheduler_name: Optional[str]):
+    """Scheduler class for a request, falling back to the pipeline's own scheduler."""
+    default_cls = type(pipeline.scheduler)
     if not scheduler_name:
-        return
+        return default_cls
 
-    key = scheduler_name.lower()
-    scheduler_cls = SCHEDULER_REGISTRY.get(key)
+    scheduler_cls = SCHEDULER_REGISTRY.get(scheduler_name.lower())
     if not scheduler_cls:
         _log_debug(f"Unknown scheduler '{scheduler_name}', keeping default")
-        return
-
-    try:
-        pipeline.scheduler = scheduler_cls.from_config(pipeline.scheduler.config)
-    except Exception as exc:  # noqa: BLE001
-        _log_debug(f"Failed to apply scheduler '{scheduler_name}': {exc}")
+        return default_cls
+    return scheduler_cls
+
+
+class SchedulerPool:
+    """Pipelines owning a private scheduler, pooled per (model, mode, scheduler class).
+
+    Schedulers carry per-run state (timesteps, step index), so requests never touch the
+    scheduler of a cached pipeline. Each request checks out a pipeline derived with
+    ``from_pipe``; it shares every other component with the cached pipeline and is
+    returned to the pool afterwards, so its scheduler is built once and reused.
+    """
+
+    def __init__(self):
+        self._free: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    @contextmanager
+    def checkout(self, cache_key: Tuple[str, str, str], mode: str, pipeline, scheduler_name: Optional[str]):
+        scheduler_cls = _resolve_scheduler(pipeline, scheduler_name)
+        key = (*cache_key, mode, scheduler_cls.__name__)
+        with self._lock:
+            free = self._free.get(key)
+            scheduled = free.pop() if free else None
+            if scheduled is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if scheduled is None:
+            scheduled = self._derive(pipeline, scheduler_cls, scheduler_name)
+        try:
+            yield scheduled
+        finally:
+            with self._lock:
+                self._free.setdefault(key, []).append(scheduled)
+
+    @staticmethod
+    def _derive(pipeline, scheduler_cls, scheduler_name: Optional[str]):
+        try:
+            scheduler = scheduler_cls.from_config(pipeline.scheduler.config)
+        except Exception as exc:  # noqa: BLE001
+            _log_debug(f"Failed to apply scheduler '{scheduler_name}': {exc}")
+            scheduler = type(pipeline.scheduler).from_config(pipeline.scheduler.config)
+        return type(pipeline).from_pipe(pipeline, scheduler=scheduler)
+
+    def drop(self, cache_key: Tuple[str, str, str]) -> None:
+        with self._lock:
+            for key in [key for key in self._free if key[:len(cache_key)] == cache_key]:
+                del self._free[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"created": self.created, "reused": self.reused}
+
+
+SCHEDULER_POOL = SchedulerPool()
+
+
+PROMPT_CACHE: Optional[PromptEmbeddingCache] = PromptEmbeddingCache(PROMPT_CACHE_SIZE) if PROMPT_CACHE_SIZE > 0 else None
+
+
+def _encode_text(pipeline, model_id: str, variant: str, text: str) -> PromptEmbeddings:
+    def _run_encoder() -> PromptEmbeddings:
+        with torch.no_grad():
+            outputs = pipeline.encode_prompt(
+                prompt=text,
+                device=pipeline._execution_device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+        # SDXL pipelines also return pooled embeddings as the third element
+        pooled = outputs[2] if len(outputs) > 2 else None
+        return outputs[0], pooled
+
+    return PROMPT_CACHE.get_or_encode((model_id, variant, text), _run_encoder)
+
+
+def _prompt_kwargs(
+    pipeline,
+    model_id: str,
+    variant: str,
+    prompt: str,
+    negative_prompt: Optional[str],
+    guidance_scale: float,
+) -> Dict[str, Any]:
+    if PROMPT_CACHE is None:
+        return {"prompt": prompt, "negative_prompt": negative_prompt}
+
+    embeds, pooled = _encode_text(pipeline, model_id, variant, prompt)
+    kwargs: Dict[str, Any] = {"prompt_embeds": embeds}
+    if pooled is not None:
+        kwargs["pooled_prompt_embeds"] = pooled
+
+    if guidance_scale > 1:
+        if negative_prompt is None and getattr(pipeline.config, "force_zeros_for_empty_prompt", False):
+            negative, negative_pooled = torch.zeros_like(embeds), torch.zeros_like(pooled) if pooled is not None else None
+        else:
+            negative, negative_pooled = _encode_text(pipeline, model_id, variant, negative_prompt or "")
+        kwargs["negative_prompt_embeds"] = negative
+        if negative_pooled is not None:
+            kwargs["negative_pooled_prompt_embeds"] = negative_pooled
+    return kwargs
 
 
-def _combine_images(images: List[Image.Image]) -> Image.Image:
-    if len(images) == 1:
+def _blend_weights(weights: Optional[List[Any]], count: int) -> np.ndarray:
+    """Normalized per-image blend weights; equal weights when none are given."""
+    if weights is None:
+        return np.full(count, 1 / count, dtype=np.float32)
+    try:
+        values = np.asarray([float(weight) for weight in weights], dtype=np.float32)
+    except (TypeError, ValueError) as exc:
+        raise ValidationError("init_image_weights must be numbers.") from exc
+    if values.shape != (count,):
+        raise ValidationError(f"init_image_weights needs one weight per base image ({count}).")
+    if (values < 0).any() or values.sum() <= 0:
+        raise ValidationError("init_image_weights must be non-negative and not all zero.")
+    return values / values.sum()
+
+
+def _image_array(image: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    """(H, W, 3) uint8 view of an init image converted to RGB and resized to ``size``."""
+    image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, Image.LANCZOS)
+    return np.asarray(image)
+
+
+def _image_batch(images: List[Image.Image], size: Tuple[int, int]) -> np.ndarray:
+    """All init images as one (N, H, W, 3) uint8 array at ``size``."""
+    width, height = size
+    batch = np.empty((len(images), height, width, 3), dtype=np.uint8)
+    for index, image in enumerate(images):
+        batch[index] = _image_array(image, size)
+    return batch
+
+
+def _combine_images(images: List[Image.Image], size: Tuple[int, int], weights: np.ndarray) -> Image.Image:
+    """Weighted mean of the init images at ``size``, accumulated in place one image at a time.
+
+    Unlike chained ``Image.blend`` calls this accepts mixed sizes and modes, takes per-image
+    weights and does not drift: the result stays within one level of the exact mean.
+    """
+    if len(images) == 1 and images[0].size == size:
         return images[0]
-
-    iterator = iter(images)
-    base = next(iterator)
-    for index, image in enumerate(iterator, start=2):
-        base = Image.blend(base, image, 1 / index)
-    return base
+    # 8.8 fixed point: 255 * 256 still fits uint16, and integer multiply-adds beat a float32 pass
+    fixed = np.rint(weights * 256).astype(np.int64)
+    fixed[np.argmax(fixed)] += 256 - fixed.sum()
+    width, height = size
+    blended = np.zeros((height, width, 3), dtype=np.uint16)
+    scaled = np.empty_like(blended)
+    for image, weight in zip(images, fixed.astype(np.uint16)):
+        np.multiply(_image_array(image, size), weight, out=scaled, dtype=np.uint16)
+        blended += scaled
+    blended += 128
+    blended >>= 8
+    return Image.fromarray(blended.astype(np.uint8))
+
+
+def _encode_init_latents(
+    pipeline, images: List[Image.Image], size: Tuple[int, int], weights: np.ndarray
+) -> torch.Tensor:
+    """VAE-encode every init image in one batched call and blend them in latent space.
+
+    The img2img pipeline takes the resulting 4-channel latents as its starting point and
+    skips its own VAE encode.
+    """
+    vae = pipeline.vae
+    pixels = torch.from_numpy(_image_batch(images, size)).permute(0, 3, 1, 2).float().div_(127.5).sub_(1.0)
+    upcast = vae.dtype == torch.float16 and getattr(vae.config, "force_upcast", False)
+    if upcast:
+        vae.to(torch.float32)
+    try:
+        with torch.no_grad():
+            latents = vae.encode(pixels.to(vae.device, vae.dtype)).latent_dist.mean
+    finally:
+        if upcast:
+            vae.to(torch.float16)
+    latents = latents * vae.config.scaling_factor
+    blend = torch.from_numpy(weights).to(latents.device, latents.dtype).view(-1, 1, 1, 1)
+    return (latents * blend).sum(dim=0, keepdim=True).to(pipeline.unet.dtype)
 
 
-def _handle_request(payload: Dict[str, Any]) -> DiffusionResponse:
+def _handle_request(payload: Dict[str, Any], timings: StageTimings) -> DiffusionResponse:
     mode = payload.get("mode", "txt2img")
     prompt = payload.get("prompt")
     model_id = payload.get("model_id") or (DEFAULT_IMG2IMG_MODEL if mode == "img2img" else DEFAULT_TEXT_MODEL)
@@ -234,86 +824,288 @@ def _handle_request(payload: Dict[str, Any]) -> DiffusionResponse:
     device_pref = payload.get("device", DEFAULT_DEVICE)
     scheduler_name = payload.get("scheduler", DEFAULT_SCHEDULER)
     seed = payload.get("seed")
+    encoding = _parse_encoding(payload)
+    output_dir = payload.get("output_dir")
+    tier = payload.get("tier") or "full"
 
     if not prompt:
         raise ValidationError("Prompt is required.")
+    if seed is not None:
+        try:
+            seed = int(seed)
+        except (TypeError, ValueError) as exc:
+            raise ValidationError("seed must be an integer.") from exc
+
+    if tier not in GENERATION_TIERS:
+        raise ValidationError(f"tier must be one of {list(GENERATION_TIERS)}.")
+    if tier == "draft":
+        model_id = DRAFT_MODEL_ID or model_id
+        steps = DRAFT_STEPS
+        guidance_scale = DRAFT_GUIDANCE_SCALE
+        # Distilled models only hold up with the scheduler they were trained with
+        scheduler_name = None
 
     if width % 8 != 0 or height % 8 != 0:
         raise ValidationError("Width and height must be multiples of 8.")
 
+    blend_mode = payload.get("blend_mode") or "pixel"
+    if blend_mode not in BLEND_MODES:
+        raise ValidationError(f"blend_mode must be one of {list(BLEND_MODES)}.")
+    blend_weights = None
+    if mode == "img2img":
+        init_count = len(payload.get("init_images") or []) + len(payload.get("init_image_paths") or [])
+        if init_count:
+            blend_weights = _blend_weights(payload.get("init_image_weights"), init_count)
+
     device = _select_device(device_pref)
     dtype = _select_dtype(device, precision)
-
-    pipeline = _load_pipeline(mode, model_id, device, dtype)
-    _resolve_scheduler(pipeline, scheduler_name)
-
-    generator = _prepare_generator(device, seed)
+    quantize = _wants_int8(device, precision)
+    pipeline_key = _pipeline_key(model_id, device, dtype, quantize)
+    cpu_profile = _cpu_profile() if device == "cpu" else None
 
     diagnostics = DiffusionDiagnostics(
         device=device,
         model_id=model_id,
-        precision=str(dtype).replace('torch.', ''),
+        precision=pipeline_key[2].replace('torch.', ''),
         width=width,
         height=height,
         scheduler=scheduler_name,
         steps=steps,
         images=num_images,
+        cpu_profile=cpu_profile,
+        tier=tier,
+        seed=seed,
+        seeds=[seed + index for index in range(num_images)] if seed is not None else None,
     )
 
+    cache_key = None
+    if RESULT_CACHE is not None and seed is not None:
+        cache_key = _result_cache_key(
+            payload,
+            mode=mode,
+            model_id=model_id,
+            dtype=pipeline_key[2],
+            width=width,
+            height=height,
+            steps=steps,
+            guidance_scale=guidance_scale,
+            scheduler=scheduler_name,
+            seed=seed,
+            images=num_images,
+            encoding=encoding.__dict__,
+        )
+        cached = RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            diagnostics.cache = "hit"
+            return _image_response(cached, encoding, output_dir, diagnostics, timings)
+        diagnostics.cache = "miss"
+
+    # Near zero when the pipeline is already cached
+    with timings.stage("pipeline_load"):
+        pipeline = _load_pipeline(mode, model_id, device, dtype, quantize)
+    diagnostics.pipelines = {**PIPELINE_CACHE.stats(), "schedulers": SCHEDULER_POOL.stats()}
+
+    if seed is None and tier == "draft":
+        # Reported in diagnostics so a chosen draft can be finalized from its own seed
+        seed = diagnostics.seed = int.from_bytes(os.urandom(4), "big") >> 1
+        diagnostics.seeds = [seed + index for index in range(num_images)]
+
     try:
-        if mode == "txt2img":
-            result = pipeline(
-                prompt=prompt,
-                width=width,
-                height=height,
-                guidance_scale=guidance_scale,
-                num_inference_steps=steps,
-                generator=generator,
-                negative_prompt=payload.get("negative_prompt"),
-                num_images_per_prompt=num_images,
-            )
-        else:
-            init_images_payload = payload.get("init_images")
-            if not init_images_payload:
-                raise ValidationError("Image-to-image mode requires at least one base image.")
-            init_images = [_decode_base64_image(item) for item in init_images_payload]
-            strength = float(payload.get("strength", 0.6))
-            base_image = _combine_images(init_images)
-            result = pipeline(
-                prompt=prompt,
-                image=base_image,
-                strength=strength,
+        # Quantized linears take float32 activations, so int8 runs skip bf16 autocast
+        with SCHEDULER_POOL.checkout(
+            pipeline_key, mode, pipeline, scheduler_name
+        ) as pipeline, _inference_context(device, autocast=not quantize):
+            # Without the prompt cache this only passes the text through and encoding lands in denoise
+            with timings.stage("text_encode"):
+                prompt_kwargs = _prompt_kwargs(
+                    pipeline, model_id, pipeline_key[2], prompt, payload.get("negative_prompt"), guidance_scale
+                )
+            if PROMPT_CACHE is not None:
+                diagnostics.prompt_cache = PROMPT_CACHE.stats()
+
+            if mode == "txt2img":
+                call_kwargs: Dict[str, Any] = {"width": width, "height": height}
+                size = (width, height)
+            else:
+                init_images_payload = payload.get("init_images") or []
+                init_image_paths = payload.get("init_image_paths") or []
+                if not init_images_payload and not init_image_paths:
+                    raise ValidationError("Image-to-image mode requires at least one base image.")
+                with timings.stage("image_decode"):
+                    init_images = [_decode_base64_image(item) for item in init_images_payload]
+                    init_images.extend(_load_init_image(path) for path in init_image_paths)
+                # Finalizing a draft upscales it to the full-quality size; otherwise the first image sets it
+                size = (width, height) if payload.get("finalize") else init_images[0].size
+                if blend_mode == "latent":
+                    with timings.stage("vae_encode"):
+                        base_image = _encode_init_latents(pipeline, init_images, size, blend_weights)
+                else:
+                    with timings.stage("image_blend"):
+                        base_image = _combine_images(init_images, size, blend_weights)
+                strength = float(payload.get("strength", 0.6))
+                call_kwargs = {"image": base_image, "strength": strength}
+            call_kwargs.update(prompt_kwargs)
+            call_kwargs.update(
                 guidance_scale=guidance_scale,
                 num_inference_steps=steps,
-                generator=generator,
-                negative_prompt=payload.get("negative_prompt"),
-                num_images_per_prompt=num_images,
+                callback_on_step_end=timings.on_step_end,
             )
-
-        images = [_encode_png(image) for image in result.images]
-        return DiffusionResponse(success=True, images=images, diagnostics=diagnostics.__dict__)
+            with timings.stage("denoise"):
+                latents = _denoise_with_recovery(
+                    pipeline, (model_id, mode, *size), num_images, seed, call_kwargs, diagnostics
+                )
+            with timings.stage("vae_decode"):
+                images = _decode_latents(pipeline, latents)
+
+        with timings.stage("image_encode"):
+            encoded = [encode_image(image, encoding) for image in images]
+        if cache_key is not None:
+            RESULT_CACHE.put(cache_key, encoded)
+        return _image_response(encoded, encoding, output_dir, diagnostics, timings)
     except Exception as exc:  # noqa: BLE001
-        error_type = "vram" if _is_vram_error(exc) else "runtime"
+        if isinstance(exc, ValidationError):
+            error_type = "validation"
+        else:
+            error_type = "vram" if _is_vram_error(exc) else "runtime"
+        diagnostics.timings = timings.as_dict()
         diagnostics_dict = dict(diagnostics.__dict__)
         diagnostics_dict["trace"] = traceback.format_exc()
         return DiffusionResponse(success=False, error=str(exc), errorType=error_type, diagnostics=diagnostics_dict)
 
 
-def main() -> None:
+def _process_payload(raw_payload: str) -> DiffusionResponse:
+    timings = StageTimings()
     try:
-        raw_payload = sys.stdin.read()
         if not raw_payload.strip():
             raise ValidationError("No payload received from caller.")
-        payload = json.loads(raw_payload)
-        response = _handle_request(payload)
+        with timings.stage("request_decode"):
+            payload = json.loads(raw_payload)
+        if not isinstance(payload, dict):
+            raise ValidationError("Payload must be a JSON object.")
+        waiting = time.perf_counter()
+        with PIPELINE_LOCK:
+            timings.record("queue_wait", time.perf_counter() - waiting)
+            return _handle_request(payload, timings)
     except ValidationError as exc:
-        response = DiffusionResponse(success=False, error=str(exc), errorType="validation")
+        return DiffusionResponse(success=False, error=str(exc), errorType="validation")
     except json.JSONDecodeError as exc:
-        response = DiffusionResponse(success=False, error=f"Invalid JSON payload: {exc}", errorType="validation")
+        return DiffusionResponse(success=False, error=f"Invalid JSON payload: {exc}", errorType="validation")
     except Exception as exc:  # noqa: BLE001
-        response = DiffusionResponse(success=False, error=str(exc), errorType="runtime")
         traceback.print_exc(file=sys.stderr)
+        return DiffusionResponse(success=False, error=str(exc), errorType="runtime")
+
+
+def _extract_request_id(raw_payload: str) -> Any:
+    try:
+        payload = json.loads(raw_payload)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(payload, dict):
+        return payload.get("id", payload.get("request_id"))
+    return None
+
+
+def _serve_line(raw_line: str) -> Optional[str]:
+    if not raw_line.strip():
+        return None
+    response = dict(_process_payload(raw_line).__dict__)
+    response["id"] = _extract_request_id(raw_line)
+    return json.dumps(response)
+
+
+def _serve_stdio() -> None:
+    _log_debug("Diffusion runner serving newline-delimited JSON on stdin")
+    for raw_line in sys.stdin:
+        message = _serve_line(raw_line)
+        if message is None:
+            continue
+        sys.stdout.write(message + "\n")
+        sys.stdout.flush()
+
+
+class _RunnerRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for raw_line in self.rfile:
+            message = _serve_line(raw_line.decode("utf-8"))
+            if message is None:
+                continue
+            self.wfile.write((message + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _RunnerSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _serve_socket(path: str) -> None:
+    if os.path.exists(path):
+        os.unlink(path)
+    with _RunnerSocketServer(path, _RunnerRequestHandler) as server:
+        _log_debug(f"Diffusion runner listening on unix socket {path}")
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run Stable Diffusion pipelines for Aura Reflect.")
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the process alive and answer newline-delimited JSON requests, reusing warm pipelines.",
+    )
+    parser.add_argument(
+        "--preload",
+        action="append",
+        default=[],
+        metavar="MODEL_ID",
+        help="Load this txt2img model before serving the first request (repeatable; serve mode only).",
+    )
+    parser.add_argument(
+        "--socket",
+        help=(
+            "Serve requests over this Unix socket path instead of stdin/stdout (implies --serve). "
+            "With --serve alone, SD_RUNNER_SOCKET supplies the path."
+        ),
+    )
+    args = parser.parse_args(argv)
+    # One-shot invocations inherit the caller's environment, so the variable only applies to --serve
+    if args.socket is None and args.serve:
+        args.socket = os.environ.get("SD_RUNNER_SOCKET")
+    return args
+
+
+def _preload(model_ids: List[str]) -> None:
+    device = _select_device(DEFAULT_DEVICE)
+    dtype = _select_dtype(device, DEFAULT_PRECISION)
+    for model_id in model_ids:
+        try:
+            quantize = _wants_int8(device, DEFAULT_PRECISION)
+            with PIPELINE_LOCK:
+                _load_pipeline("txt2img", model_id, device, dtype, quantize)
+        except Exception as exc:  # noqa: BLE001
+            # Requests for this model retry the load and report the error to the caller
+            _log_debug(f"Failed to preload {model_id}: {exc}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    # Messages from aura_diffusion go to stderr next to _log_debug; stdout carries responses
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+
+    if args.preload and (args.serve or args.socket):
+        _preload(args.preload)
+
+    if args.socket:
+        _serve_socket(args.socket)
+        return
+    if args.serve:
+        _serve_stdio()
+        return
 
+    response = _process_payload(sys.stdin.read())
     sys.stdout.write(json.dumps(response.__dict__))
     sys.stdout.flush()
 
@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
-"""Utility script to pre-download Stable Diffusion model weights for offline use."""
+"""Utility script to pre-download Stable Diffusion model weights for offline use.
+
+Models land in ``<output-dir>/<org>_<name>`` and are recorded in ``<output-dir>/manifest.json``
+with every file's size and SHA-256, the dtypes stored in each safetensors file and the
+complete weight variants (e.g. ``fp16``). ``backend/app.py`` and ``scripts/diffusion_runner.py``
+resolve model ids against that manifest and load the local files without touching the network.
+"""
 
 import argparse
+import hashlib
+import json
 import os
+import struct
+import time
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 from huggingface_hub import snapshot_download
 
@@ -13,6 +24,11 @@ DEFAULT_MODELS = [
     "runwayml/stable-diffusion-v1-5",
 ]
 
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Checkpoint formats neither service loads (both load safetensors only)
+SKIPPED_FORMATS = ["*.bin", "*.ckpt", "*.pt", "*.pth", "*.msgpack", "*.h5", "*.onnx", "*.onnx_data", "*.tflite"]
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Download Stable Diffusion models to a local directory.")
@@ -24,7 +40,7 @@ def parse_args() -> argparse.Namespace:
     )
     parser.add_argument(
         "--output-dir",
-        default=os.environ.get("SD_MODELS_DIR", "models"),
+        default=os.environ.get("SD_MODELS_DIR", str(Path(__file__).resolve().parent.parent / "models")),
         help="Directory where the models should be stored.",
     )
     parser.add_argument(
@@ -32,9 +48,143 @@ def parse_args() -> argparse.Namespace:
         default=None,
         help="Optional model revision or branch to download.",
     )
+    parser.add_argument(
+        "--variant",
+        action="append",
+        default=[],
+        help="Also download a weight variant published on the hub, e.g. fp16 (can be repeated).",
+    )
+    parser.add_argument(
+        "--convert-fp16",
+        action="store_true",
+        help="Write fp16 copies of float32 safetensors files so fp16 loads memory-map them without a cast.",
+    )
+    parser.add_argument(
+        "--all-formats",
+        action="store_true",
+        help="Also download .bin/.ckpt/ONNX/Flax checkpoints (skipped by default).",
+    )
+    parser.add_argument(
+        "--manifest-only",
+        action="store_true",
+        help="Skip downloading and rebuild the manifest entries of already downloaded models.",
+    )
     return parser.parse_args()
 
 
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _safetensors_dtypes(path: Path) -> List[str]:
+    """Tensor dtypes recorded in a safetensors header, read without loading any weights."""
+    with path.open("rb") as handle:
+        (length,) = struct.unpack("<Q", handle.read(8))
+        header = json.loads(handle.read(length))
+    return sorted({info["dtype"] for name, info in header.items() if name != "__metadata__"})
+
+
+def _weight_variant(path: Path) -> Optional[str]:
+    """``fp16`` for ``model.fp16.safetensors`` (or a ``model.fp16-00001-of-00002`` shard), else None."""
+    parts = path.name.split(".")
+    if len(parts) < 3 or parts[-1] != "safetensors":
+        return None
+    variant = parts[-2].split("-")[0]
+    return None if variant.isdigit() else variant
+
+
+def _weight_files(model_dir: Path) -> List[Path]:
+    """Safetensors files ``from_pretrained`` reads: per component for diffusers layouts.
+
+    Diffusers repos often also ship single-file checkpoints at the top level; those are
+    recorded in the manifest but never loaded, converted or counted for variants.
+    """
+    diffusers_layout = (model_dir / "model_index.json").exists()
+    return [
+        path
+        for path in sorted(model_dir.rglob("*.safetensors"))
+        if path.relative_to(model_dir).parts[0] != ".cache" and not (diffusers_layout and path.parent == model_dir)
+    ]
+
+
+def _convert_fp16(model_dir: Path) -> None:
+    """Write ``<name>.fp16.safetensors`` beside every float32 weight file that has no fp16 copy yet."""
+    import torch
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+
+    for path in _weight_files(model_dir):
+        if _weight_variant(path) is not None:
+            continue
+        if "-of-" in path.stem:
+            print(f"  skipping sharded checkpoint {path.relative_to(model_dir)}")
+            continue
+        target = path.with_name(f"{path.stem}.fp16.safetensors")
+        if target.exists() or "F32" not in _safetensors_dtypes(path):
+            continue
+        with safe_open(str(path), framework="pt") as handle:
+            metadata = handle.metadata()
+            tensors = {
+                name: tensor.half() if tensor.dtype == torch.float32 else tensor
+                for name, tensor in ((name, handle.get_tensor(name)) for name in handle.keys())
+            }
+        tmp = target.with_name(target.name + ".tmp")
+        save_file(tensors, str(tmp), metadata=metadata)
+        os.replace(tmp, target)
+        print(f"  wrote {target.relative_to(model_dir)}")
+
+
+def _complete_variants(model_dir: Path, weights: List[Path]) -> List[str]:
+    """Variants present for every component that has weights, i.e. safe to pass as ``variant=``."""
+    components: Dict[Path, set] = {}
+    for path in weights:
+        variants = components.setdefault(path.parent, set())
+        variant = _weight_variant(path)
+        if variant is not None:
+            variants.add(variant)
+    if not components:
+        return []
+    return sorted(set.intersection(*components.values()))
+
+
+def build_manifest_entry(model: str, model_dir: Path, revision: Optional[str]) -> Dict[str, Any]:
+    files: Dict[str, Dict[str, Any]] = {}
+    for path in sorted(model_dir.rglob("*")):
+        relative = path.relative_to(model_dir)
+        if not path.is_file() or relative.parts[0] == ".cache" or path.name.endswith(".tmp"):
+            continue
+        info: Dict[str, Any] = {"size": path.stat().st_size, "sha256": _sha256(path)}
+        if path.suffix == ".safetensors":
+            info["dtypes"] = _safetensors_dtypes(path)
+        files[relative.as_posix()] = info
+    weights = _weight_files(model_dir)
+    if not weights:
+        print(f"  warning: {model} has no safetensors weights; re-run with --all-formats or pick another repo")
+    return {
+        "path": model_dir.name,
+        "revision": revision,
+        "created": int(time.time()),
+        "variants": _complete_variants(model_dir, weights),
+        "files": files,
+    }
+
+
+def write_manifest(output_dir: Path, entries: Dict[str, Dict[str, Any]]) -> None:
+    """Merge ``entries`` into the store manifest, replacing it atomically."""
+    path = output_dir / MANIFEST_NAME
+    manifest: Dict[str, Any] = {"version": MANIFEST_VERSION, "models": {}}
+    if path.exists():
+        manifest["models"] = json.loads(path.read_text()).get("models", {})
+    manifest["models"].update(entries)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp, path)
+
+
 def main() -> None:
     args = parse_args()
     targets = args.model or DEFAULT_MODELS
@@ -42,11 +192,29 @@ def main() -> None:
     output_dir = Path(args.output_dir).expanduser().resolve()
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    ignore_patterns = [] if args.all_formats else list(SKIPPED_FORMATS)
+    # Hub variants are extra copies of every weight; only fetch the ones asked for
+    ignore_patterns.extend(f"*.{variant}.*" for variant in ("fp16", "non_ema", "ema_only") if variant not in args.variant)
+
+    entries = {}
     for model in targets:
-        print(f"Downloading {model} ...")
-        snapshot_download(repo_id=model, local_dir=output_dir / model.replace('/', '_'), revision=args.revision)
+        model_dir = output_dir / model.replace('/', '_')
+        if not args.manifest_only:
+            print(f"Downloading {model} ...")
+            snapshot_download(
+                repo_id=model, local_dir=model_dir, revision=args.revision, ignore_patterns=ignore_patterns
+            )
+        elif not model_dir.is_dir():
+            print(f"Skipping {model}: {model_dir} does not exist")
+            continue
+        if args.convert_fp16:
+            print(f"Converting {model} to fp16 ...")
+            _convert_fp16(model_dir)
+        print(f"Hashing {model} ...")
+        entries[model] = build_manifest_entry(model, model_dir, args.revision)
 
-    print("Download complete.")
+    write_manifest(output_dir, entries)
+    print(f"Download complete. Manifest: {output_dir / MANIFEST_NAME}")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,66 @@
+import importlib.util
+import os
+import time
+from pathlib import Path
+from typing import Any
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+DEFAULT_MODEL_ID = "stabilityai/sdxl-turbo"
+MODEL_ID = os.environ.get("DIFFUSERS_MODEL_ID", DEFAULT_MODEL_ID)
+MODEL_OVERRIDE_PATH = os.environ.get("DIFFUSERS_MODEL_PATH")
+REQUIRED_PACKAGES = ("torch", "diffusers", "transformers", "safetensors", "huggingface_hub")
 
 app = FastAPI(title="Aura Reflect Image Service")
+STARTED_AT = time.time()
+
+
+def _check_packages() -> dict[str, Any]:
+    missing = [name for name in REQUIRED_PACKAGES if importlib.util.find_spec(name) is None]
+    return {"ok": not missing, "missing": missing}
+
+
+def _check_model() -> dict[str, Any]:
+    """The configured model must be on local disk; a hub download on first use is not ready."""
+    if MODEL_OVERRIDE_PATH:
+        ok = (Path(MODEL_OVERRIDE_PATH) / "model_index.json").is_file()
+        return {"ok": ok, "source": MODEL_OVERRIDE_PATH, "detail": None if ok else "model_index.json not found"}
+
+    try:
+        from huggingface_hub import try_to_load_from_cache
+    except ImportError:
+        # Reported by the packages check too; the cache cannot be inspected without it
+        return {"ok": False, "source": MODEL_ID, "detail": "huggingface_hub is not installed"}
+
+    ok = isinstance(try_to_load_from_cache(MODEL_ID, "model_index.json"), str)
+    return {"ok": ok, "source": MODEL_ID, "detail": None if ok else "not in the local Hugging Face cache"}
+
+
+def _checks() -> tuple[bool, dict[str, Any]]:
+    checks = {"packages": _check_packages(), "model": _check_model()}
+    return all(check["ok"] for check in checks.values()), checks
+
+
+@app.get("/live", summary="Liveness probe")
+def liveness() -> dict[str, str]:
+    """The process is up and serving requests."""
+    return {"status": "alive"}
+
+
+@app.get("/ready", summary="Readiness probe")
+def readiness() -> JSONResponse:
+    """503 until the inference packages are installed and the model is available locally."""
+    ready, checks = _checks()
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks})
 
 
 @app.get("/health", summary="Health check endpoint")
-def health_check() -> dict[str, str]:
-    """Simple health check endpoint."""
-    return {"status": "ok"}
+def health_check() -> dict[str, Any]:
+    """Readiness checks plus uptime, for monitoring; always 200, failing checks are in the body."""
+    ready, checks = _checks()
+    return {
+        "status": "ok" if ready else "unavailable",
+        "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        "checks": checks,
+    }
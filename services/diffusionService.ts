@@ -14,6 +14,9 @@ const ASPECT_RATIO_DIMENSIONS: Record<string, { width: number; height: number }>
 const DEFAULT_GUIDANCE = 6.5;
 const DEFAULT_STEPS = 30;
 const DEFAULT_IMG2IMG_STRENGTH = 0.6;
+// Drafts render at half the full-quality size; finalizing upscales the chosen one
+const DRAFT_SCALE = 0.5;
+const FINALIZE_STRENGTH = 0.6;
 const PYTHON_MODULE_PATH = '../scripts/diffusion_runner.py';
 
 const DEFAULT_TEXT_MODEL = process.env.SD_MODEL_ID ?? 'stabilityai/stable-diffusion-xl-base-1.0';
@@ -34,18 +37,26 @@ interface DiffusionRunnerRequest {
   num_inference_steps: number;
   precision: string;
   device: string;
-  output_format: 'png';
+  output_format: 'png' | 'webp' | 'jpeg';
+  quality?: number;
+  compress_level?: number;
   num_images?: number;
   negative_prompt?: string;
   scheduler?: string;
   strength?: number;
   init_images?: string[];
+  init_image_weights?: number[];
+  blend_mode?: 'pixel' | 'latent';
   seed?: number;
+  tier?: 'full' | 'draft';
+  finalize?: boolean;
 }
 
 interface DiffusionRunnerSuccess {
   success: true;
   images: string[];
+  paths?: string[];
+  mimeType?: string;
   diagnostics?: DiffusionDiagnostics;
 }
 
@@ -69,6 +80,30 @@ interface DiffusionDiagnostics {
   images?: number;
   errorType?: string;
   runnerMessage?: string;
+  cache?: 'hit' | 'miss';
+  prompt_cache?: { hits: number; misses: number; entries: number };
+  pipelines?: {
+    loaded: string[];
+    resident_mb: number;
+    loads: number;
+    evictions: number;
+    schedulers: { created: number; reused: number };
+  };
+  cpu_profile?: {
+    threads: number;
+    interop_threads: number;
+    channels_last: boolean;
+    torch_compile: boolean;
+    bf16_autocast: boolean;
+  };
+  downgrades?: string[];
+  // Seconds per stage (queue_wait, pipeline_load, text_encode, denoise, vae_decode, image_encode, base64, ...)
+  // plus denoise_steps / denoise_step_mean / denoise_step_max
+  timings?: Record<string, number>;
+  tier?: 'full' | 'draft';
+  seed?: number | null;
+  // One seed per image (seed + index) for seeded and draft requests
+  seeds?: number[] | null;
 }
 
 class DiffusionGenerationError extends Error {
@@ -167,6 +202,7 @@ const runDiffusion = async (payload: DiffusionRunnerRequest): Promise<DiffusionR
         resolve({
           success: true,
           images: parsed.images,
+          paths: parsed.paths,
           diagnostics: parsed.diagnostics,
         });
         return;
@@ -221,6 +257,72 @@ export const generateInitialImages = async (
   return response.images;
 };
 
+const roundToMultipleOf8 = (value: number): number => Math.max(8, Math.round(value / 8) * 8);
+
+export const generateDraftImages = async (
+  prompt: string,
+  aspectRatio: string,
+): Promise<{ images: string[]; seeds: number[] }> => {
+  const { width, height } = resolveDimensions(aspectRatio);
+
+  const requestPayload: DiffusionRunnerRequest = {
+    mode: 'txt2img',
+    model_id: DEFAULT_TEXT_MODEL,
+    prompt,
+    width: roundToMultipleOf8(width * DRAFT_SCALE),
+    height: roundToMultipleOf8(height * DRAFT_SCALE),
+    // The runner picks the draft model, step count and guidance for this tier
+    guidance_scale: 0,
+    num_inference_steps: DEFAULT_STEPS,
+    precision: DEFAULT_PRECISION,
+    device: DEFAULT_DEVICE,
+    output_format: 'png',
+    num_images: 2,
+    tier: 'draft',
+  };
+
+  const response = await runDiffusion(requestPayload);
+  // Finalize a chosen draft with seeds[index], the seed its noise came from
+  const seeds = response.diagnostics?.seeds;
+  if (!Array.isArray(seeds) || seeds.length !== response.images.length) {
+    throw new DiffusionGenerationError('Diffusion runner did not report the draft seeds.', response.diagnostics);
+  }
+  return { images: response.images, seeds };
+};
+
+// `seed` is the chosen draft's entry in the seeds returned by generateDraftImages
+export const finalizeDraft = async (
+  draftImage: string,
+  prompt: string,
+  aspectRatio: string,
+  seed: number,
+  temperature: number,
+): Promise<string> => {
+  const { width, height } = resolveDimensions(aspectRatio);
+
+  const requestPayload: DiffusionRunnerRequest = {
+    mode: 'img2img',
+    model_id: DEFAULT_TEXT_MODEL,
+    prompt,
+    width,
+    height,
+    guidance_scale: normalizeTemperature(temperature),
+    num_inference_steps: DEFAULT_STEPS,
+    precision: DEFAULT_PRECISION,
+    device: DEFAULT_DEVICE,
+    output_format: 'png',
+    num_images: 1,
+    strength: FINALIZE_STRENGTH,
+    scheduler: process.env.SD_SCHEDULER,
+    init_images: [sanitizeDataUrl(draftImage)],
+    seed,
+    finalize: true,
+  };
+
+  const response = await runDiffusion(requestPayload);
+  return response.images[0];
+};
+
 export const refineImages = async (
   baseImages: string[],
   refinePrompt: string,
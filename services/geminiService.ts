@@ -1 +1 @@
-export { generateInitialImages, refineImages } from './diffusionService';
+export { finalizeDraft, generateDraftImages, generateInitialImages, refineImages } from './diffusionService';
@@ -0,0 +1,15 @@
+"""Shared fixtures: every test runs offline against the tiny random pipeline from ``benchmark --tiny``."""
+
+import os
+
+import pytest
+
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory) -> str:
+    """Directory of a tiny Stable Diffusion pipeline with random weights (built once per session)."""
+    from benchmark import build_tiny_pipeline
+
+    return str(build_tiny_pipeline(tmp_path_factory.mktemp("tiny-sd")))
@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import importlib
+import io
+
+import pytest
+from httpx import ASGITransport, AsyncClient
+from PIL import Image
+
+
+@pytest.fixture(scope="module")
+def backend(tiny_model, tmp_path_factory):
+    """backend/app.py serving the tiny pipeline in-process, with its settings read from the environment on import."""
+    state = tmp_path_factory.mktemp("backend")
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in {
+            "AURA_MODELS": tiny_model,
+            "AURA_PRELOAD_MODELS": "",
+            "AURA_WARMUP": "0",
+            "AURA_DRAFT_MODEL": "",
+            "AURA_MODEL_STORE_DIR": str(state / "models"),
+            "AURA_JOBS_DIR": str(state / "jobs"),
+            "AURA_WORKER_PROCESSES": "0",
+            "AURA_RESULT_CACHE": "0",
+            "AURA_BATCH_WINDOW_MS": "200",
+            "AURA_MAX_BATCH_IMAGES": "8",
+        }.items():
+            patch.setenv(name, value)
+        yield importlib.import_module("app")
+
+
+@pytest.fixture
+def pipeline_calls(backend, monkeypatch):
+    """Prompt lists of the pipeline calls the batch scheduler makes during a test."""
+    calls = []
+    generate_batch = backend._generate_batch
+
+    def recording_generate_batch(model_id, prompts, *args, **kwargs):
+        calls.append(list(prompts))
+        return generate_batch(model_id, prompts, *args, **kwargs)
+
+    monkeypatch.setattr(backend, "_generate_batch", recording_generate_batch)
+    return calls
+
+
+def _serve(backend, scenario):
+    async def main():
+        transport = ASGITransport(app=backend.app)
+        async with AsyncClient(transport=transport, base_url="http://test", timeout=600) as client:
+            return await scenario(client)
+
+    return asyncio.run(main())
+
+
+def _request(prompt, **extra):
+    return {"prompt": prompt, "aspectRatio": "1:1", "temperature": 1, **extra}
+
+
+def test_concurrent_requests_share_one_pipeline_call(backend, pipeline_calls):
+    async def scenario(client):
+        return await asyncio.gather(
+            client.post("/generate", json=_request("a red fox", seed=1)),
+            client.post("/generate", json=_request("a blue whale", seed=2)),
+        )
+
+    fox, whale = _serve(backend, scenario)
+    assert fox.status_code == whale.status_code == 200
+    assert sorted(map(sorted, pipeline_calls)) == [["a blue whale", "a red fox"]]
+    assert len(fox.json()["images"]) == len(whale.json()["images"]) == backend.NUM_IMAGES
+    assert set(fox.json()["images"]).isdisjoint(whale.json()["images"])
+
+
+def test_duplicate_requests_attach_to_the_running_generation(backend, pipeline_calls):
+    before = backend.request_coalescer.coalesced
+
+    async def scenario(client):
+        return await asyncio.gather(*(client.post("/generate", json=_request("a quiet harbour")) for _ in range(2)))
+
+    first, second = _serve(backend, scenario)
+    assert first.status_code == second.status_code == 200
+    assert pipeline_calls == [["a quiet harbour"]]
+    assert first.json()["images"] == second.json()["images"]
+    assert backend.request_coalescer.coalesced == before + 1
+
+
+def test_idempotency_key_replays_the_result(backend, pipeline_calls):
+    async def scenario(client):
+        headers = {"Idempotency-Key": "moodboard-42"}
+        first = await client.post("/generate", json=_request("misty pines"), headers=headers)
+        replay = await client.post("/generate", json=_request("misty pines"), headers=headers)
+        reused = await client.post("/generate", json=_request("desert dunes"), headers=headers)
+        return first, replay, reused
+
+    first, replay, reused = _serve(backend, scenario)
+    assert first.status_code == replay.status_code == 200
+    # Unseeded, so only the key makes the second request get the same images
+    assert replay.json()["images"] == first.json()["images"]
+    assert pipeline_calls == [["misty pines"]]
+    assert reused.status_code == 422
+
+
+def test_job_runs_to_completion(backend):
+    async def scenario(client):
+        created = await client.post("/jobs", json=_request("a lighthouse", seed=7))
+        assert created.status_code == 202
+        status_url = created.json()["statusUrl"]
+        while True:
+            job = (await client.get(status_url)).json()
+            if job["status"] not in ("queued", "running"):
+                break
+            await asyncio.sleep(0.1)
+        image = await client.get(job["imageUrls"][0])
+        cancel = await client.post(f"{status_url}/cancel")
+        missing = await client.get("/jobs/does-not-exist")
+        return job, image, cancel, missing
+
+    job, image, cancel, missing = _serve(backend, scenario)
+    assert job["status"] == "succeeded"
+    assert job["mimeType"] == "image/png"
+    assert len(job["images"]) == backend.NUM_IMAGES
+    assert image.status_code == 200
+    assert base64.b64decode(job["images"][0]) == image.content
+    assert Image.open(io.BytesIO(image.content)).size == backend.ASPECT_RATIO_DIMENSIONS["1:1"]
+    # Cancelling a finished job leaves it as it was
+    assert cancel.json()["status"] == "succeeded"
+    assert missing.status_code == 404
+
+
+def test_job_cancelled_before_it_runs(backend):
+    async def scenario(client):
+        job_id = (await client.post("/jobs", json=_request("a storm at sea"))).json()["id"]
+        cancelling = (await client.post(f"/jobs/{job_id}/cancel")).json()
+        while True:
+            job = (await client.get(f"/jobs/{job_id}")).json()
+            if job["status"] not in ("queued", "running", "cancelling"):
+                return cancelling, job
+            await asyncio.sleep(0.1)
+
+    cancelling, job = _serve(backend, scenario)
+    assert cancelling["status"] == "cancelling"
+    assert job["status"] == "cancelled"
+    assert "images" not in job
+
+
+def test_job_store_lifecycle(backend, tmp_path):
+    store = backend.JobStore(str(tmp_path), retention_seconds=0)
+    job_id = store.create("generate", {"prompt": "a lighthouse"})
+    assert store.get(job_id)["status"] == "queued"
+
+    # A restarted process finds the job still queued, with the payload it needs to resubmit it
+    restarted = backend.JobStore(str(tmp_path), retention_seconds=0)
+    assert restarted.unfinished() == [(job_id, "generate", {"prompt": "a lighthouse"})]
+
+    restarted.finish(job_id, "succeeded", images=[b"first", b"second"], mime_type="image/png")
+    job = restarted.get(job_id)
+    assert (job["status"], job["images"], job["mime_type"]) == ("succeeded", 2, "image/png")
+    assert restarted.image(job_id, 1) == b"second"
+    assert restarted.unfinished() == []
+
+    assert restarted.purge() == 1
+    assert restarted.get(job_id) is None
+    assert restarted.image(job_id, 0) is None
@@ -0,0 +1,69 @@
+import os
+import time
+
+import torch
+
+from aura_diffusion import PromptEmbeddingCache, ResultCache
+
+
+def test_result_cache_memory_tier_is_bounded_by_bytes():
+    cache = ResultCache(10, None, 0, 0)
+    cache.put("a", [b"12345"])
+    cache.put("b", [b"123", b"45"])
+    assert cache.get("a") == [b"12345"]
+    # "b" is now the least recently used entry
+    cache.put("c", [b"12345"])
+    assert cache.get("b") is None
+    assert cache.get("a") == [b"12345"]
+    assert cache.get("c") == [b"12345"]
+    # Results larger than the whole budget are never kept
+    cache.put("d", [b"x" * 11])
+    assert cache.get("d") is None
+    assert cache.stats()["memory_bytes"] == 10
+
+
+def test_result_cache_disk_tier_survives_restart(tmp_path):
+    ResultCache(1024, str(tmp_path), 1024, 0).put("key", [b"first", b"second"])
+    restarted = ResultCache(1024, str(tmp_path), 1024, 0)
+    assert restarted.get("key") == [b"first", b"second"]
+    assert restarted.stats()["memory_entries"] == 1
+
+
+def test_result_cache_disk_tier_expires_and_evicts(tmp_path):
+    cache = ResultCache(0, str(tmp_path), 10, 60)
+    cache.put("old", [b"12345"])
+    stale = time.time() - 120
+    os.utime(tmp_path / "old", (stale, stale))
+    assert cache.get("old") is None
+    assert not (tmp_path / "old").exists()
+
+    cache.put("a", [b"123456"])
+    cache.put("b", [b"123456"])
+    assert cache.get("a") is None
+    assert cache.get("b") == [b"123456"]
+
+
+def test_result_cache_key_is_order_independent():
+    assert ResultCache.make_key(prompt="p", seed=1) == ResultCache.make_key(seed=1, prompt="p")
+    assert ResultCache.make_key(prompt="p", seed=1) != ResultCache.make_key(prompt="p", seed=2)
+
+
+def test_prompt_embedding_cache_encodes_once_per_key():
+    cache = PromptEmbeddingCache(2)
+    encoded = []
+
+    def encoder(text):
+        def encode():
+            encoded.append(text)
+            return torch.zeros(1), None
+
+        return encode
+
+    first = cache.get_or_encode(("model", "float32", "a"), encoder("a"))
+    assert cache.get_or_encode(("model", "float32", "a"), encoder("a")) is first
+    cache.get_or_encode(("model", "float32", "b"), encoder("b"))
+    cache.get_or_encode(("model", "float32", "c"), encoder("c"))
+    # "a" was evicted as the least recently used entry
+    cache.get_or_encode(("model", "float32", "a"), encoder("a"))
+    assert encoded == ["a", "b", "c", "a"]
+    assert cache.stats() == {"hits": 1, "misses": 4, "entries": 2}
@@ -0,0 +1,80 @@
+import json
+import shutil
+
+import pytest
+import torch
+from diffusers import StableDiffusionPipeline
+
+import aura_diffusion.store
+from aura_diffusion import ModelStore
+from download_models import build_manifest_entry, write_manifest
+
+TINY_MODEL_ID = "aura-tests/tiny-sd"
+UNET_WEIGHTS = "unet/diffusion_pytorch_model.safetensors"
+
+
+@pytest.fixture
+def model_store(tmp_path, tiny_model):
+    """A store holding a copy of the tiny pipeline, laid out the way download_models.py writes it."""
+    root = tmp_path / "store"
+    model_dir = root / TINY_MODEL_ID.replace("/", "_")
+    shutil.copytree(tiny_model, model_dir)
+    write_manifest(root, {TINY_MODEL_ID: build_manifest_entry(TINY_MODEL_ID, model_dir, revision=None)})
+    return root
+
+
+def test_manifest_records_sizes_checksums_and_dtypes(model_store):
+    manifest = json.loads((model_store / "manifest.json").read_text())
+    entry = manifest["models"][TINY_MODEL_ID]
+    weights = model_store / entry["path"] / UNET_WEIGHTS
+    assert entry["files"][UNET_WEIGHTS]["size"] == weights.stat().st_size
+    assert len(entry["files"][UNET_WEIGHTS]["sha256"]) == 64
+    assert entry["files"][UNET_WEIGHTS]["dtypes"] == ["F32"]
+    assert "dtypes" not in entry["files"]["model_index.json"]
+
+
+def test_resolve_loads_the_stored_copy_offline(model_store):
+    store = ModelStore(str(model_store))
+    source, kwargs = store.resolve(TINY_MODEL_ID, torch.float32)
+    assert source == str(model_store / TINY_MODEL_ID.replace("/", "_"))
+    assert kwargs == {"local_files_only": True, "use_safetensors": True}
+    StableDiffusionPipeline.from_pretrained(source, **kwargs)
+
+
+def test_models_outside_the_store_pass_through(model_store):
+    assert ModelStore(str(model_store)).resolve("someone/other-model", torch.float32) == ("someone/other-model", {})
+
+
+def test_verified_files_are_not_hashed_again(model_store, monkeypatch):
+    ModelStore(str(model_store)).resolve(TINY_MODEL_ID, torch.float32)
+    assert (model_store / ModelStore.VERIFIED_NAME).exists()
+
+    def no_hashing(*args, **kwargs):
+        raise AssertionError("verified files were hashed again")
+
+    # A restarted process (or another worker) trusts .verified.json while sizes and mtimes match
+    monkeypatch.setattr(aura_diffusion.store.hashlib, "sha256", no_hashing)
+    ModelStore(str(model_store)).resolve(TINY_MODEL_ID, torch.float32)
+
+
+def test_corrupt_weights_are_refused_until_replaced(model_store):
+    weights = model_store / TINY_MODEL_ID.replace("/", "_") / UNET_WEIGHTS
+    original = weights.read_bytes()
+    # Same size, so only the checksum can tell
+    weights.write_bytes(original[:-1] + bytes([original[-1] ^ 0xFF]))
+    store = ModelStore(str(model_store))
+    with pytest.raises(RuntimeError, match="checksum"):
+        store.resolve(TINY_MODEL_ID, torch.float32)
+    with pytest.raises(RuntimeError, match="checksum"):
+        store.resolve(TINY_MODEL_ID, torch.float32)
+    assert store.stats()["models"][TINY_MODEL_ID]["state"] == "corrupt"
+
+    weights.write_bytes(original)
+    store.resolve(TINY_MODEL_ID, torch.float32)
+
+
+def test_truncated_weights_are_refused(model_store):
+    weights = model_store / TINY_MODEL_ID.replace("/", "_") / UNET_WEIGHTS
+    weights.write_bytes(weights.read_bytes()[:100])
+    with pytest.raises(RuntimeError, match="download it again"):
+        ModelStore(str(model_store)).resolve(TINY_MODEL_ID, torch.float32)
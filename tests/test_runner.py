@@ -0,0 +1,189 @@
+import base64
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from diffusers import StableDiffusionPipeline
+from PIL import Image
+
+import diffusion_runner as runner
+from aura_diffusion import OomRecovery, ResultCache
+
+RUNNER = Path(runner.__file__).resolve()
+
+
+def _payload(model, **overrides):
+    payload = {
+        "prompt": "a red fox",
+        "model_id": model,
+        "device": "cpu",
+        "width": 64,
+        "height": 64,
+        "num_inference_steps": 2,
+        "num_images": 2,
+        "seed": 3,
+    }
+    payload.update(overrides)
+    return payload
+
+
+def _pixels(data_url):
+    return np.asarray(Image.open(io.BytesIO(base64.b64decode(data_url.split(",", 1)[-1]))), dtype=np.int16)
+
+
+def _run(payload):
+    return runner._process_payload(json.dumps(payload)).__dict__
+
+
+@pytest.fixture
+def result_cache(monkeypatch):
+    cache = ResultCache(64 * 1024 ** 2, None, 0, 0)
+    monkeypatch.setattr(runner, "RESULT_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def init_image(tmp_path):
+    path = tmp_path / "init.png"
+    Image.new("RGB", (64, 64), (200, 40, 40)).save(path)
+    return str(path)
+
+
+def test_result_cache_key_covers_strength_for_image_paths(init_image):
+    payload = {"prompt": "p", "init_image_paths": [init_image]}
+    low = runner._result_cache_key({**payload, "strength": 0.3}, seed=1)
+    high = runner._result_cache_key({**payload, "strength": 0.9}, seed=1)
+    assert low != high
+
+
+def test_result_cache_key_does_not_join_image_lists():
+    assert runner._result_cache_key({"prompt": "p", "init_images": ["ab", "c"]}) != runner._result_cache_key(
+        {"prompt": "p", "init_images": ["a", "bc"]}
+    )
+
+
+def test_unreadable_init_image_path_is_a_validation_error(tiny_model, result_cache, tmp_path):
+    response = _run(_payload(tiny_model, mode="img2img", init_image_paths=[str(tmp_path / "missing.png")]))
+    assert response["success"] is False
+    assert response["errorType"] == "validation"
+
+
+def test_cached_img2img_results_depend_on_strength(tiny_model, result_cache, init_image):
+    payload = _payload(tiny_model, mode="img2img", init_image_paths=[init_image], num_inference_steps=4)
+    low = _run({**payload, "strength": 0.3})
+    high = _run({**payload, "strength": 0.9})
+    assert low["diagnostics"]["cache"] == high["diagnostics"]["cache"] == "miss"
+    assert low["images"] != high["images"]
+
+    repeat = _run({**payload, "strength": 0.3})
+    assert repeat["diagnostics"]["cache"] == "hit"
+    assert repeat["images"] == low["images"]
+
+
+def test_seed_must_be_an_integer(tiny_model):
+    response = _run(_payload(tiny_model, seed="abc"))
+    assert response["success"] is False
+    assert response["errorType"] == "validation"
+    assert response["error"] == "seed must be an integer."
+
+
+def test_out_of_memory_ladder_keeps_seeded_images(tiny_model, monkeypatch):
+    monkeypatch.setattr(runner, "OOM_RECOVERY", OomRecovery())
+    payload = _payload(tiny_model, num_images=4)
+    baseline = _run(payload)
+    assert baseline["success"], baseline["error"]
+
+    original = StableDiffusionPipeline.__call__
+    calls = []
+    pipelines = []
+
+    def flaky_call(self, *args, **kwargs):
+        calls.append(kwargs["num_images_per_prompt"])
+        pipelines.append(self)
+        # Fail the first full batch, then the second run of two, which drops to one image per call
+        if len(calls) in (1, 3):
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(StableDiffusionPipeline, "__call__", flaky_call)
+    recovered = _run(payload)
+
+    assert recovered["success"], recovered["error"]
+    assert recovered["diagnostics"]["downgrades"] == ["split into runs of 2 image(s)", "split into runs of 1 image(s)"]
+    assert calls == [4, 2, 2, 1, 1, 1, 1]
+    # Per-image generators make the split runs reproduce the unsplit batch
+    assert recovered["images"] == baseline["images"]
+    assert runner.OOM_RECOVERY.safe_batch((tiny_model, "txt2img", 64, 64)) == 1
+
+    # Attention slicing is the next rung; it must not outlive the call that needed it
+    calls.clear()
+
+    def out_of_memory_once_per_image(self, *args, **kwargs):
+        calls.append(kwargs["num_images_per_prompt"])
+        pipelines.append(self)
+        if len(calls) == 1:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return original(self, *args, **kwargs)
+
+    monkeypatch.setattr(StableDiffusionPipeline, "__call__", out_of_memory_once_per_image)
+    sliced = _run(payload)
+    assert sliced["diagnostics"]["downgrades"] == ["split into runs of 1 image(s) (learned)", "attention slicing"]
+    # Sliced attention only reorders the float math, so the same noise gives nearly the same pixels
+    for image, expected in zip(sliced["images"], baseline["images"]):
+        assert np.abs(_pixels(image) - _pixels(expected)).mean() < 4
+    processors = {type(processor).__name__ for processor in pipelines[-1].unet.attn_processors.values()}
+    assert not any("Sliced" in name for name in processors)
+
+
+def _request(sock, payload):
+    sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+    buffer = b""
+    while not buffer.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        assert chunk, "runner closed the connection"
+        buffer += chunk
+    return json.loads(buffer)
+
+
+def test_serve_socket_reuses_the_loaded_pipeline(tiny_model, tmp_path):
+    path = str(tmp_path / "runner.sock")
+    env = {**os.environ, "SD_MODELS_DIR": str(tmp_path / "models"), "PYTHONPATH": str(RUNNER.parent.parent)}
+    log = (tmp_path / "runner.log").open("wb")
+    process = subprocess.Popen(
+        [sys.executable, str(RUNNER), "--socket", path, "--preload", tiny_model],
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=log,
+    )
+    try:
+        deadline = time.monotonic() + 120
+        while not os.path.exists(path):
+            assert process.poll() is None, (tmp_path / "runner.log").read_text()
+            assert time.monotonic() < deadline, "runner did not open its socket"
+            time.sleep(0.1)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            first = _request(sock, {**_payload(tiny_model), "id": "one"})
+            second = _request(sock, {**_payload(tiny_model, prompt="a blue fox"), "id": "two"})
+            invalid = _request(sock, {"id": "three", "prompt": ""})
+        assert (first["id"], second["id"], invalid["id"]) == ("one", "two", "three")
+        assert first["success"] and second["success"]
+        assert len(second["images"]) == 2
+        # Preloaded once; neither request loaded the model again
+        assert second["diagnostics"]["pipelines"]["loads"] == 1
+        assert invalid["errorType"] == "validation"
+    finally:
+        # SIGINT stops serve_forever() so the runner removes its socket
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=30)
+        log.close()
+    assert not os.path.exists(path)